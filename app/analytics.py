@@ -0,0 +1,236 @@
+"""
+Vectorized sales analytics over an in-memory, columnar snapshot of ``Sale``.
+
+The snapshot keeps one NumPy array per column. It is refreshed incrementally:
+sales are only ever appended with increasing ids, so new rows are found with
+an ``id > watermark`` query, on each database holding sales (see
+``app.sharding``). Updates, deletes and moves of sales advance the rewrites
+of their database (``SaleVersion``, see ``app.rollups``), committed with
+them: every worker then notices them, and loads a new snapshot of the whole
+table, while its other threads go on reading the current one.
+
+The watermark assumes sales are committed in id order, which holds on SQLite
+where writes are serialized. With concurrent writers a sale committed after
+one with a higher id is only picked up by the next full reload.
+
+It serves /sale_statistics/distribution/ only. The figures of
+/sale_statistics/ (averages, highest sale, top products) are read from the
+rollups kept up to date with every write (see ``app.rollups``), a few rows
+per request whatever the number of sales: reducing the snapshot would be
+slower, and cost each worker the memory and the loads of the table.
+
+NumPy is optional; ``available()`` tells whether this module can be used.
+"""
+
+import threading
+
+from django.conf import settings
+
+import app.models as models
+import app.sharding as sharding
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+PERCENTILES = (50, 90, 99)
+
+
+def available():
+    return np is not None
+
+
+class SaleSnapshot:
+    def __init__(self, rewrites=None):
+        # The rewrites of each database the snapshot was loaded after
+        self.rewrites = rewrites or {}
+        # Held while reading, and while new rows are swapped in, so readers
+        # never see the columns of different refreshes.
+        self.lock = threading.RLock()
+        # Held while new rows are loaded
+        self._refresh_lock = threading.Lock()
+        # Highest id loaded, per database
+        self.watermarks = {}
+        self.products = []
+        self._product_codes = {}
+        self._derived = {}
+        self.columns = self._empty_columns()
+
+    @staticmethod
+    def _empty_columns():
+        return {
+            "id": np.empty(0, dtype=np.int64),
+            "user_id": np.empty(0, dtype=np.int64),
+            # Proleptic Gregorian ordinal, see datetime.date.toordinal()
+            "date": np.empty(0, dtype=np.int32),
+            "product": np.empty(0, dtype=np.int32),
+            "sales_number": np.empty(0, dtype=np.int64),
+            "revenue": np.empty(0, dtype=np.float64),
+        }
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def _product_code(self, product):
+        code = self._product_codes.get(product)
+        if code is None:
+            code = self._product_codes[product] = len(self.products)
+            self.products.append(product)
+        return code
+
+    def _load(self, db, since_id):
+        rows = {name: [] for name in self.columns}
+        for pk, user_id, date, product, sales_number, revenue in (
+            models.Sale.objects.using(db)
+            .filter(id__gt=since_id)
+            .order_by("id")
+            .values_list("id", "user_id", "date", "product", "sales_number", "revenue")
+            .iterator(chunk_size=settings.SALE_SNAPSHOT_CHUNK_SIZE)
+        ):
+            rows["id"].append(pk)
+            rows["user_id"].append(user_id)
+            rows["date"].append(date.toordinal())
+            rows["product"].append(self._product_code(product))
+            rows["sales_number"].append(sales_number)
+            rows["revenue"].append(revenue)
+        return {
+            name: np.array(values, dtype=self.columns[name].dtype)
+            for name, values in rows.items()
+        }
+
+    def refresh(self):
+        """Append the sales created since the last refresh."""
+        with self._refresh_lock:
+            for db in sharding.databases():
+                new = self._load(db, self.watermarks.get(db, 0))
+                if len(new["id"]):
+                    columns = {
+                        name: np.concatenate([self.columns[name], new[name]])
+                        for name in self.columns
+                    }
+                    with self.lock:
+                        self.columns = columns
+                        self.watermarks[db] = int(new["id"][-1])
+                        self._derived = {}
+        return self
+
+    @property
+    def version(self):
+        """Tells apart the rows of snapshots, the same in every worker."""
+        with self.lock:
+            return "-".join(
+                f"{self.rewrites.get(db, 0)}.{self.watermarks.get(db, 0)}"
+                for db in sharding.databases()
+            )
+
+    def user_revenue_totals(self):
+        """
+        Return the ids of the users with sales, their total revenues, and
+        those totals sorted.
+        """
+        if "user_revenue_totals" not in self._derived:
+            users, inverse = np.unique(self.columns["user_id"], return_inverse=True)
+            totals = np.bincount(inverse, weights=self.columns["revenue"])
+            self._derived["user_revenue_totals"] = (users, totals, np.sort(totals))
+        return self._derived["user_revenue_totals"]
+
+
+_snapshot = None
+# Held while a new snapshot is loaded
+_snapshot_lock = threading.Lock()
+
+
+def _rewrites():
+    return {
+        db: models.SaleVersion.objects.using(db)
+        .values_list("rewrites", flat=True)
+        .first()
+        or 0
+        for db in sharding.databases()
+    }
+
+
+def get_snapshot():
+    """
+    Return the snapshot, refreshed. Once sales were rewritten, one thread
+    loads a new snapshot; the others go on with the current one meanwhile.
+    """
+    global _snapshot
+    rewrites = _rewrites()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.rewrites != rewrites:
+        # Only the first snapshot is waited for.
+        if _snapshot_lock.acquire(blocking=snapshot is None):
+            try:
+                if _snapshot is None or _snapshot.rewrites != rewrites:
+                    _snapshot = SaleSnapshot(rewrites).refresh()
+                    return _snapshot
+                snapshot = _snapshot
+            finally:
+                _snapshot_lock.release()
+    return snapshot.refresh()
+
+
+def clear():
+    """Forget the snapshot, e.g. once the databases were replaced."""
+    global _snapshot
+    _snapshot = None
+
+
+def _percentiles(values):
+    if not len(values):
+        return {f"p{p}": None for p in PERCENTILES}
+    return {
+        f"p{p}": float(value)
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+    }
+
+
+def sale_distribution(user_id, snapshot=None):
+    """
+    Revenue percentiles of the user's sales overall and per product, the
+    median units per sale, and where the user's total revenue ranks among
+    all users (percentage of users with at most the same total).
+    """
+    snapshot = snapshot or get_snapshot()
+    with snapshot.lock:
+        return _sale_distribution(snapshot, user_id)
+
+
+def _sale_distribution(snapshot, user_id):
+    columns = snapshot.columns
+    mine = columns["user_id"] == user_id
+    revenue = columns["revenue"][mine]
+    products = columns["product"][mine]
+
+    order = np.lexsort((revenue, products))
+    revenue, products = revenue[order], products[order]
+    codes, starts, counts = np.unique(products, return_index=True, return_counts=True)
+    per_product = [
+        {
+            "product": snapshot.products[code],
+            "sales": int(count),
+            "revenue": float(revenue[start : start + count].sum()),
+            "revenue_percentiles": _percentiles(revenue[start : start + count]),
+        }
+        for code, start, count in zip(codes, starts, counts)
+    ]
+
+    users, totals, sorted_totals = snapshot.user_revenue_totals()
+    revenue_rank = None
+    position = np.searchsorted(users, user_id)
+    if position < len(users) and users[position] == user_id:
+        at_most = np.searchsorted(sorted_totals, totals[position], side="right")
+        revenue_rank = float(100 * at_most / len(users))
+
+    sales_numbers = columns["sales_number"][mine]
+    return {
+        "sales": int(mine.sum()),
+        "revenue_percentiles": _percentiles(revenue),
+        "median_sales_number": (
+            float(np.median(sales_numbers)) if len(sales_numbers) else None
+        ),
+        "products": per_product,
+        "revenue_rank_percentile": revenue_rank,
+    }
@@ -1,6 +1,21 @@
+import os
+
 from django.apps import AppConfig
+from django.core.exceptions import ImproperlyConfigured
 
 
 class AppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app"
+
+    def ready(self):
+        import app.caching as caching
+        import app.signals  # noqa: F401
+
+        # gunicorn starts WEB_CONCURRENCY workers, which must share the
+        # version counters of app.caching.
+        if int(os.environ.get("WEB_CONCURRENCY") or 1) > 1 and not caching.is_shared():
+            raise ImproperlyConfigured(
+                "VERSIONED_CACHE_ALIAS must be a cache shared by the "
+                "WEB_CONCURRENCY workers, not one private to each process."
+            )
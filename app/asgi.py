@@ -0,0 +1,49 @@
+"""
+ASGI handler of ``huy.asgi``.
+
+Django 3.2 iterates streaming responses on the event loop, where the ORM
+refuses to run (``SynchronousOnlyOperation``); yet the sales export reads its
+rows as it streams them. ``ASGIHandler`` pulls every part of a streaming
+response on the thread running the synchronous views instead, the one that
+created its database cursor.
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+_DONE = object()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        parts = iter(response)
+        # next() with a default: StopIteration cannot cross sync_to_async.
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while (part := await next_part(parts, _DONE)) is not _DONE:
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
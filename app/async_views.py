@@ -0,0 +1,42 @@
+"""
+Async entry points for the read-heavy endpoints, used by the ASGI profile
+(``huy.settings_asgi``).
+
+Django 3.2 has no async ORM and DRF views are synchronous, so the views still
+run on a thread; what changes is which one. Under ASGI Django runs every
+synchronous view on one shared thread, one request at a time. The views
+returned by ``offload`` run on the event loop's thread pool instead, so
+requests are served in parallel while the event loop keeps handling the
+connections of slow clients.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def _render(view, request, args, kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+        # Rendered here rather than by Django, which would render it on the
+        # shared thread.
+        if callable(getattr(response, "render", None)):
+            response.render()
+        return response
+    finally:
+        # Pool threads outlive requests: drop their connections like
+        # request_finished does for the request thread.
+        close_old_connections()
+
+
+def offload(view):
+    """Return an async view running the synchronous ``view`` on a pool thread."""
+
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(_render, thread_sensitive=False)(
+            view, request, args, kwargs
+        )
+
+    return async_view
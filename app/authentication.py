@@ -0,0 +1,231 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import connections
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions, status
+
+import app.caching as caching
+import app.models as models
+
+TOKEN_SCOPE = "auth_tokens"
+
+
+class TokenCache:
+    """
+    Thread-safe LRU of token key -> token (with its user), whose entries
+    expire after ``timeout`` seconds.
+
+    Every worker process has its own instance. Invalidations are published by
+    bumping the "auth_tokens" version in the shared cache; the other workers
+    notice it at most ``sync_interval`` seconds later and drop their entries.
+    """
+
+    def __init__(self, max_size, timeout, sync_interval):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.sync_interval = sync_interval
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._synced_at = float("-inf")
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        version = caching.get_version(TOKEN_SCOPE)
+        if self._version is not None and version != self._version:
+            self.clear()
+        self._version = version
+
+    def get(self, key):
+        self.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        with self._lock:
+            self._entries[key] = (token, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None, user_id=None):
+        """Drop ``key`` or all tokens of ``user_id`` in every worker."""
+        with self._lock:
+            for cached_key, (token, _) in list(self._entries.items()):
+                if cached_key == key or token.user_id == user_id:
+                    del self._entries[cached_key]
+        caching.bump_version(TOKEN_SCOPE)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE,
+    settings.AUTH_TOKEN_CACHE_TIMEOUT,
+    settings.AUTH_TOKEN_CACHE_SYNC_INTERVAL,
+)
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    ``TokenAuthentication`` that remembers recently used tokens, saving the
+    token/user query on most requests. Deleting a token or saving its user
+    invalidates the cached entry in every worker (see ``app.signals``).
+
+    Workers only learn of invalidations through a shared cache: without one
+    (see ``caching.is_shared``), every request looks the token up, so a
+    revoked token is refused at once by every worker.
+    """
+
+    def authenticate_credentials(self, key):
+        if not caching.is_shared():
+            return super().authenticate_credentials(key)
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        return (token.user, token)
+
+
+class PasswordHashingUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Too many logins in progress, try again later.")
+    default_code = "password_hashing_unavailable"
+
+
+class PasswordHashingPool:
+    """
+    Runs password checks on at most ``size`` threads, with at most
+    ``queue_size`` more checks waiting for one.
+
+    A burst of logins then occupies a bounded number of threads, and the
+    request threads stay free for the other endpoints; the hashers in
+    ``hashlib`` release the GIL while they work.
+    """
+
+    def __init__(self, size, queue_size, queue_timeout):
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(size + queue_size)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="password-hashing"
+        )
+
+    @staticmethod
+    def _run(func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # The pool threads outlive requests, so they must not keep the
+            # connections they opened.
+            connections.close_all()
+
+    def run(self, func, *args, **kwargs):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHashingUnavailable()
+        try:
+            return self._executor.submit(self._run, func, args, kwargs).result()
+        finally:
+            self._slots.release()
+
+
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+
+def run_password_check(func, *args, **kwargs):
+    """
+    Call ``func``, on the password hashing pool when ``PASSWORD_HASH_POOL_SIZE``
+    is set.
+    """
+    global _hashing_pool
+    if not settings.PASSWORD_HASH_POOL_SIZE:
+        return func(*args, **kwargs)
+    with _hashing_pool_lock:
+        if _hashing_pool is None:
+            _hashing_pool = PasswordHashingPool(
+                settings.PASSWORD_HASH_POOL_SIZE,
+                settings.PASSWORD_HASH_QUEUE_SIZE,
+                settings.PASSWORD_HASH_QUEUE_TIMEOUT,
+            )
+    return _hashing_pool.run(func, *args, **kwargs)
+
+
+def _credentials_key(username, password):
+    digest = salted_hmac(
+        "app.authentication.credentials",
+        f"{username}\0{password}",
+        algorithm="sha256",
+    )
+    return f"credentials:{digest.hexdigest()}"
+
+
+def _password_fingerprint(user):
+    # Changes whenever the password (or only its hashing) changes, which
+    # invalidates the credentials verified with the old one.
+    return salted_hmac(
+        "app.authentication.password", user.password, algorithm="sha256"
+    ).hexdigest()
+
+
+def verify_credentials(request, username, password):
+    """
+    ``authenticate()`` that remembers successfully verified credentials for
+    ``AUTH_CREDENTIAL_CACHE_TIMEOUT`` seconds, so repeated logins and Basic
+    auth requests skip the slow password hash.
+
+    Entries are keyed by an HMAC of the credentials; neither the password
+    nor its hash are cached.
+    """
+    cache = caching.get_cache()
+    key = _credentials_key(username, password)
+    cached = cache.get(key)
+    if cached is not None:
+        user_id, fingerprint = cached
+        user = models.User.objects.filter(pk=user_id, is_active=True).first()
+        if user is not None and constant_time_compare(
+            _password_fingerprint(user), fingerprint
+        ):
+            return user
+        cache.delete(key)
+
+    user = run_password_check(
+        authenticate, request=request, username=username, password=password
+    )
+    if user is not None:
+        cache.set(
+            key,
+            (user.pk, _password_fingerprint(user)),
+            settings.AUTH_CREDENTIAL_CACHE_TIMEOUT,
+        )
+    return user
+
+
+class CachedBasicAuthentication(authentication.BasicAuthentication):
+    """``BasicAuthentication`` verifying credentials with ``verify_credentials``."""
+
+    def authenticate_credentials(self, userid, password, request=None):
+        user = verify_credentials(request, userid, password)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("Invalid username/password."))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return (user, None)
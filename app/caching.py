@@ -0,0 +1,106 @@
+"""
+Versioned caching on top of Django's cache framework.
+
+Cached values are keyed on a version counter per scope (e.g. "sales"), which
+writers bump instead of deleting keys. Readers then simply miss on the new
+version and the stale entries expire on their own. The counters live in the
+cache configured by ``VERSIONED_CACHE_ALIAS``, a file-based cache by default,
+so they are shared by all the workers of a server. With a cache private to
+each process (locmem, dummy), a write only invalidates what the process that
+made it cached: see ``is_shared``.
+
+Bumping a version stores a new value rather than incrementing the old one,
+as ``incr()`` is a get and a set on most backends: two workers bumping at
+the same time would both store the same number.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+import app.replicas as replicas
+import app.sharding as sharding
+
+
+def get_cache():
+    return caches[settings.VERSIONED_CACHE_ALIAS]
+
+
+def is_shared():
+    """Whether the cache of ``VERSIONED_CACHE_ALIAS`` is shared by processes."""
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def _version_key(scope):
+    return f"version:{scope}"
+
+
+def _new_version():
+    # The time, so that counters that were evicted, or bumped by two workers
+    # at once, never go back to a version older cached entries were stored at.
+    return time.time_ns()
+
+
+def get_version(scope):
+    cache = get_cache()
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def changed_at(scope):
+    """
+    When ``scope`` was last invalidated, in seconds since the epoch: no
+    earlier, later if its counter was evicted since.
+    """
+    return get_version(scope) // 1_000_000_000
+
+
+def _bump(scope):
+    get_cache().set(_version_key(scope), _new_version(), timeout=None)
+
+
+def bump_version(*scopes, using=(DEFAULT_DB_ALIAS,)):
+    """
+    Invalidate everything cached for ``scopes``.
+
+    The versions are bumped right away and again once the current transaction
+    of each database of ``using`` commits, so a value computed from not yet
+    committed data cannot stay cached under the final version.
+    """
+    for scope in scopes:
+        _bump(scope)
+    for alias in using:
+        transaction.on_commit(lambda: [_bump(scope) for scope in scopes], using=alias)
+
+
+def get_or_set(scope, name, compute, timeout):
+    """
+    Return the value cached as ``name`` for the current version of ``scope``,
+    calling ``compute`` and caching its result on a miss.
+    """
+    cache = get_cache()
+    key = f"{name}:{scope}:{get_version(scope)}"
+    value = cache.get(key)
+    if value is None:
+        # The value outlives the lag of the replicas, and is shared with the
+        # clients reading their own writes.
+        with replicas.reading_from_primaries():
+            value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def bump_sales_versions(user_ids):
+    """
+    Invalidate the sales statistics shared by all users, after a write of
+    the sales of ``user_ids``.
+    """
+    bump_version("sales", using=sharding.shards_for(user_ids))
@@ -0,0 +1,121 @@
+"""
+Conditional GETs: ``etag`` answers a request whose validator still matches
+with 304 Not Modified, which costs a query or two instead of the view's
+queries and serialization.
+
+The validators are built from the data the view reads, and read before it:
+
+- what is read from the user's sales or rollups goes with the version of
+  their ``SaleUserRollup``, committed with every change of their sales (see
+  ``app.rollups``), read from the database the view reads from;
+- values cached for all users (see ``app.caching``) go with the version
+  they are cached under;
+- the sales distribution goes with the rows of the analytics snapshot it is
+  computed from (see ``app.analytics``).
+
+Every worker then computes the same validators, and a validator never
+belongs to data newer than the body sent with it, e.g. one read from a read
+replica that is behind.
+"""
+
+import functools
+import hashlib
+
+import django.utils.cache as django_cache
+from django.utils.http import quote_etag
+from rest_framework import status
+
+import app.analytics as analytics
+import app.caching as caching
+import app.models as models
+import app.schema as schema
+import app.sharding as sharding
+
+
+def etag(etag_func):
+    """
+    Decorator of the ``get`` method of a DRF view, like Django's
+    ``condition(etag_func=...)`` but called once the request is authenticated
+    and its permissions checked, with the view: ``etag_func(view, request,
+    *args, **kwargs)``. Error responses get no ETag.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            validator = quote_etag(etag_func(view, request, *args, **kwargs))
+            response = django_cache.get_conditional_response(request, etag=validator)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+            if (
+                status.is_success(response.status_code)
+                or response.status_code == status.HTTP_304_NOT_MODIFIED
+            ):
+                response.headers.setdefault("ETag", validator)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _representation(request):
+    # The same resource is rendered differently per format (JSON, browsable
+    # API, ...) and, for lists, per query string (pagination).
+    query = hashlib.sha1(request.META.get("QUERY_STRING", "").encode()).hexdigest()
+    return f"{request.accepted_renderer.format}-{query[:12]}"
+
+
+def _user_sales_version(request):
+    user_id = request.user.id
+    version = (
+        models.SaleUserRollup.objects.for_user(user_id)
+        .values_list("version", flat=True)
+        .first()
+    )
+    # Versions are counted per database: users moved to another one by
+    # rebalance_sales must not find their old validators there.
+    return f"{user_id}-{sharding.shard_for(user_id)}-{version or 0}"
+
+
+def sale_list_etag(view, request, *args, **kwargs):
+    return f"sales-{_user_sales_version(request)}-{_representation(request)}"
+
+
+def sale_detail_etag(view, request, pk, *args, **kwargs):
+    version = _user_sales_version(request)
+    # Raises for sales the user may not see, before anything is compared.
+    view.get_object()
+    return f"sale-{pk}-{version}-{_representation(request)}"
+
+
+def sale_statistics_etag(view, request, *args, **kwargs):
+    # average_sale_all_user is cached, for every user's sales.
+    return (
+        f"statistics-{_user_sales_version(request)}-"
+        f"{caching.get_version('sales')}-{_representation(request)}"
+    )
+
+
+def sale_leaderboard_etag(view, request, *args, **kwargs):
+    if request.GET.get("scope") == "all":
+        # Cached, and depends on every user's sales only.
+        version = f"all-{caching.get_version('sales')}"
+    else:
+        version = _user_sales_version(request)
+    return f"leaderboard-{version}-{_representation(request)}"
+
+
+def sale_distribution_etag(view, request, *args, **kwargs):
+    # Ranks the user among everyone, from the snapshot of the worker, which
+    # the view then reads (see app.analytics).
+    if not analytics.available():
+        return "distribution-unavailable"
+    return (
+        f"distribution-{request.user.id}-{view.get_snapshot().version}-"
+        f"{_representation(request)}"
+    )
+
+
+def openapi_document_etag(request, *args, **kwargs):
+    return schema.get_document()[1]
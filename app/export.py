@@ -0,0 +1,104 @@
+"""
+Streaming encoders for exporting sales.
+
+Rows are read with a chunked database cursor and encoded as they are
+produced, so the memory used by an export does not grow with its size.
+"""
+
+import csv
+import datetime
+import json
+
+from django.conf import settings
+
+import app.serializers as serializers
+
+SALE_FIELDS = serializers.SaleSerializer.Meta.fields
+
+
+class _Echo:
+    """File-like object handing back what ``csv.writer`` writes to it."""
+
+    def write(self, value):
+        return value
+
+
+_csv_writer = csv.writer(_Echo())
+
+
+def _json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_line(data):
+    return (
+        json.dumps(
+            data, default=_json_default, ensure_ascii=False, separators=(",", ":")
+        )
+        + "\n"
+    )
+
+
+_json_encoder = json.JSONEncoder(
+    ensure_ascii=False, allow_nan=False, separators=(",", ":")
+)
+
+
+def sales_json(rows):
+    """
+    Encode tuples of ``SALE_FIELDS`` values as the JSON array DRF's
+    ``JSONRenderer`` makes of ``SaleSerializer(many=True).data``, without
+    going through model instances and serializer fields.
+    """
+    data = []
+    for row in rows:
+        sale = dict(zip(SALE_FIELDS, row))
+        sale["date"] = sale["date"].isoformat()
+        data.append(sale)
+    # Like JSONRenderer: these are valid JSON but not valid JavaScript.
+    text = _json_encoder.encode(data).replace("\u2028", "\\u2028")
+    return text.replace("\u2029", "\\u2029").encode("utf-8")
+
+
+def csv_line(values):
+    return _csv_writer.writerow(
+        [
+            value.isoformat() if isinstance(value, datetime.date) else value
+            for value in values
+        ]
+    )
+
+
+def sale_rows(queryset):
+    """
+    Yield the ``SaleSerializer`` fields of every sale of ``queryset`` as
+    tuples, in (date, id) order.
+    """
+    return (
+        queryset.order_by("date", "id")
+        .values_list(*SALE_FIELDS)
+        .iterator(chunk_size=settings.SALE_EXPORT_CHUNK_SIZE)
+    )
+
+
+def _batched(lines):
+    # Yielding every line on its own makes the WSGI server flush tiny writes.
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= settings.SALE_EXPORT_CHUNK_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def ndjson_stream(rows):
+    return _batched(ndjson_line(dict(zip(SALE_FIELDS, row))) for row in rows)
+
+
+def csv_stream(rows):
+    yield csv_line(SALE_FIELDS)
+    yield from _batched(csv_line(row) for row in rows)
@@ -0,0 +1,51 @@
+"""
+Batched ingestion of many sales at once.
+
+Rows are validated with ``SaleSerializer`` one by one, so a bad row only
+rejects itself, and the valid rows of each batch are inserted with a single
+``bulk_create`` in one transaction.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import exceptions
+
+import app.models as models
+import app.parsers as parsers
+import app.rollups as rollups
+import app.serializers as serializers
+import app.sharding as sharding
+
+
+def validate_sale(serializer, row):
+    if isinstance(row, parsers.InvalidLine):
+        raise exceptions.ValidationError({"non_field_errors": [row.detail]})
+    return serializer.run_validation(row)
+
+
+def ingest_sales(user, rows, context=None):
+    """
+    Create a sale of ``user`` for every valid row. Returns the number of
+    sales created and a list of ``{"index": ..., "errors": ...}`` for the
+    rejected rows.
+    """
+    serializer = serializers.SaleSerializer(context=context or {})
+    batch_size = settings.SALE_BULK_BATCH_SIZE
+    db = sharding.shard_for(user.id)
+    created, errors = 0, []
+    for start in range(0, len(rows), batch_size):
+        sales = []
+        for index, row in enumerate(rows[start : start + batch_size], start):
+            try:
+                data = validate_sale(serializer, row)
+            except exceptions.ValidationError as exc:
+                errors.append({"index": index, "errors": exc.detail})
+                continue
+            sales.append(models.Sale(**data, user=user))
+        if not sales:
+            continue
+        with transaction.atomic(using=db):
+            models.Sale.objects.using(db).bulk_create(sales)
+            rollups.sales_created(sales)
+        created += len(sales)
+    return created, errors
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+import app.schema as schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the OpenAPI document into a static file, so that the docs "
+        "do not generate it at runtime. Run it before collectstatic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=schema.STATIC_SOURCE,
+            help=f"Where to write the document (default: {schema.STATIC_SOURCE})",
+        )
+
+    def handle(self, *args, output, **options):
+        size = schema.write_static(output)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {size} bytes to {output}"))
@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+
+import app.caching as caching
+import app.sale_queue as sale_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Save the sales queued by POST /sales/ when SALE_QUEUE_PATH is set: "
+        "until the queue is empty, or forever, looking for new sales every "
+        "--interval seconds. Run a single one per queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Seconds to wait when the queue is empty; stop then if not set",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.SALE_BULK_BATCH_SIZE,
+            help="Sales saved per transaction",
+        )
+
+    def handle(self, *args, interval=None, batch_size=None, **options):
+        if not settings.SALE_QUEUE_PATH:
+            raise CommandError("SALE_QUEUE_PATH is not set")
+        # The sales saved here must invalidate what the web workers cached.
+        if not caching.is_shared():
+            raise CommandError(
+                "VERSIONED_CACHE_ALIAS must be a cache shared with the web "
+                "workers, not one private to this process."
+            )
+        while True:
+            drained = 0
+            try:
+                while count := sale_queue.drain(batch_size):
+                    drained += count
+            except OperationalError as exc:
+                # Such as "database is locked": the batch is retried.
+                if interval is None:
+                    raise
+                self.stderr.write(f"Draining failed: {exc}")
+            if drained:
+                self.stdout.write(f"Drained {drained} queued sales")
+            if interval is None:
+                return
+            time.sleep(interval)
@@ -0,0 +1,214 @@
+import collections
+import csv
+import itertools
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+import app.caching as caching
+import app.models as models
+import app.rollups as rollups
+import app.sharding as sharding
+
+
+def sniff_delimiter(path):
+    if os.path.splitext(path)[1].lower() == ".tsv":
+        return "\t"
+    with open(path, newline="") as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",\t;").delimiter
+    except csv.Error:
+        return ","
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Import sales and/or cities from CSV or TSV files. Rows are streamed and "
+        "written in batches, and re-running an import updates the rows it "
+        "created before instead of duplicating them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sales",
+            help="File with date, product, sales_number and revenue columns",
+        )
+        parser.add_argument(
+            "--user",
+            dest="user_ids",
+            type=int,
+            action="append",
+            default=[],
+            help="Id of a user the sales are imported for (repeatable)",
+        )
+        parser.add_argument(
+            "--cities", help="File with a city name and a country name per row"
+        )
+        parser.add_argument("--delimiter", help="Field delimiter, sniffed by default")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["sales"]:
+            if not options["user_ids"]:
+                raise CommandError("--sales needs at least one --user")
+            self.import_sales(options)
+        if options["cities"]:
+            self.import_cities(options)
+
+    def report(self, what, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{what}: {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+
+    def read_rows(self, path, options, reader=csv.reader):
+        """Yield (line number, row) for the rows of ``path``, lazily."""
+        delimiter = options["delimiter"] or sniff_delimiter(path)
+        with open(path, newline="") as f:
+            yield from enumerate(reader(f, delimiter=delimiter), 1)
+
+    def import_sales(self, options):
+        users = list(models.User.objects.filter(id__in=options["user_ids"]))
+        missing = set(options["user_ids"]) - {user.id for user in users}
+        if missing:
+            raise CommandError(f"Unknown user ids: {sorted(missing)}")
+
+        # Sales have no natural key and a file may repeat a row, so the n-th
+        # occurrence of (user, date, product) in the file is matched with the
+        # n-th existing sale with that key, in id order.
+        occurrences = {}
+        started, count, created, updated = time.perf_counter(), 0, 0, 0
+        rows = self.read_rows(options["sales"], options, reader=csv.DictReader)
+        for batch in batched(rows, options["batch_size"]):
+            parsed = []
+            for line, row in batch:
+                try:
+                    date = parse_date(row["date"])
+                    if date is None:
+                        raise ValueError(f"invalid date {row['date']!r}")
+                    parsed.append(
+                        (
+                            date,
+                            row["product"],
+                            int(row["sales_number"]),
+                            float(row["revenue"]),
+                        )
+                    )
+                except (KeyError, TypeError, ValueError) as exc:
+                    self.stderr.write(f"Skipping sales line {line + 1}: {exc!r}")
+
+            existing = {}
+            for user in users:
+                for sale in (
+                    models.Sale.objects.for_user(user.id)
+                    .filter(
+                        date__in={row[0] for row in parsed},
+                        product__in={row[1] for row in parsed},
+                    )
+                    .order_by("id")
+                ):
+                    existing.setdefault(
+                        (sale.user_id, sale.date, sale.product), []
+                    ).append(sale)
+
+            # Per database, see app.sharding
+            to_create = collections.defaultdict(list)
+            to_update = collections.defaultdict(list)
+            for user in users:
+                db = sharding.shard_for(user.id)
+                for date, product, sales_number, revenue in parsed:
+                    key = (user.id, date, product)
+                    index = occurrences.get(key, 0)
+                    occurrences[key] = index + 1
+                    matches = existing.get(key, [])
+                    if index >= len(matches):
+                        to_create[db].append(
+                            models.Sale(
+                                user=user,
+                                date=date,
+                                product=product,
+                                sales_number=sales_number,
+                                revenue=revenue,
+                            )
+                        )
+                    elif (matches[index].sales_number, matches[index].revenue) != (
+                        sales_number,
+                        revenue,
+                    ):
+                        matches[index].sales_number = sales_number
+                        matches[index].revenue = revenue
+                        to_update[db].append(matches[index])
+
+            with sharding.atomic([user.id for user in users]):
+                for db, sales in to_create.items():
+                    models.Sale.objects.using(db).bulk_create(sales)
+                for db, sales in to_update.items():
+                    models.Sale.objects.using(db).bulk_update(
+                        sales, ["sales_number", "revenue"]
+                    )
+            count += len(parsed) * len(users)
+            created += sum(len(sales) for sales in to_create.values())
+            updated += sum(len(sales) for sales in to_update.values())
+            self.report("Sales", count, started)
+
+        if created or updated:
+            # Bulk writes send no signals, so the rollups are recomputed once.
+            rollups.rebuild([user.id for user in users])
+        self.stdout.write(
+            self.style.SUCCESS(f"Sales: {created} created, {updated} updated")
+        )
+
+    def import_cities(self, options):
+        countries = dict(models.Country.objects.values_list("name", "id"))
+        started, count, created = time.perf_counter(), 0, 0
+        rows = self.read_rows(options["cities"], options)
+        for batch in batched(rows, options["batch_size"]):
+            parsed = []
+            for line, row in batch:
+                fields = [field.strip() for field in row if field.strip()]
+                if len(fields) < 2:
+                    self.stderr.write(f"Skipping cities line {line}: {row!r}")
+                    continue
+                parsed.append((fields[0], fields[1]))
+
+            with transaction.atomic():
+                for _, country in parsed:
+                    if country not in countries:
+                        countries[country] = models.Country.objects.create(
+                            name=country
+                        ).id
+                seen = set(
+                    models.City.objects.filter(
+                        name__in={city for city, _ in parsed}
+                    ).values_list("country_id", "name")
+                )
+                to_create = []
+                for city, country in parsed:
+                    key = (countries[country], city)
+                    if key not in seen:
+                        seen.add(key)
+                        to_create.append(
+                            models.City(name=city, country_id=countries[country])
+                        )
+                models.City.objects.bulk_create(to_create)
+            count += len(parsed)
+            created += len(to_create)
+            self.report("Cities", count, started)
+
+        if created:
+            # bulk_create sends no signals to invalidate the cached /countries/.
+            caching.bump_version("countries")
+        self.stdout.write(self.style.SUCCESS(f"Cities: {created} created"))
@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+
+import app.models as models
+import app.rollups as rollups
+import app.sharding as sharding
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the sales of every user, and their rollups, to the database "
+        "app.sharding maps the user to: from 'default' after turning sharding "
+        "on, or to the new shards after adding some. Sales keep their ids. "
+        "Interrupted runs can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="sources",
+            action="append",
+            help="Database to move sales out of (repeatable); by default "
+            "'default' and every shard",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many sales would move where",
+        )
+
+    def handle(self, *args, **options):
+        sources = options["sources"] or [DEFAULT_DB_ALIAS, *settings.SALE_SHARDS]
+        unknown = set(sources) - set(settings.DATABASES)
+        if unknown:
+            raise CommandError(f"Unknown databases: {sorted(unknown)}")
+
+        moved_users = []
+        for source in dict.fromkeys(sources):
+            moves = {}
+            for user_id, count in self.sale_counts(source).items():
+                target = sharding.shard_for(user_id)
+                if target != source:
+                    moves.setdefault(target, []).append((user_id, count))
+            for target, users in sorted(moves.items()):
+                count = sum(count for _, count in users)
+                if not options["dry_run"]:
+                    for user_id, _ in users:
+                        self.move(user_id, source, target, options["batch_size"])
+                moved_users.extend(user_id for user_id, _ in users)
+                self.stdout.write(
+                    f"{source} -> {target}: {count} sales of {len(users)} users"
+                )
+
+        verb = "Would move" if options["dry_run"] else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} the sales of {len(moved_users)} users")
+        )
+
+    def sale_counts(self, db):
+        counts = dict.fromkeys(
+            models.SaleUserRollup.objects.using(db).values_list("user_id", flat=True),
+            0,
+        )
+        for user_id, count in (
+            models.Sale.objects.using(db)
+            .values("user_id")
+            .annotate(count=Count("id"))
+            .values_list("user_id", "count")
+        ):
+            counts[user_id] = count
+        return counts
+
+    def move(self, user_id, source, target, batch_size):
+        sales = models.Sale.objects.using(source).filter(user_id=user_id)
+        last_id = sales.order_by("-id").values_list("id", flat=True).first()
+        if last_id is not None and last_id > sharding.id_range(target)[1]:
+            # The target would go on numbering its rows from there, into the
+            # range of another shard.
+            raise CommandError(
+                f"Sales of user {user_id} have ids above the range of {target}: "
+                "shards can be added, not removed"
+            )
+        with transaction.atomic(using=target):
+            batch = []
+            for sale in sales.order_by("id").iterator(chunk_size=batch_size):
+                batch.append(sale)
+                if len(batch) == batch_size:
+                    self.copy(batch, user_id, target)
+                    batch = []
+            self.copy(batch, user_id, target)
+            rollups.rebuild([user_id])
+        with transaction.atomic(using=source):
+            rollups.delete_rollups(source, [user_id])
+            # Without the delete signals, which would update the rollups on
+            # the user's new shard.
+            sales._raw_delete(source)
+
+    def copy(self, sales, user_id, target):
+        taken = dict(
+            models.Sale.objects.using(target)
+            .filter(pk__in=[sale.pk for sale in sales])
+            .values_list("id", "user_id")
+        )
+        conflicts = sorted(pk for pk, owner in taken.items() if owner != user_id)
+        if conflicts:
+            # Rolls the copy back, before anything is deleted from the source.
+            raise CommandError(
+                f"Sales {conflicts} of user {user_id} have ids already taken "
+                f"on {target}"
+            )
+        # Rows of the user already there were copied by an interrupted run.
+        models.Sale.objects.using(target).bulk_create(
+            sale for sale in sales if sale.pk not in taken
+        )
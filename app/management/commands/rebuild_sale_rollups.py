@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+import app.rollups as rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user sale rollups from the sales table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            dest="user_ids",
+            type=int,
+            action="append",
+            help="Only rebuild the rollups of this user id (repeatable)",
+        )
+
+    def handle(self, *args, user_ids=None, **options):
+        count = rollups.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {count} users"))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import app.traffic as traffic
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay requests recorded by TrafficRecordingMiddleware, in process or "
+        "against a running server, and report latency percentiles, throughput "
+        "and error rate per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file of recorded requests")
+        parser.add_argument(
+            "--target",
+            help="Base URL of a running server, e.g. http://localhost:8000; "
+            "requests go through Django's test client by default",
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        pacing = parser.add_mutually_exclusive_group()
+        pacing.add_argument("--rate", type=float, help="Requests per second")
+        pacing.add_argument(
+            "--speed",
+            type=float,
+            help="Keep the recorded spacing between requests, sped up this "
+            "many times",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            records = traffic.load_records(options["path"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}")
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        client = (
+            traffic.HTTPClient(options["target"])
+            if options["target"]
+            else traffic.InProcessClient()
+        )
+        replay = traffic.Replay(
+            records,
+            client,
+            concurrency=options["concurrency"],
+            rate=options["rate"],
+            speed=options["speed"],
+        ).run()
+
+        if replay.skipped:
+            self.stderr.write(
+                f"Skipped {replay.skipped} requests with redacted secrets"
+            )
+        self.stdout.write(
+            f"{'endpoint':40} {'requests':>8} {'req/s':>8} {'errors':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for row in replay.summary():
+            percentiles = " ".join(
+                f"{row[p]:8.1f}" if row[p] is not None else f"{'-':>8}"
+                for p in ("p50", "p95", "p99")
+            )
+            self.stdout.write(
+                f"{row['endpoint']:40} {row['requests']:8} {row['throughput']:8.1f} "
+                f"{row['error_rate']:7.1%} {percentiles}"
+            )
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import app.replicas as replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy every database of DATABASE_REPLICAS to its replica, with "
+        "SQLite's online backup API: once, or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Seconds between the starts of two syncs; sync once if not set",
+        )
+
+    def handle(self, *args, interval=None, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No DATABASE_REPLICAS configured")
+        for alias in [
+            *settings.DATABASE_REPLICAS,
+            *settings.DATABASE_REPLICAS.values(),
+        ]:
+            if settings.DATABASES[alias]["ENGINE"] != "django.db.backends.sqlite3":
+                raise CommandError(f"{alias} is not a SQLite database")
+        while True:
+            started = time.monotonic()
+            for primary, replica in settings.DATABASE_REPLICAS.items():
+                duration = replicas.sync(primary, replica)
+                self.stdout.write(f"{primary} -> {replica}: {duration:.2f}s")
+            if interval is None:
+                return
+            time.sleep(max(0, interval - (time.monotonic() - started)))
@@ -0,0 +1,386 @@
+"""
+Histograms of request performance, and the lag of the read replicas,
+exposed in the Prometheus text format.
+
+Every worker process counts in memory, and saves its histograms to a file of
+``METRICS_DIR`` after each measured request. ``render()``, in whichever
+worker the scrape reaches, adds up those of every worker. Files are named
+after the PID and the start time of their worker, so a worker reusing the
+PID of an exited one never overwrites its file. The first worker to save or
+render after a restart folds the files of exited workers into one, which
+``render()`` adds too: the totals never go down, and files don't pile up.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: the folding of exited workers is not locked
+    fcntl = None
+
+import app.replicas as replicas
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Add ``value`` to the series of ``labels``, a tuple of (name, value)."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def series(self):
+        """A copy of the series, as {labels: (bucket counts, sum, count)}."""
+        with self._lock:
+            return {
+                labels: (list(counts), total, count)
+                for labels, (counts, total, count) in self._series.items()
+            }
+
+    def render(self, series=None):
+        """Render ``series``, by default those of this process."""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        if series is None:
+            series = self.series()
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_labels(labels + (('le', bound),))} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}"
+            )
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Gauge:
+    """A gauge read at scrape time: ``collect`` returns {labels: value}."""
+
+    def __init__(self, name, help_text, collect):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} gauge",
+        ]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+request_duration = Histogram(
+    "huy_request_duration_seconds", "Wall time of sampled requests", DURATION_BUCKETS
+)
+request_queries = Histogram(
+    "huy_request_db_queries", "SQL queries per sampled request", QUERY_BUCKETS
+)
+request_query_duration = Histogram(
+    "huy_request_db_duration_seconds",
+    "Time spent in SQL queries per sampled request",
+    DURATION_BUCKETS,
+)
+request_serialize_duration = Histogram(
+    "huy_request_serialize_duration_seconds",
+    "Time spent in serializers turning objects into primitives, per sampled request",
+    DURATION_BUCKETS,
+)
+request_render_duration = Histogram(
+    "huy_request_render_duration_seconds",
+    "Time spent encoding the response body (JSON, ...) of sampled requests",
+    DURATION_BUCKETS,
+)
+response_size = Histogram(
+    "huy_response_size_bytes",
+    "Body size of the responses to sampled requests",
+    SIZE_BUCKETS,
+)
+replica_lag = Gauge(
+    "huy_replica_lag_seconds",
+    "Seconds since the start of the last sync of each read replica",
+    lambda: {(("database", replica),): lag for replica, lag in replicas.lags().items()},
+)
+HISTOGRAMS = (
+    request_duration,
+    request_queries,
+    request_query_duration,
+    request_serialize_duration,
+    request_render_duration,
+    response_size,
+)
+
+
+GAUGES = (replica_lag,)
+
+# Durations of the request being measured, by name; None for the others
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+@contextlib.contextmanager
+def measuring():
+    """Collect the ``timing`` blocks run inside, in the dict returned."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextlib.contextmanager
+def timing(name):
+    """Add the time spent in the block to the ``name`` timing, if measuring."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+_save_lock = threading.Lock()
+
+# Key of the file of this process, see _this_worker()
+_worker = None
+
+
+def _path(worker):
+    return os.path.join(settings.METRICS_DIR, f"worker-{worker}.json")
+
+
+def _exited_path():
+    return os.path.join(settings.METRICS_DIR, "exited.json")
+
+
+def _started(pid):
+    """
+    When the process ``pid`` started, in clock ticks since boot; None if it is
+    not running, or without /proc.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # The fields after the command, which may hold spaces
+            return int(file.read().rpartition(")")[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _running(worker):
+    pid, _, start = worker.partition("-")
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    started = _started(pid)
+    if started is not None:
+        return str(started) == start
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _this_worker():
+    """
+    Key of the file of this process: its PID and start time. Folds the files
+    of the exited workers when called first in the process.
+    """
+    global _worker
+    pid = os.getpid()
+    if _worker is None or not _worker.startswith(f"{pid}-"):
+        _worker = f"{pid}-{_started(pid) or time.time_ns()}"
+        if settings.METRICS_DIR:
+            _fold_exited()
+    return _worker
+
+
+@contextlib.contextmanager
+def _locked():
+    """Hold the lock of ``METRICS_DIR``, against other processes."""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, "lock"), "a") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+def _write(path, data):
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    # Written aside and renamed, so the file is never read half-written
+    fd, temporary = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def _saved(histograms):
+    return {
+        histogram.name: [
+            [labels, counts, total, count]
+            for labels, (counts, total, count) in series.items()
+        ]
+        for histogram, series in histograms.items()
+    }
+
+
+def _add(histogram, series, saved):
+    """Add the series ``saved`` of ``histogram`` to ``series``."""
+    for labels, counts, total, count in saved.get(histogram.name, ()):
+        labels = tuple(tuple(label) for label in labels)
+        if labels not in series:
+            series[labels] = ([0] * len(histogram.buckets), 0, 0)
+        own_counts, own_total, own_count = series[labels]
+        series[labels] = (
+            [a + b for a, b in zip(own_counts, counts)],
+            own_total + total,
+            own_count + count,
+        )
+
+
+def _fold_exited():
+    """
+    Add the files of the exited workers to that of ``render()``, and remove
+    them. The workers folded are listed in it until their file is gone, so a
+    fold interrupted before the removal doesn't count them twice.
+    """
+    with _locked():
+        exited = _read(_exited_path(), {"folded": [], "histograms": {}})
+        workers = {}
+        for path in glob.glob(_path("*")):
+            worker = os.path.basename(path)[len("worker-") : -len(".json")]
+            if not _running(worker):
+                workers[worker] = path
+        if not workers:
+            return
+        histograms = {}
+        for histogram in HISTOGRAMS:
+            series = histograms[histogram] = {}
+            _add(histogram, series, exited["histograms"])
+            for worker, path in workers.items():
+                if worker not in exited["folded"]:
+                    _add(histogram, series, _read(path, {}))
+        _write(
+            _exited_path(),
+            {"folded": sorted(workers), "histograms": _saved(histograms)},
+        )
+        for path in workers.values():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def save():
+    """Save the histograms of this process for ``render()`` in the others."""
+    if not settings.METRICS_DIR:
+        return
+    path = _path(_this_worker())
+    with _save_lock:
+        _write(
+            path,
+            _saved({histogram: histogram.series() for histogram in HISTOGRAMS}),
+        )
+
+
+def _saved_by_others():
+    if not settings.METRICS_DIR:
+        return []
+    own = _path(_this_worker())
+    with _locked():
+        exited = _read(_exited_path(), {"folded": [], "histograms": {}})
+        saved = [exited["histograms"]]
+        for path in glob.glob(_path("*")):
+            worker = os.path.basename(path)[len("worker-") : -len(".json")]
+            if path == own or worker in exited["folded"]:
+                continue
+            if (histograms := _read(path)) is not None:
+                saved.append(histograms)
+    return saved
+
+
+def render():
+    """The metrics of every worker, in the Prometheus text format."""
+    others = _saved_by_others()
+    parts = []
+    for histogram in HISTOGRAMS:
+        series = histogram.series()
+        for saved in others:
+            _add(histogram, series, saved)
+        parts.append(histogram.render(series))
+    return "".join(parts + [gauge.render() for gauge in GAUGES])
+
+
+def clear():
+    """Forget the histograms of this process."""
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+    if settings.METRICS_DIR:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_path(_this_worker()))
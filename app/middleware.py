@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import contextvars
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+import app.metrics as metrics
+import app.replicas as replicas
+import app.traffic as traffic
+
+
+class _SyncAndAsyncMiddleware:
+    """
+    Middleware running synchronously or asynchronously, as the handler it
+    wraps: under ASGI, Django need not switch threads to call it.
+    Subclasses implement ``sync_call`` and ``async_call``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django to await the middleware, see MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.async_call(request)
+        return self.sync_call(request)
+
+
+class TrafficRecordingMiddleware(_SyncAndAsyncMiddleware):
+    """
+    Append every request to the JSONL file ``TRAFFIC_RECORD_FILE``, in the
+    format ``manage.py replay_traffic`` reads. Disabled when the setting is
+    empty.
+
+    Each record is written with a single ``write()`` to a file opened for
+    appending, so the workers of a server can share the file.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TRAFFIC_RECORD_FILE:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+        self._file = open(settings.TRAFFIC_RECORD_FILE, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def _body(self, request):
+        # Read now: once the view has consumed the stream, the body is gone.
+        # Larger bodies are left alone, as reading them could exceed
+        # DATA_UPLOAD_MAX_MEMORY_SIZE.
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        if length <= settings.TRAFFIC_RECORD_MAX_BODY:
+            return request.body
+        return None
+
+    def _record(self, request, body, response, timestamp, duration):
+        record = traffic.make_record(request, body, response, timestamp, duration)
+        line = traffic.dump_record(record)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def sync_call(self, request):
+        body = self._body(request)
+        timestamp, started = time.time(), time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, body, response, timestamp, time.perf_counter() - started)
+        return response
+
+    async def async_call(self, request):
+        body = self._body(request)
+        timestamp, started = time.time(), time.perf_counter()
+        response = await self.get_response(request)
+        duration = time.perf_counter() - started
+        await sync_to_async(self._record, thread_sensitive=False)(
+            request, body, response, timestamp, duration
+        )
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    ``WhiteNoiseMiddleware`` that also runs asynchronously, for
+    huy.settings_asgi: the other requests go on to the async views without
+    passing through the thread of synchronous code.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django to await the middleware, see MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # The files are indexed at startup, unless WHITENOISE_AUTOREFRESH, so
+        # only the requests for one of them leave the event loop, which
+        # opens the file.
+        if self.autorefresh or request.path_info in self.files:
+            response = await sync_to_async(
+                self.process_request, thread_sensitive=False
+            )(request)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+
+class ReplicaReadMiddleware(_SyncAndAsyncMiddleware):
+    """
+    Let safe requests read from the replicas of ``DATABASE_REPLICAS``, and
+    remember which clients wrote so that they read their own writes (see
+    ``app.replicas``). Disabled when the setting is empty.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def sync_call(self, request):
+        key = replicas.client_key(request)
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            with replicas.reading_from_replicas(key):
+                return self.get_response(request)
+        response = self.get_response(request)
+        if key and response.status_code < 400:
+            replicas.wrote(key)
+        return response
+
+    async def async_call(self, request):
+        # The replicas to read from are in the context, which sync_to_async
+        # hands on to the threads running the views.
+        key = replicas.client_key(request)
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            with replicas.reading_from_replicas(key):
+                return await self.get_response(request)
+        response = await self.get_response(request)
+        if key and response.status_code < 400:
+            replicas.wrote(key)
+        return response
+
+
+class _QueryTimer:
+    """Number and duration of the queries of a measured request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        # Async views may run queries on several threads at once.
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+
+
+_query_timer = contextvars.ContextVar("query_timer", default=None)
+
+
+def time_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper of every connection (see ``app.signals``),
+    timing the queries of the requests ``PerformanceMiddleware`` measures.
+    ``sync_to_async`` copies the context, so queries are timed on whichever
+    thread they run.
+    """
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.add(time.perf_counter() - started)
+
+
+class PerformanceMiddleware(_SyncAndAsyncMiddleware):
+    """
+    Measure a ``PERF_SAMPLE_RATE`` share of the requests: wall time, number
+    and duration of SQL queries, serialization and rendering times, and
+    response size. The numbers go to the histograms of ``app.metrics`` and,
+    for staff users or with ``PERF_SERVER_TIMING``, to a Server-Timing
+    header. Other requests only cost a call to random().
+    """
+
+    def __init__(self, get_response):
+        if not settings.PERF_SAMPLE_RATE:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    @contextlib.contextmanager
+    def _measuring(self, request):
+        queries = _query_timer.set(_QueryTimer())
+        try:
+            with metrics.measuring() as request._perf_timings:
+                yield
+        finally:
+            request._perf_queries = _query_timer.get()
+            _query_timer.reset(queries)
+
+    def sync_call(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return self.get_response(request)
+        started = time.perf_counter()
+        with self._measuring(request):
+            response = self.get_response(request)
+        self._report(request, response, time.perf_counter() - started)
+        metrics.save()
+        return response
+
+    async def async_call(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with self._measuring(request):
+            response = await self.get_response(request)
+        self._report(request, response, time.perf_counter() - started)
+        await sync_to_async(metrics.save, thread_sensitive=False)()
+        return response
+
+    def _report(self, request, response, duration):
+        queries = request._perf_queries
+        serialize_duration = request._perf_timings.get("serialize", 0.0)
+        render_duration = request._perf_timings.get("render", 0.0)
+
+        match = request.resolver_match
+        labels = (
+            ("method", request.method),
+            ("view", match.route if match else "unmatched"),
+        )
+        metrics.request_duration.observe(labels, duration)
+        metrics.request_queries.observe(labels, queries.count)
+        metrics.request_query_duration.observe(labels, queries.duration)
+        metrics.request_serialize_duration.observe(labels, serialize_duration)
+        metrics.request_render_duration.observe(labels, render_duration)
+        if not response.streaming:
+            metrics.response_size.observe(labels, len(response.content))
+
+        # Tells anyone how long the queries take otherwise.
+        user = getattr(request, "user", None)
+        if settings.PERF_SERVER_TIMING or getattr(user, "is_staff", False):
+            response["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"',
+                    f"serialize;dur={serialize_duration * 1000:.1f}",
+                    f"render;dur={render_duration * 1000:.1f}",
+                    f"total;dur={duration * 1000:.1f}",
+                ]
+            )
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns.
+        if hasattr(request, "_perf_timings"):
+            started = time.perf_counter()
+
+            def rendered(response):
+                request._perf_timings["render"] = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,100 @@
+# Generated by Django 3.2.9 on 2026-10-18 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    # The rollups of the sales already there, as app.rollups.rebuild()
+    # computes them.
+    db = schema_editor.connection.alias
+    Sale = apps.get_model('app', 'Sale')
+    SaleUserRollup = apps.get_model('app', 'SaleUserRollup')
+    SaleProductRollup = apps.get_model('app', 'SaleProductRollup')
+    sales = Sale.objects.using(db)
+    totals = {
+        'total_count': models.Count('id'),
+        'total_number': models.Sum('sales_number'),
+        'total_revenue': models.Sum('revenue'),
+    }
+    highest = sales.filter(user_id=models.OuterRef('user_id')).order_by('-revenue', 'id')
+    users = sales.values('user_id').annotate(
+        **totals,
+        max_sale_id=models.Subquery(highest.values('id')[:1]),
+        max_revenue=models.Subquery(highest.values('revenue')[:1]),
+    )
+    SaleUserRollup.objects.using(db).bulk_create(
+        (
+            SaleUserRollup(
+                user_id=row['user_id'],
+                sale_count=row['total_count'],
+                sales_number=row['total_number'],
+                revenue=row['total_revenue'],
+                max_sale_id=row['max_sale_id'],
+                max_revenue=row['max_revenue'],
+            )
+            for row in users.order_by('user_id').iterator()
+        ),
+        batch_size=1000,
+    )
+    # In the order the products were first sold, which breaks ties.
+    products = sales.values('user_id', 'product').annotate(**totals, first_id=models.Min('id'))
+    SaleProductRollup.objects.using(db).bulk_create(
+        (
+            SaleProductRollup(
+                user_id=row['user_id'],
+                product=row['product'],
+                sale_count=row['total_count'],
+                sales_number=row['total_number'],
+                revenue=row['total_revenue'],
+            )
+            for row in products.order_by('first_id').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='city',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cities', to='app.country'),
+        ),
+        migrations.CreateModel(
+            name='SaleUserRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sale_count', models.IntegerField(default=0)),
+                ('sales_number', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('max_revenue', models.FloatField(null=True)),
+                ('max_sale', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.sale')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sale_rollup', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SaleProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.TextField()),
+                ('sale_count', models.IntegerField(default=0)),
+                ('sales_number', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sale_product_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='saleproductrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_sale_product_rollup'),
+        ),
+        migrations.RunPython(
+            backfill_rollups, migrations.RunPython.noop, hints={'model_name': 'sale'}
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_sale_shard_user_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleQueueCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_item_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
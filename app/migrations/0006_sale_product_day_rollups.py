@@ -0,0 +1,83 @@
+# Generated by Django 3.2.9 on 2026-10-18 09:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_day_rollups(apps, schema_editor):
+    # The day rollups and totals of the sales already there, as
+    # app.rollups.rebuild() computes them.
+    db = schema_editor.connection.alias
+    Sale = apps.get_model('app', 'Sale')
+    totals = {
+        'total_count': models.Count('id'),
+        'total_number': models.Sum('sales_number'),
+        'total_revenue': models.Sum('revenue'),
+    }
+    for model_name, key_fields in [
+        ('SaleProductDayRollup', ('user_id', 'product', 'date')),
+        ('SaleProductDayTotal', ('product', 'date')),
+    ]:
+        model = apps.get_model('app', model_name)
+        rows = Sale.objects.using(db).values(*key_fields).annotate(**totals)
+        model.objects.using(db).bulk_create(
+            (
+                model(
+                    **{field: row[field] for field in key_fields},
+                    sale_count=row['total_count'],
+                    sales_number=row['total_number'],
+                    revenue=row['total_revenue'],
+                )
+                for row in rows.order_by(*key_fields).iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_sale_queue_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleProductDayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.TextField()),
+                ('date', models.DateField()),
+                ('sale_count', models.IntegerField(default=0)),
+                ('sales_number', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SaleProductDayTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.TextField()),
+                ('date', models.DateField()),
+                ('sale_count', models.IntegerField(default=0)),
+                ('sales_number', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='saleproductdaytotal',
+            constraint=models.UniqueConstraint(fields=('date', 'product'), name='unique_sale_product_day_total'),
+        ),
+        migrations.AddField(
+            model_name='saleproductdayrollup',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='saleproductdayrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'date', 'product'), name='unique_sale_product_day_rollup'),
+        ),
+        migrations.RunPython(
+            backfill_day_rollups, migrations.RunPython.noop, hints={'model_name': 'sale'}
+        ),
+    ]
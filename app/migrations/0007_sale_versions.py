@@ -0,0 +1,25 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_sale_product_day_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='saleuserrollup',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_sale_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saleversion',
+            name='rewrites',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 import django.contrib.auth.models as auth_models
 
 
@@ -20,9 +20,166 @@ class User(auth_models.AbstractUser):
     city = models.ForeignKey(City, null=True, on_delete=models.SET_NULL)
 
 
+class UserShardedManager(models.Manager):
+    """
+    Rows spread over databases by user (see app.sharding). The router picks
+    the database, from the user id hinted here, for reads and for writes.
+    """
+
+    def on_shard_of(self, user_id):
+        """All the rows of the database holding the rows of ``user_id``."""
+        return self.db_manager(hints={"user_id": user_id}).get_queryset()
+
+    def for_user(self, user_id):
+        """The rows of ``user_id``, on the database holding them."""
+        return self.on_shard_of(user_id).filter(user_id=user_id)
+
+
 class Sale(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Users and sales may be in different databases, see app.sharding.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     date = models.DateField()
     product = models.TextField()
     sales_number = models.IntegerField(default=0)
     revenue = models.FloatField(default=0)
+
+    objects = UserShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "date"], name="sale_user_date_idx"),
+            models.Index(fields=["user", "product"], name="sale_user_product_idx"),
+            models.Index(fields=["user", "revenue"], name="sale_user_revenue_idx"),
+        ]
+
+    # The save and delete signals update the rollups (see app.signals): in a
+    # transaction with the write, or a savepoint within the caller's, so that
+    # a failed update rolls the write back.
+
+    def save(self, *args, using=None, **kwargs):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, using=using, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            return super().delete(using=using, keep_parents=keep_parents)
+
+
+class SaleUserRollup(models.Model):
+    """
+    Running totals of a user's sales, kept up to date by ``app.rollups``.
+    """
+
+    user = models.OneToOneField(
+        User, related_name="sale_rollup", on_delete=models.CASCADE, db_constraint=False
+    )
+    sale_count = models.IntegerField(default=0)
+    sales_number = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+    max_sale = models.ForeignKey(
+        Sale, null=True, related_name="+", on_delete=models.SET_NULL
+    )
+    max_revenue = models.FloatField(null=True)
+    # The SaleVersion of the database at the last change of the user's sales
+    version = models.BigIntegerField(default=0)
+
+    objects = UserShardedManager()
+
+
+class SaleProductRollup(models.Model):
+    """
+    Running totals of a user's sales of one product. Rows are created in the
+    order the products were first sold, which is used to break ties.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name="sale_product_rollups",
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    product = models.TextField()
+    sale_count = models.IntegerField(default=0)
+    sales_number = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    objects = UserShardedManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="unique_sale_product_rollup"
+            )
+        ]
+
+
+class SaleProductDayRollup(models.Model):
+    """
+    Running totals of a user's sales of one product on one day, for the
+    leaderboards over a time window (see ``app.statistics``).
+    """
+
+    user = models.ForeignKey(
+        User, related_name="+", on_delete=models.CASCADE, db_constraint=False
+    )
+    product = models.TextField()
+    date = models.DateField()
+    sale_count = models.IntegerField(default=0)
+    sales_number = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    objects = UserShardedManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "date", "product"],
+                name="unique_sale_product_day_rollup",
+            )
+        ]
+
+
+class SaleProductDayTotal(models.Model):
+    """
+    Running totals of the sales of one product on one day, over the users
+    whose sales are in this database: the sums of ``SaleProductDayRollup``.
+    """
+
+    product = models.TextField()
+    date = models.DateField()
+    sale_count = models.IntegerField(default=0)
+    sales_number = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product"], name="unique_sale_product_day_total"
+            )
+        ]
+
+
+class SaleQueueCursor(models.Model):
+    """
+    Id of the last item of the write-behind queue (see ``app.sale_queue``)
+    inserted into this database, written in the same transaction as its
+    sale. A single row, on every database holding sales.
+    """
+
+    last_item_id = models.BigIntegerField(default=0)
+
+
+class SaleVersion(models.Model):
+    """
+    Counter of the changes to the sales of this database, advanced in the
+    transaction of each of them (see ``app.rollups``), for the validators of
+    ``app.conditional``. A single row, on every database holding sales.
+
+    ``rewrites`` only counts the changes to existing sales (updates, deletes,
+    moves), which the snapshot of ``app.analytics`` cannot append.
+    """
+
+    version = models.BigIntegerField(default=0)
+    rewrites = models.BigIntegerField(default=0)
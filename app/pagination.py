@@ -0,0 +1,126 @@
+import base64
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework import pagination
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SaleKeysetPagination(pagination.BasePagination):
+    """
+    Keyset pagination of sales ordered by (date, id).
+
+    Each page starts right after the (date, id) of the previous page's last
+    row, so fetching a deep page costs the same as fetching the first one.
+    Pagination is opt-in: requests without a ``cursor`` or ``page_size``
+    parameter get the full, unpaginated list.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_query_description = _("The pagination cursor value.")
+    page_size_query_param = "page_size"
+    page_size_query_description = _("Number of results to return per page.")
+    invalid_cursor_message = _("Invalid cursor")
+
+    def is_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+    def get_page_size(self, request):
+        try:
+            return pagination._positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=settings.SALE_MAX_PAGE_SIZE,
+            )
+        except (KeyError, ValueError):
+            return settings.SALE_PAGE_SIZE
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            date, pk = (
+                base64.urlsafe_b64decode(encoded.encode("ascii"))
+                .decode("ascii")
+                .split("|")
+            )
+            return datetime.date.fromisoformat(date), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, sale):
+        # ``sale`` is a Sale or a row with date and id attributes.
+        position = f"{sale.date.isoformat()}|{sale.id}"
+        return base64.urlsafe_b64encode(position.encode("ascii")).decode("ascii")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by("date", "id")
+        position = self.decode_cursor(request)
+        if position is not None:
+            date, pk = position
+            # The redundant date__gte bound lets the (user, date) index seek
+            # straight to the position instead of walking up to it.
+            queryset = queryset.filter(
+                Q(date__gt=date) | Q(date=date, id__gt=pk), date__gte=date
+            )
+
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_fields(self, view):
+        return [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.String(
+                    title="Cursor", description=str(self.cursor_query_description)
+                ),
+            ),
+            coreapi.Field(
+                name=self.page_size_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.Integer(
+                    title="Page size",
+                    description=str(self.page_size_query_description),
+                ),
+            ),
+        ]
@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+from rest_framework import exceptions, parsers
+
+
+class InvalidLine:
+    """Placeholder for an NDJSON line that is not valid JSON."""
+
+    def __init__(self, detail):
+        self.detail = detail
+
+
+class NDJSONParser(parsers.BaseParser):
+    """
+    Parse newline delimited JSON into a list with one item per non-blank line.
+    Lines that fail to decode become ``InvalidLine`` items instead of failing
+    the whole body, so bulk endpoints can report them per row.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        rows = []
+        # Split on b"\n" only: decoded text would also split on U+2028,
+        # U+0085... which may be in the strings of a row.
+        for number, line in enumerate(iter(stream.readline, b""), 1):
+            try:
+                line = line.decode(encoding)
+            except UnicodeDecodeError as exc:
+                raise exceptions.ParseError(
+                    f"NDJSON parse error - line {number}: {exc}"
+                )
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as exc:
+                rows.append(InvalidLine(f"JSON parse error - {exc}"))
+        return rows
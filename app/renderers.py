@@ -0,0 +1,35 @@
+from rest_framework import renderers
+
+import app.export as export
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline delimited JSON: one object per line. Streaming views write the
+    lines themselves; this renders regular (e.g. error) responses.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        return "".join(export.ndjson_line(row) for row in rows).encode(self.charset)
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not data:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        fields = list(rows[0])
+        lines = [export.csv_line(fields)]
+        lines += [export.csv_line([row.get(field) for field in fields]) for row in rows]
+        return "".join(lines).encode(self.charset)
@@ -0,0 +1,173 @@
+"""
+Read replicas of the SQLite databases.
+
+``DATABASE_REPLICAS`` maps databases to a replica each (see
+``huy.settings_replica``): a copy of the database file refreshed by
+``manage.py sync_replica`` with SQLite's online backup API. Each sync leaves
+the time it started in a file next to the replica, so the replica holds
+everything committed before that time.
+
+``ReplicaReadMiddleware`` lets the reads of safe (GET, HEAD, OPTIONS)
+requests go to the replicas, through ``ReplicaRouter``, unless:
+
+- the replica lags more than ``REPLICA_MAX_LAG`` seconds;
+- the client wrote since the last sync: clients, told apart by their
+  Authorization header or session cookie, read their own writes;
+- the model is a user, token, session... so a token created by a login is
+  found by the very next request.
+
+The ETags of conditional GETs (see ``app.conditional``) are read from the
+same database as the body: a replica that is behind answers with the
+validators of its own, older data, and a client revalidating once the
+replica caught up gets the new body.
+"""
+
+import contextlib
+import contextvars
+import hashlib
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+import app.caching as caching
+
+PRIMARY_ONLY_APPS = {"admin", "auth", "authtoken", "contenttypes", "sessions"}
+
+# Databases to read from instead of their primary, during a safe request
+_read_from = contextvars.ContextVar("replica_read_from", default={})
+
+
+def primary_of(alias):
+    for primary, replica in settings.DATABASE_REPLICAS.items():
+        if replica == alias:
+            return primary
+    return alias
+
+
+def for_read(alias):
+    """The database to read what lives on ``alias`` from."""
+    return _read_from.get().get(alias, alias)
+
+
+def _synced_path(replica):
+    return f"{settings.DATABASES[replica]['NAME']}.synced"
+
+
+def synced_at(replica):
+    """When the last sync of ``replica`` started, or None if it never ran."""
+    try:
+        with open(_synced_path(replica)) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def lags():
+    """Seconds each replica is behind its database, for the synced ones."""
+    now = time.time()
+    return {
+        replica: now - synced
+        for replica in settings.DATABASE_REPLICAS.values()
+        if (synced := synced_at(replica)) is not None
+    }
+
+
+def sync(primary, replica):
+    """
+    Copy the database ``primary`` to ``replica`` in one step, which holds a
+    read transaction on ``primary`` only: writers carry on in WAL mode.
+    Returns the seconds taken.
+    """
+    started = time.time()
+    source = sqlite3.connect(settings.DATABASES[primary]["NAME"])
+    try:
+        target = sqlite3.connect(
+            settings.DATABASES[replica]["NAME"],
+            timeout=settings.DATABASES[replica].get("OPTIONS", {}).get("timeout", 5),
+        )
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    path = _synced_path(replica)
+    with open(f"{path}.tmp", "w") as f:
+        f.write(repr(started))
+    os.replace(f"{path}.tmp", path)
+    return time.time() - started
+
+
+def client_key(request):
+    """Who made ``request``, for read-your-writes; None if anonymous."""
+    credentials = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credentials:
+        return None
+    return "replica:write:" + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def wrote(key):
+    """Remember that the client ``key`` just wrote."""
+    caching.get_cache().set(key, time.time(), settings.REPLICA_MAX_LAG)
+
+
+@contextlib.contextmanager
+def reading_from_replicas(key):
+    """Read from the replicas holding what the client ``key`` wrote."""
+    last_write = caching.get_cache().get(key) if key else None
+    not_before = max(last_write or 0, time.time() - settings.REPLICA_MAX_LAG)
+    token = _read_from.set(
+        {
+            primary: replica
+            for primary, replica in settings.DATABASE_REPLICAS.items()
+            if (synced_at(replica) or 0) > not_before
+        }
+    )
+    try:
+        yield
+    finally:
+        _read_from.reset(token)
+
+
+@contextlib.contextmanager
+def reading_from_primaries():
+    """Read from the primaries, even during ``reading_from_replicas``."""
+    token = _read_from.set({})
+    try:
+        yield
+    finally:
+        _read_from.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router of ``huy.settings_replica``: reads go to the replica of
+    "default" while ``reading_from_replicas``, writes go to "default".
+    """
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        primary = self.db_for_write(model, **hints)
+        if model._meta.app_label in PRIMARY_ONLY_APPS or (
+            model._meta.label_lower == settings.AUTH_USER_MODEL.lower()
+        ):
+            return primary
+        return for_read(primary)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of their database, migrations included.
+        if db in settings.DATABASE_REPLICAS.values():
+            return False
+        return None
@@ -0,0 +1,434 @@
+"""
+Incremental maintenance of the per-user sale rollups.
+
+Every create, update and delete of a ``Sale`` adjusts the matching
+``SaleUserRollup``, ``SaleProductRollup``, ``SaleProductDayRollup`` and
+``SaleProductDayTotal`` rows (see ``app.signals``), so statistics can be read
+without scanning the sales table. Code inserting sales
+with ``bulk_create`` applies them with ``sales_created``, and ``rebuild``
+recomputes the rollups from scratch, e.g. after writes through raw SQL.
+
+Each of them also advances the ``SaleVersion`` of the database, and stamps
+the ``SaleUserRollup`` of the users whose sales changed with it: the
+validators of ``app.conditional``, committed with the sales.
+
+Rollups live on the database of their user's sales (see ``app.sharding``).
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery, Sum
+
+import app.caching as caching
+import app.models as models
+import app.sharding as sharding
+
+SALE_FIELDS = ("user_id", "product", "date", "sales_number", "revenue")
+
+
+def sale_values(sale):
+    values = {field: getattr(sale, field) for field in SALE_FIELDS}
+    # Sales may be saved with their date as a string.
+    values["date"] = models.Sale._meta.get_field("date").to_python(values["date"])
+    return values
+
+
+TOTAL_FIELDS = ("sale_count", "sales_number", "revenue")
+
+# Keys looked up, and rows updated, per query by _add_many
+ROLLUP_BATCH_SIZE = 100
+
+
+def _totals(values):
+    return {
+        "sale_count": 1,
+        "sales_number": values["sales_number"],
+        "revenue": values["revenue"],
+    }
+
+
+def _add_to_rollup(rollups, totals, **lookup):
+    updated = rollups.filter(**lookup).update(
+        **{field: F(field) + totals[field] for field in TOTAL_FIELDS}
+    )
+    if not updated:
+        rollups.create(**lookup, **totals)
+
+
+def _remove_from_rollup(rollups, totals, **lookup):
+    # Never create rows when removing a sale: the user may be in the middle
+    # of being deleted.
+    rollups.filter(**lookup).update(
+        **{field: F(field) - totals[field] for field in TOTAL_FIELDS}
+    )
+    rollups.filter(**lookup, sale_count__lte=0).delete()
+
+
+def _sum_totals(totals_by_key, key, totals):
+    if key in totals_by_key:
+        for field, value in totals.items():
+            totals_by_key[key][field] += value
+    else:
+        totals_by_key[key] = dict(totals)
+
+
+def _add_many(rollups, key_fields, deltas):
+    """
+    Add ``deltas``, totals by tuple of ``key_fields`` values, to ``rollups``
+    in a few queries per ``ROLLUP_BATCH_SIZE`` keys rather than per key.
+    Missing rows are created and rows left without sales deleted.
+    """
+    keys = list(deltas)
+    found = {}
+    for start in range(0, len(keys), ROLLUP_BATCH_SIZE):
+        lookup = Q()
+        for key in keys[start : start + ROLLUP_BATCH_SIZE]:
+            lookup |= Q(**dict(zip(key_fields, key)))
+        for row in rollups.filter(lookup).only("pk", *key_fields):
+            found[tuple(getattr(row, field) for field in key_fields)] = row
+    for key, row in found.items():
+        for field in TOTAL_FIELDS:
+            setattr(row, field, F(field) + deltas[key][field])
+    rollups.bulk_update(found.values(), TOTAL_FIELDS, batch_size=ROLLUP_BATCH_SIZE)
+    rollups.bulk_create(
+        [
+            rollups.model(**dict(zip(key_fields, key)), **totals)
+            for key, totals in deltas.items()
+            if key not in found and totals["sale_count"] > 0
+        ],
+        batch_size=ROLLUP_BATCH_SIZE,
+    )
+    emptied = [row.pk for key, row in found.items() if deltas[key]["sale_count"] < 0]
+    for start in range(0, len(emptied), ROLLUP_BATCH_SIZE):
+        rollups.filter(
+            pk__in=emptied[start : start + ROLLUP_BATCH_SIZE], sale_count__lte=0
+        ).delete()
+
+
+def _adjust(values, sign):
+    totals = _totals(values)
+    user_id, product = values["user_id"], values["product"]
+    db = sharding.shard_for(user_id)
+    user_rollups = models.SaleUserRollup.objects.using(db)
+    product_rollups = models.SaleProductRollup.objects.using(db)
+    day_rollups = models.SaleProductDayRollup.objects.using(db)
+    day_totals = models.SaleProductDayTotal.objects.using(db)
+    day = {"product": product, "date": values["date"]}
+    if sign > 0:
+        _add_to_rollup(user_rollups, totals, user_id=user_id)
+        _add_to_rollup(product_rollups, totals, user_id=user_id, product=product)
+        _add_to_rollup(day_rollups, totals, user_id=user_id, **day)
+        _add_to_rollup(day_totals, totals, **day)
+    else:
+        _remove_from_rollup(day_totals, totals, **day)
+        _remove_from_rollup(day_rollups, totals, user_id=user_id, **day)
+        _remove_from_rollup(product_rollups, totals, user_id=user_id, product=product)
+        _remove_from_rollup(user_rollups, totals, user_id=user_id)
+
+
+def _advance(db, user_ids=None, rewritten=False):
+    """
+    Advance the version of ``db`` and stamp the rollups of ``user_ids``, all
+    users if None, with it. ``rewritten`` tells that existing sales were
+    changed, which also advances the rewrites of ``db``.
+    """
+    versions = models.SaleVersion.objects.using(db)
+    rewrites = {"rewrites": F("rewrites") + 1} if rewritten else {}
+    if not versions.filter(pk=1).update(version=F("version") + 1, **rewrites):
+        versions.create(pk=1, version=1, rewrites=int(rewritten))
+    user_rollups = models.SaleUserRollup.objects.using(db)
+    if user_ids is not None:
+        user_rollups = user_rollups.filter(user_id__in=user_ids)
+    user_rollups.update(version=Subquery(versions.filter(pk=1).values("version")))
+
+
+def highest_revenue_sale(user_id):
+    # Ties are broken by id, i.e. the first sale that reached the maximum wins.
+    return (
+        models.Sale.objects.for_user(user_id)
+        .order_by("-revenue", "id")
+        .values("id", "revenue")
+        .first()
+    )
+
+
+def refresh_max_sale(user_id):
+    highest = highest_revenue_sale(user_id)
+    models.SaleUserRollup.objects.for_user(user_id).update(
+        max_sale_id=highest["id"] if highest else None,
+        max_revenue=highest["revenue"] if highest else None,
+    )
+
+
+def _offer_max_sale(sale, lowered):
+    rollup = (
+        models.SaleUserRollup.objects.for_user(sale.user_id)
+        .values("max_sale_id", "max_revenue")
+        .first()
+    )
+    if rollup is None:
+        return
+    if rollup["max_sale_id"] is None or (rollup["max_sale_id"] == sale.id and lowered):
+        refresh_max_sale(sale.user_id)
+    elif sale.revenue > rollup["max_revenue"] or (
+        sale.revenue == rollup["max_revenue"] and sale.id < rollup["max_sale_id"]
+    ):
+        models.SaleUserRollup.objects.for_user(sale.user_id).update(
+            max_sale_id=sale.id, max_revenue=sale.revenue
+        )
+
+
+def sale_saved(sale, previous=None):
+    """
+    Apply a created or updated sale. ``previous`` holds the ``sale_values`` of
+    the row before an update.
+    """
+    db = sharding.shard_for(sale.user_id)
+    rewritten = previous is not None
+    # Without a savepoint: a failure rolls back the write of the sale too,
+    # whose transaction this usually is (see Sale.save).
+    with transaction.atomic(using=db, savepoint=False):
+        user_ids = {sale.user_id}
+        if previous is not None:
+            _adjust(previous, -1)
+            user_ids.add(previous["user_id"])
+        _adjust(sale_values(sale), 1)
+        if previous is not None and previous["user_id"] != sale.user_id:
+            refresh_max_sale(previous["user_id"])
+            previous = None
+        _offer_max_sale(
+            sale,
+            lowered=previous is not None and sale.revenue < previous["revenue"],
+        )
+        _advance(db, user_ids, rewritten)
+
+
+def sale_deleted(sale):
+    db = sharding.shard_for(sale.user_id)
+    with transaction.atomic(using=db, savepoint=False):
+        _adjust(sale_values(sale), -1)
+        rollup = (
+            models.SaleUserRollup.objects.for_user(sale.user_id)
+            .values("max_sale_id")
+            .first()
+        )
+        if rollup is not None and rollup["max_sale_id"] in (None, sale.id):
+            refresh_max_sale(sale.user_id)
+        _advance(db, [sale.user_id], rewritten=True)
+
+
+def sales_created(sales):
+    """
+    Apply sales inserted with ``bulk_create``, which sends no signals. Deltas
+    are summed per user and per product first, so a batch costs a few
+    queries per user and product rather than per sale.
+    """
+    user_totals, product_totals, highest = {}, {}, {}
+    # By database, see app.sharding
+    day_totals, product_day_totals = {}, {}
+    for sale in sales:
+        values = sale_values(sale)
+        totals = _totals(values)
+        db = sharding.shard_for(sale.user_id)
+        _sum_totals(user_totals, sale.user_id, totals)
+        _sum_totals(product_totals, (sale.user_id, sale.product), totals)
+        _sum_totals(
+            day_totals.setdefault(db, {}),
+            (sale.user_id, sale.product, values["date"]),
+            totals,
+        )
+        _sum_totals(
+            product_day_totals.setdefault(db, {}),
+            (sale.product, values["date"]),
+            totals,
+        )
+        highest[sale.user_id] = max(
+            highest.get(sale.user_id, sale.revenue), sale.revenue
+        )
+
+    with sharding.atomic(user_totals):
+        for user_id, totals in user_totals.items():
+            _add_to_rollup(
+                models.SaleUserRollup.objects.using(sharding.shard_for(user_id)),
+                totals,
+                user_id=user_id,
+            )
+        for (user_id, product), totals in product_totals.items():
+            _add_to_rollup(
+                models.SaleProductRollup.objects.using(sharding.shard_for(user_id)),
+                totals,
+                user_id=user_id,
+                product=product,
+            )
+        for user_id, revenue in highest.items():
+            rollup = (
+                models.SaleUserRollup.objects.for_user(user_id)
+                .values("max_revenue")
+                .first()
+            )
+            # bulk_create does not return ids on SQLite, so a new maximum is
+            # looked up rather than taken from the batch.
+            if rollup["max_revenue"] is None or revenue > rollup["max_revenue"]:
+                refresh_max_sale(user_id)
+        # Sales spread over many days touch many more rows, updated in bulk.
+        for db, totals in day_totals.items():
+            _add_many(
+                models.SaleProductDayRollup.objects.using(db),
+                ("user_id", "product", "date"),
+                totals,
+            )
+            _add_many(
+                models.SaleProductDayTotal.objects.using(db),
+                ("product", "date"),
+                product_day_totals[db],
+            )
+        for db in sharding.shards_for(user_totals):
+            _advance(db, user_totals)
+        caching.bump_sales_versions(user_totals)
+
+
+def rebuild(user_ids=None):
+    """
+    Recompute the rollups of ``user_ids`` (all users when None) from the
+    sales table. Returns the number of user rollups written.
+    """
+    created = 0
+    with sharding.atomic(user_ids):
+        for db in sharding.shards_for(user_ids):
+            created += _rebuild(db, user_ids)
+            # Rebuilt after sales were updated in bulk (import_data) or
+            # moved in (rebalance_sales)
+            _advance(db, user_ids, rewritten=True)
+        caching.bump_sales_versions(user_ids or [])
+    return created
+
+
+def delete_rollups(db, user_ids):
+    """
+    Delete the rollups of ``user_ids`` on ``db``, and take them out of its
+    day totals, e.g. once their sales moved to another database.
+    """
+    _forget_days(db, user_ids)
+    models.SaleProductRollup.objects.using(db).filter(user_id__in=user_ids).delete()
+    models.SaleUserRollup.objects.using(db).filter(user_id__in=user_ids).delete()
+    _advance(db, [], rewritten=True)
+
+
+def _day_totals(rows, key_fields, count=Sum("sale_count")):
+    """Totals of the day rollups, or sales, ``rows`` by ``key_fields``."""
+    return {
+        tuple(row[field] for field in key_fields): {
+            "sale_count": row["total_count"],
+            "sales_number": row["total_number"],
+            "revenue": row["total_revenue"],
+        }
+        for row in rows.values(*key_fields).annotate(
+            total_count=count,
+            total_number=Sum("sales_number"),
+            total_revenue=Sum("revenue"),
+        )
+    }
+
+
+def _forget_days(db, user_ids):
+    days = models.SaleProductDayRollup.objects.using(db).filter(user_id__in=user_ids)
+    removed = _day_totals(days.order_by(), ("product", "date"))
+    _add_many(
+        models.SaleProductDayTotal.objects.using(db),
+        ("product", "date"),
+        {
+            key: {field: -value for field, value in totals.items()}
+            for key, totals in removed.items()
+        },
+    )
+    days.delete()
+
+
+def _rebuild_days(db, sales, user_ids):
+    if user_ids is None:
+        models.SaleProductDayRollup.objects.using(db).delete()
+        models.SaleProductDayTotal.objects.using(db).delete()
+    else:
+        # The day totals of the other users are kept, which assumes they
+        # match their day rollups.
+        _forget_days(db, user_ids)
+    days = _day_totals(
+        sales.order_by(), ("user_id", "product", "date"), count=Count("id")
+    )
+    models.SaleProductDayRollup.objects.using(db).bulk_create(
+        (
+            models.SaleProductDayRollup(
+                user_id=user_id, product=product, date=date, **totals
+            )
+            for (user_id, product, date), totals in days.items()
+        ),
+        batch_size=ROLLUP_BATCH_SIZE * 10,
+    )
+    product_days = {}
+    for (user_id, product, date), totals in days.items():
+        _sum_totals(product_days, (product, date), totals)
+    _add_many(
+        models.SaleProductDayTotal.objects.using(db), ("product", "date"), product_days
+    )
+
+
+def _rebuild(db, user_ids):
+    sales = models.Sale.objects.using(db)
+    user_rollups = models.SaleUserRollup.objects.using(db)
+    product_rollups = models.SaleProductRollup.objects.using(db)
+    if user_ids is not None:
+        sales = sales.filter(user_id__in=user_ids)
+        user_rollups = user_rollups.filter(user_id__in=user_ids)
+        product_rollups = product_rollups.filter(user_id__in=user_ids)
+
+    highest = (
+        models.Sale.objects.using(db)
+        .filter(user_id=OuterRef("user_id"))
+        .order_by("-revenue", "id")
+    )
+    users = (
+        sales.values("user_id")
+        .annotate(
+            total_count=Count("id"),
+            total_number=Sum("sales_number"),
+            total_revenue=Sum("revenue"),
+            max_sale_id=Subquery(highest.values("id")[:1]),
+            max_revenue=Subquery(highest.values("revenue")[:1]),
+        )
+        .order_by("user_id")
+    )
+    products = (
+        sales.values("user_id", "product")
+        .annotate(
+            total_count=Count("id"),
+            total_number=Sum("sales_number"),
+            total_revenue=Sum("revenue"),
+            first_id=Min("id"),
+        )
+        .order_by("first_id")
+    )
+
+    product_rollups.delete()
+    user_rollups.delete()
+    created = models.SaleUserRollup.objects.using(db).bulk_create(
+        models.SaleUserRollup(
+            user_id=row["user_id"],
+            sale_count=row["total_count"],
+            sales_number=row["total_number"],
+            revenue=row["total_revenue"],
+            max_sale_id=row["max_sale_id"],
+            max_revenue=row["max_revenue"],
+        )
+        for row in users.iterator()
+    )
+    models.SaleProductRollup.objects.using(db).bulk_create(
+        models.SaleProductRollup(
+            user_id=row["user_id"],
+            product=row["product"],
+            sale_count=row["total_count"],
+            sales_number=row["total_number"],
+            revenue=row["total_revenue"],
+        )
+        for row in products.iterator()
+    )
+    _rebuild_days(db, sales, user_ids)
+    return len(created)
@@ -0,0 +1,221 @@
+"""
+Write-behind queue of the sales created through /api/v1/sales/.
+
+With ``SALE_QUEUE_PATH`` set, ``SaleListView`` validates a new sale, appends
+it to the queue, a SQLite database of its own, and answers 202 Accepted with
+the id of the queued item. ``manage.py drain_sale_queue`` inserts the queued
+sales in batches, with one transaction per batch and sales database, like
+/sales/bulk/. A burst of POSTs then costs one short insert into the queue
+each, instead of a transaction on the sales database with its rollup
+updates, and the sales database is left with a single writer.
+
+Every sales database keeps the id of the last item it received in
+``SaleQueueCursor``, committed with the sales, so a drain interrupted before
+marking its items as done does not insert them twice.
+"""
+
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, status
+
+import app.models as models
+import app.rollups as rollups
+import app.serializers as serializers
+import app.sharding as sharding
+
+QUEUED, CREATED, FAILED = "queued", "created", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sale_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    sale_id INTEGER,
+    errors TEXT,
+    queued_at REAL NOT NULL,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS sale_queue_queued
+    ON sale_queue (user_id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS sale_queue_done ON sale_queue (done_at);
+"""
+
+
+class QueueFull(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Too many sales waiting to be saved, try again later.")
+    default_code = "sale_queue_full"
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+_local = threading.local()
+
+
+def _connection():
+    # One connection per thread and queue file
+    path = settings.SALE_QUEUE_PATH
+    connection = getattr(_local, "connection", None)
+    if connection is None or _local.path != path:
+        # Autocommit: transactions are opened explicitly.
+        connection = sqlite3.connect(path, isolation_level=None, timeout=5)
+        connection.row_factory = sqlite3.Row
+        # Like the sales database under huy.settings_sqlite: a crash of the
+        # server loses no accepted sale, a power loss can lose the last ones.
+        connection.execute("PRAGMA journal_mode = wal")
+        connection.execute("PRAGMA synchronous = normal")
+        connection.executescript(SCHEMA)
+        _local.connection, _local.path = connection, path
+    return connection
+
+
+def close():
+    connection = getattr(_local, "connection", None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+@contextlib.contextmanager
+def _transaction(connection, mode="DEFERRED"):
+    connection.execute(f"BEGIN {mode}")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def enqueue(user_id, data):
+    """
+    Queue a sale of ``user_id`` with the validated fields ``data``; returns
+    the id of the queued item. Raises ``Throttled`` when the user has
+    ``SALE_QUEUE_MAX_PENDING_PER_USER`` sales queued already, and
+    ``QueueFull`` when everyone has ``SALE_QUEUE_MAX_PENDING``.
+    """
+    connection = _connection()
+    # IMMEDIATE: the limits are checked and the item added under one lock.
+    with _transaction(connection, "IMMEDIATE"):
+        user_pending, pending = connection.execute(
+            "SELECT coalesce(sum(user_id = ?), 0), count(*) "
+            "FROM sale_queue WHERE status = 'queued'",
+            [user_id],
+        ).fetchone()
+        if user_pending >= settings.SALE_QUEUE_MAX_PENDING_PER_USER:
+            raise exceptions.Throttled(wait=settings.SALE_QUEUE_RETRY_AFTER)
+        if pending >= settings.SALE_QUEUE_MAX_PENDING:
+            raise QueueFull(wait=settings.SALE_QUEUE_RETRY_AFTER)
+        item_id = connection.execute(
+            "INSERT INTO sale_queue (user_id, data, queued_at) VALUES (?, ?, ?)",
+            [user_id, json.dumps(data, cls=DjangoJSONEncoder), time.time()],
+        ).lastrowid
+    return item_id
+
+
+def get(item_id):
+    """The queued item ``item_id`` as a dict, or None."""
+    row = (
+        _connection()
+        .execute(
+            "SELECT id, user_id, status, sale_id, errors FROM sale_queue WHERE id = ?",
+            [item_id],
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    item = dict(row)
+    item["errors"] = json.loads(item["errors"]) if item["errors"] else None
+    return item
+
+
+def _insert(db, items):
+    """
+    Insert the sales of ``items``, (item id, sale) pairs for users of
+    ``db``, skipping those inserted by an interrupted drain. Returns the
+    sale id of each item, None for the skipped ones.
+    """
+    with transaction.atomic(using=db):
+        cursor = models.SaleQueueCursor.objects.using(db).get_or_create(pk=1)[0]
+        sales = [sale for item_id, sale in items if item_id > cursor.last_item_id]
+        models.Sale.objects.using(db).bulk_create(sales)
+        # bulk_create does not return ids on SQLite, but those of a single
+        # transaction are consecutive: they are the last ones.
+        ids = (
+            models.Sale.objects.using(db)
+            .order_by("-id")
+            .values_list("id", flat=True)[: len(sales)]
+        )
+        for sale, sale_id in zip(sales, list(ids)[::-1]):
+            sale.id = sale_id
+        rollups.sales_created(sales)
+        cursor.last_item_id = max(item_id for item_id, sale in items)
+        cursor.save(update_fields=["last_item_id"])
+    return {item_id: sale.id for item_id, sale in items}
+
+
+def drain(batch_size=None):
+    """
+    Insert the sales of the oldest ``batch_size`` queued items (default
+    ``SALE_BULK_BATCH_SIZE``). Returns the number of items processed, 0 once
+    the queue is empty.
+    """
+    connection = _connection()
+    rows = connection.execute(
+        "SELECT id, user_id, data FROM sale_queue WHERE status = 'queued' "
+        "ORDER BY id LIMIT ?",
+        [batch_size or settings.SALE_BULK_BATCH_SIZE],
+    ).fetchall()
+    users = set(
+        models.User.objects.filter(pk__in={row["user_id"] for row in rows}).values_list(
+            "pk", flat=True
+        )
+    )
+    serializer = serializers.SaleSerializer()
+    by_db, errors = {}, {}
+    for row in rows:
+        if row["user_id"] not in users:
+            errors[row["id"]] = {"non_field_errors": ["The user no longer exists."]}
+            continue
+        try:
+            data = serializer.run_validation(json.loads(row["data"]))
+        except exceptions.ValidationError as exc:
+            errors[row["id"]] = exc.detail
+            continue
+        by_db.setdefault(sharding.shard_for(row["user_id"]), []).append(
+            (row["id"], models.Sale(**data, user_id=row["user_id"]))
+        )
+    sale_ids = {}
+    for db, items in sorted(by_db.items()):
+        sale_ids.update(_insert(db, items))
+
+    now = time.time()
+    with _transaction(connection):
+        connection.executemany(
+            "UPDATE sale_queue SET status = ?, sale_id = ?, done_at = ? WHERE id = ?",
+            [(CREATED, sale_id, now, item_id) for item_id, sale_id in sale_ids.items()],
+        )
+        connection.executemany(
+            "UPDATE sale_queue SET status = ?, errors = ?, done_at = ? WHERE id = ?",
+            [
+                (FAILED, json.dumps(detail), now, item_id)
+                for item_id, detail in errors.items()
+            ],
+        )
+        connection.execute(
+            "DELETE FROM sale_queue WHERE done_at < ?",
+            [now - settings.SALE_QUEUE_RETENTION],
+        )
+    return len(rows)
@@ -0,0 +1,111 @@
+"""
+The OpenAPI document of the API and the ReDoc page showing it.
+
+Generating the document walks every view and its ``swagger_auto_schema``
+decorators, so it is done once: at deploy time by
+``manage.py build_openapi_schema``, which writes a static file for WhiteNoise
+to serve, or else on first use in each worker process, which then keeps it
+in memory.
+"""
+
+import hashlib
+import os
+import threading
+
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from django.template.loader import render_to_string
+from django.urls import reverse
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import ReDocRenderer
+
+API_INFO = openapi.Info(
+    title="API Documentation",
+    default_version="v1",
+    description="API Description",
+    contact=openapi.Contact(email="havanhuy1997@gmail.com"),
+)
+API_URL = "https://localhost:8000/api/v1"
+
+# Static file name of the built document, and where the build writes it
+STATIC_NAME = "app/openapi.json"
+STATIC_SOURCE = os.path.join(os.path.dirname(__file__), "static", STATIC_NAME)
+
+
+def generate():
+    """Generate the OpenAPI document, as JSON bytes."""
+    from app.urls import api_url_patterns
+
+    generator = OpenAPISchemaGenerator(API_INFO, url=API_URL, patterns=api_url_patterns)
+    return OpenAPICodecJson(validators=[]).encode(
+        generator.get_schema(request=None, public=True)
+    )
+
+
+_lock = threading.Lock()
+_document = None
+_redoc_page = None
+
+
+def get_document():
+    """Return the document and its ETag, generating them on first use."""
+    global _document
+    with _lock:
+        if _document is None:
+            body = generate()
+            _document = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    return _document
+
+
+def static_url():
+    """URL of the built document, or None if it was not built (and collected)."""
+    if not finders.find(STATIC_NAME):
+        return None
+    try:
+        return static(STATIC_NAME)
+    except ValueError:
+        # Missing from the manifest: collectstatic did not run since.
+        return None
+
+
+class _ReDocPageRenderer(ReDocRenderer):
+    def __init__(self, spec_url):
+        self.spec_url = spec_url
+
+    def get_redoc_settings(self):
+        return {**super().get_redoc_settings(), "url": self.spec_url}
+
+
+def get_redoc_page(request):
+    """Return the ReDoc page, rendered on first use."""
+    global _redoc_page
+    with _lock:
+        if _redoc_page is None:
+            spec_url = static_url() or reverse("openapi_document")
+            context = {"request": request}
+            # The page only shows the title and version of the document.
+            swagger = openapi.Swagger(
+                info=API_INFO, _url=API_URL, _prefix="/", paths=openapi.Paths({})
+            )
+            _ReDocPageRenderer(spec_url).set_context(context, swagger)
+            _redoc_page = render_to_string(
+                ReDocRenderer.template, context, request
+            ).encode("utf-8")
+    return _redoc_page
+
+
+def reset():
+    global _document, _redoc_page
+    with _lock:
+        _document = _redoc_page = None
+
+
+def write_static(path=STATIC_SOURCE):
+    """Generate the document and write it to ``path``; return its size."""
+    body = generate()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(body)
+    return len(body)
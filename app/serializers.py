@@ -1,11 +1,33 @@
-from django.contrib.auth import authenticate
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
 
+import app.authentication as authentication
+import app.metrics as metrics
 import app.models as models
 
 
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with metrics.timing("serialize"):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Serializer whose ``data`` counts towards the "serialize" timing of the
+    requests ``PerformanceMiddleware`` measures. Lists of them are timed
+    too when ``Meta.list_serializer_class`` is ``TimedListSerializer``.
+    """
+
+    @property
+    def data(self):
+        with metrics.timing("serialize"):
+            return super().data
+
+
 class AuthTokenSerializer(serializers.Serializer):
     email = serializers.CharField(label=_("email"), write_only=True)
     password = serializers.CharField(
@@ -21,8 +43,8 @@ class AuthTokenSerializer(serializers.Serializer):
         password = attrs.get("password")
 
         if email and password:
-            user = authenticate(
-                request=self.context.get("request"), username=email, password=password
+            user = authentication.verify_credentials(
+                self.context.get("request"), email, password
             )
 
             if not user:
@@ -36,11 +58,12 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(required=False)
 
     class Meta:
         model = models.User
+        list_serializer_class = TimedListSerializer
         fields = [
             "id",
             "username",
@@ -54,11 +77,12 @@ class UserSerializer(serializers.ModelSerializer):
         ]
 
 
-class SaleSerializer(serializers.ModelSerializer):
+class SaleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = serializers.CharField(required=False)
 
     class Meta:
         model = models.Sale
+        list_serializer_class = TimedListSerializer
         fields = [
             "id",
             "product",
@@ -69,9 +93,57 @@ class SaleSerializer(serializers.ModelSerializer):
         ]
 
     def create(self, validated_data):
-        return models.Sale.objects.create(
-            **validated_data, user=self.context["request"].user
-        )
+        user = self.context["request"].user
+        return models.Sale.objects.for_user(user.id).create(**validated_data, user=user)
+
+
+class SaleQueueItemSerializer(TimedSerializerMixin, serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=["queued", "created", "failed"])
+    sale_id = serializers.IntegerField(allow_null=True, required=False)
+    errors = serializers.DictField(allow_null=True, required=False)
+
+
+class DateRangeQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if "start" in attrs and "end" in attrs and attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError(_("start must not be after end."))
+        return attrs
+
+
+class SaleTimeSeriesQuerySerializer(DateRangeQuerySerializer):
+    interval = serializers.ChoiceField(choices=["day", "week", "month"], default="day")
+    product = serializers.CharField(required=False)
+
+
+class SaleLeaderboardQuerySerializer(DateRangeQuerySerializer):
+    by = serializers.ChoiceField(choices=["revenue", "sales_number"], default="revenue")
+    scope = serializers.ChoiceField(choices=["user", "all"], default="user")
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.SALE_LEADERBOARD_MAX_LIMIT, default=10
+    )
+
+
+class SaleLeaderboardEntrySerializer(TimedSerializerMixin, serializers.Serializer):
+    product = serializers.CharField()
+    revenue = serializers.FloatField()
+    sales_number = serializers.IntegerField()
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+
+class SaleTimeSeriesBucketSerializer(TimedSerializerMixin, serializers.Serializer):
+    bucket = serializers.DateField()
+    product = serializers.CharField()
+    revenue = serializers.FloatField()
+    sales_number = serializers.IntegerField()
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
 
 
 class CitySerializer(serializers.ModelSerializer):
@@ -83,11 +155,12 @@ class CitySerializer(serializers.ModelSerializer):
         ]
 
 
-class CountrySerializer(serializers.ModelSerializer):
+class CountrySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     cities = CitySerializer(many=True)
 
     class Meta:
         model = models.Country
+        list_serializer_class = TimedListSerializer
         fields = [
             "id",
             "name",
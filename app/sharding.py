@@ -0,0 +1,161 @@
+"""
+Per-user sharding of the sales.
+
+With ``SALE_SHARDS`` set (see ``huy.settings_sharded``), the sales of a user
+and their rollups live in one of the shard databases, picked from the user
+id; users, tokens, countries and cities stay in "default". As SQLite lets one
+writer at a time into a database, writes for users on different shards no
+longer wait for each other.
+
+The router cannot tell which user a query is about, so code reading or
+writing sales hints the user: ``Sale.objects.for_user(user_id)``, or
+``.on_shard_of(user_id)``. Instances remember their database, and related
+managers of a user (``user.sale_set``) are routed by the router. Queries
+without a user, such as totals over all users, run on every database of
+``databases()`` and combine the results.
+
+Users are mapped to shards with a jump consistent hash (Lamping and Veach,
+2014): adding shards only moves users to the new ones, and
+``manage.py rebalance_sales`` moves their rows. Ids stay unique across
+databases because each numbers its rows from its own range of ``ID_RANGE``
+ids, "default" from the first one; rows moved to a shard appended after
+theirs keep ids below its range, and ``rebalance_sales`` stops at an id
+already taken. A sale's user cannot be changed to a user of another shard.
+"""
+
+import contextlib
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+import app.replicas as replicas
+
+# Models with a table on every database holding sales
+SHARDED_MODELS = {
+    "app.sale",
+    "app.saleuserrollup",
+    "app.saleproductrollup",
+    "app.saleproductdayrollup",
+    "app.saleproductdaytotal",
+    "app.salequeuecursor",
+    "app.saleversion",
+}
+
+ID_RANGE = 1 << 40
+
+
+def jump_hash(key, buckets):
+    """Bucket in ``range(buckets)`` of the integer ``key``."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def databases():
+    """Aliases of the databases holding sales."""
+    return settings.SALE_SHARDS or [DEFAULT_DB_ALIAS]
+
+
+def shard_for(user_id):
+    """Alias of the database holding the sales of ``user_id``."""
+    shards = databases()
+    if len(shards) == 1:
+        return shards[0]
+    return shards[jump_hash(user_id, len(shards))]
+
+
+def shards_for(user_ids):
+    """Aliases of the databases holding the sales of ``user_ids``; all if empty."""
+    if not user_ids:
+        return databases()
+    return sorted({shard_for(user_id) for user_id in user_ids})
+
+
+@contextlib.contextmanager
+def atomic(user_ids):
+    """
+    A transaction on each database holding the sales of ``user_ids``. Each
+    database commits on its own: there is no atomicity across shards.
+    """
+    with contextlib.ExitStack() as stack:
+        for alias in shards_for(user_ids):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def id_range(alias):
+    """First and last id of the rows created on the database ``alias``."""
+    # "default" comes first, the shards after it: no two databases holding
+    # sales number their rows from the same ids.
+    index = (
+        settings.SALE_SHARDS.index(alias) + 1 if alias in settings.SALE_SHARDS else 0
+    )
+    return index * ID_RANGE, (index + 1) * ID_RANGE - 1
+
+
+def reserve_id_range(alias):
+    """
+    Make the sharded tables of ``alias`` number new rows from the start of
+    its id range. Only SQLite is supported, through ``sqlite_sequence``.
+    """
+    start = id_range(alias)[0]
+    connection = connections[alias]
+    if not start or connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for label in sorted(SHARDED_MODELS):
+            table = apps.get_model(label)._meta.db_table
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                [start, table, start],
+            )
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, start, table],
+            )
+
+
+class SaleShardRouter(replicas.ReplicaRouter):
+    """
+    Database router of ``huy.settings_sharded``: sharded models go to the
+    shard of the hinted user or of the user of the instance they are
+    accessed from, everything else to "default". Reads may go to replicas,
+    see ``app.replicas``.
+    """
+
+    def db_for_write(self, model, instance=None, user_id=None, **hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        if instance is not None:
+            if instance._meta.label_lower in SHARDED_MODELS and instance._state.db:
+                return replicas.primary_of(instance._state.db)
+            if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+                return shard_for(instance.pk)
+            if getattr(instance, "user_id", None) is not None:
+                return shard_for(instance.user_id)
+        if user_id is not None:
+            return shard_for(user_id)
+        raise ValueError(
+            f"No shard for this {model.__name__} query: use "
+            f"{model.__name__}.objects.for_user() or .using()"
+        )
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live in "default" but are referenced from every shard.
+        if {obj1._meta.label_lower, obj2._meta.label_lower} & SHARDED_MODELS:
+            return True
+        return super().allow_relation(obj1, obj2, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if super().allow_migrate(db, app_label, model_name, **hints) is False:
+            return False
+        if f"{app_label}.{model_name}" in SHARDED_MODELS:
+            # Also in "default", which holds the sales until rebalance_sales
+            # moves them, and where deleting a user looks for them.
+            return True
+        return db == DEFAULT_DB_ALIAS
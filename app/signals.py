@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import signals
+from django.dispatch import receiver
+import rest_framework.authtoken.models as authtoken_models
+
+import app.authentication as authentication
+import app.caching as caching
+import app.middleware as middleware
+import app.models as models
+import app.rollups as rollups
+import app.sharding as sharding
+
+
+@receiver(signals.pre_save, sender=models.Sale)
+def remember_previous_sale(sender, instance, raw, using, **kwargs):
+    instance._rollup_previous = None
+    if instance.pk is not None and not raw:
+        instance._rollup_previous = (
+            models.Sale.objects.using(using)
+            .filter(pk=instance.pk)
+            .values(*rollups.SALE_FIELDS)
+            .first()
+        )
+
+
+@receiver(signals.post_save, sender=models.Sale)
+def update_rollups_on_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, "_rollup_previous", None)
+    rollups.sale_saved(instance, previous)
+    instance._rollup_previous = None
+    user_ids = {instance.user_id}
+    if previous is not None:
+        user_ids.add(previous["user_id"])
+    caching.bump_sales_versions(user_ids)
+
+
+@receiver(signals.post_delete, sender=models.Sale)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    rollups.sale_deleted(instance)
+    caching.bump_sales_versions([instance.user_id])
+
+
+@receiver(signals.post_delete, sender=models.User)
+def delete_sharded_sales(sender, instance, using, **kwargs):
+    # Deleting the user cascaded to the sales in its own database only.
+    if sharding.shard_for(instance.id) != using:
+        models.Sale.objects.for_user(instance.id).delete()
+        rollups.delete_rollups(sharding.shard_for(instance.id), [instance.id])
+
+
+@receiver(signals.post_save, sender=models.Country)
+@receiver(signals.post_delete, sender=models.Country)
+@receiver(signals.post_save, sender=models.City)
+@receiver(signals.post_delete, sender=models.City)
+def invalidate_countries(sender, **kwargs):
+    caching.bump_version("countries")
+
+
+@receiver(signals.post_delete, sender=authtoken_models.Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    authentication.token_cache.invalidate(key=instance.key)
+
+
+@receiver(signals.post_save, sender=models.User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # Covers deactivation as well as any other change of the cached user.
+    authentication.token_cache.invalidate(user_id=instance.id)
+
+
+@receiver(signals.post_migrate)
+def reserve_sale_ids(sender, using, **kwargs):
+    if sender.name == "app":
+        sharding.reserve_id_range(using)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    connection.execute_wrappers.append(middleware.time_queries)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
@@ -0,0 +1,196 @@
+import datetime
+import heapq
+
+from django.conf import settings
+from django.db.models import F, Sum
+
+import app.caching as caching
+import app.models as models
+import app.sharding as sharding
+
+
+def average_sale(total_revenue, total_number):
+    if not total_number:
+        return None
+    return total_revenue / total_number
+
+
+def _global_totals():
+    totals = {"total_number": None, "total_revenue": None}
+    for db in sharding.databases():
+        shard_totals = models.SaleUserRollup.objects.using(db).aggregate(
+            total_number=Sum("sales_number"), total_revenue=Sum("revenue")
+        )
+        for name, value in shard_totals.items():
+            if value is not None:
+                totals[name] = (totals[name] or 0) + value
+    return totals
+
+
+def global_totals():
+    return caching.get_or_set(
+        "sales", "global_totals", _global_totals, settings.SALE_STATISTICS_CACHE_TIMEOUT
+    )
+
+
+def top_products(user_id):
+    """
+    Return the names of the user's products with the highest revenue and with
+    the highest number of units sold, ties broken by the product sold first.
+    """
+    revenue_product, number_product = None, None
+    highest_revenue, highest_number = float("-inf"), float("-inf")
+    for product, revenue, number_sold in (
+        models.SaleProductRollup.objects.for_user(user_id)
+        .order_by("id")
+        .values_list("product", "revenue", "sales_number")
+    ):
+        if revenue > highest_revenue:
+            highest_revenue, revenue_product = revenue, product
+        if number_sold > highest_number:
+            highest_number, number_product = number_sold, product
+    return revenue_product, number_product
+
+
+def sale_statistics(user_id):
+    current = models.SaleUserRollup.objects.for_user(user_id).first()
+    all_users = global_totals()
+    revenue_product, number_product = top_products(user_id)
+    return {
+        "average_sales_for_current_user": (
+            average_sale(current.revenue, current.sales_number) if current else None
+        ),
+        "average_sale_all_user": average_sale(
+            all_users["total_revenue"], all_users["total_number"]
+        ),
+        "highest_revenue_sale_for_current_user": (
+            {"sale_id": current.max_sale_id, "revenue": current.max_revenue}
+            if current and current.max_sale_id is not None
+            else None
+        ),
+        "product_highest_revenue_for_current_user": {"product_name": revenue_product},
+        "product_highest_sales_number_for_current_user": {
+            "product_name": number_product
+        },
+    }
+
+
+LEADERBOARD_FIELDS = ("revenue", "sales_number")
+
+
+def _in_window(rollups, start, end):
+    if start is not None:
+        rollups = rollups.filter(date__gte=start)
+    if end is not None:
+        rollups = rollups.filter(date__lte=end)
+    return rollups.values("product").annotate(
+        total_revenue=Sum("revenue"), total_number=Sum("sales_number")
+    )
+
+
+def _leaderboard_entries(rows):
+    return [
+        {
+            "product": row["product"],
+            "revenue": row["total_revenue"],
+            "sales_number": row["total_number"],
+        }
+        for row in rows
+    ]
+
+
+def _user_leaderboard(user_id, by, start, end, limit):
+    if start is None and end is None:
+        rows = models.SaleProductRollup.objects.for_user(user_id).annotate(
+            total_revenue=F("revenue"), total_number=F("sales_number")
+        )
+    else:
+        rows = _in_window(
+            models.SaleProductDayRollup.objects.for_user(user_id), start, end
+        )
+    order = "-total_revenue" if by == "revenue" else "-total_number"
+    return _leaderboard_entries(
+        rows.order_by(order, "product").values(
+            "product", "total_revenue", "total_number"
+        )[:limit]
+    )
+
+
+def _global_leaderboard(by, start, end, limit):
+    totals = {}
+    for db in sharding.databases():
+        rows = _in_window(models.SaleProductDayTotal.objects.using(db), start, end)
+        for row in rows.order_by():
+            product = totals.setdefault(
+                row["product"],
+                {"product": row["product"], "total_revenue": 0, "total_number": 0},
+            )
+            product["total_revenue"] += row["total_revenue"]
+            product["total_number"] += row["total_number"]
+    field = "total_revenue" if by == "revenue" else "total_number"
+    return _leaderboard_entries(
+        heapq.nsmallest(
+            limit, totals.values(), key=lambda row: (-row[field], row["product"])
+        )
+    )
+
+
+def product_leaderboard(user_id, by, start=None, end=None, limit=10):
+    """
+    The ``limit`` products of ``user_id``, or of every user if None, with
+    the highest revenue or number of units sold (``by``) between the dates
+    ``start`` and ``end``, both optional. Ties are broken by product name.
+
+    Read from the rollups: a user's totals per product, or the totals per
+    product and day, which a time window sums over its days only.
+    """
+    if user_id is not None:
+        return _user_leaderboard(user_id, by, start, end, limit)
+    return caching.get_or_set(
+        "sales",
+        f"leaderboard:{by}:{start}:{end}:{limit}",
+        lambda: _global_leaderboard(by, start, end, limit),
+        settings.SALE_STATISTICS_CACHE_TIMEOUT,
+    )
+
+
+BUCKETS = {
+    "day": lambda date: date,
+    "week": lambda date: date - datetime.timedelta(days=date.weekday()),
+    "month": lambda date: date.replace(day=1),
+}
+
+
+def sale_time_series(user_id, interval, start=None, end=None, product=None):
+    """
+    Revenue and units sold per product and per day, week (starting on
+    Monday) or month. Buckets without sales are omitted.
+
+    Read from the totals per product and day: the cost grows with the days
+    the user sold on, not with the number of sales. Weeks and months are
+    summed here, as truncating dates in SQLite calls Python for every row.
+    """
+    days = models.SaleProductDayRollup.objects.for_user(user_id).filter(
+        sale_count__gt=0
+    )
+    if start is not None:
+        days = days.filter(date__gte=start)
+    if end is not None:
+        days = days.filter(date__lte=end)
+    if product is not None:
+        days = days.filter(product=product)
+    bucket_of = BUCKETS[interval]
+    buckets = {}
+    for date, product, revenue, sales_number in days.order_by(
+        "date", "product"
+    ).values_list("date", "product", "revenue", "sales_number"):
+        bucket = buckets.setdefault(
+            (bucket_of(date), product),
+            {"revenue": 0, "sales_number": 0},
+        )
+        bucket["revenue"] += revenue
+        bucket["sales_number"] += sales_number
+    return [
+        {"bucket": bucket, "product": product, **totals}
+        for (bucket, product), totals in sorted(buckets.items())
+    ]
@@ -1,11 +1,100 @@
+import asyncio
+import base64
+import collections
+import contextlib
+import datetime
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import base_user
 from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
+import django.http as django_http
 import django.urls as django_url
+import django.utils.http as django_http_utils
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
+import rest_framework.renderers as rest_renderers
 import rest_framework.test as rest_test
 from rest_framework import status
 import rest_framework.authtoken.models as authtoken_models
 
+import app.analytics as analytics
+import app.asgi as asgi
+import app.async_views as async_views
+import app.authentication as authentication
+import app.caching as caching
+import app.export as export
+import app.metrics as metrics
+import app.middleware as middleware
 import app.models as models
+import app.replicas as replicas
+import app.rollups as rollups
+import app.sale_queue as sale_queue
+import app.schema as schema
+import app.serializers as serializers
+import app.sharding as sharding
+import app.signals as signals
+import app.traffic as traffic
+import app.views as views
+import huy.settings_asgi as settings_asgi
+
+
+def sharded_rows(model, *fields, **lookups):
+    """
+    The ``fields`` of the rows of ``model`` matching ``lookups``, sorted, on
+    every database holding sales (see app.sharding).
+    """
+    return sorted(
+        row
+        for db in sharding.databases()
+        for row in model.objects.using(db).filter(**lookups).values_list(*fields)
+    )
+
+
+# The databases of the test cases writing sales, see app.sharding
+SALE_DATABASES = {"default", *settings.SALE_SHARDS}
+
+
+@contextlib.contextmanager
+def assert_num_queries(test, num):
+    """
+    ``test.assertNumQueries(num)`` counting the queries of every database,
+    such as the shards of huy.settings_sharded.
+    """
+    aliases = connections if test.databases == "__all__" else test.databases
+    with contextlib.ExitStack() as stack:
+        contexts = [
+            stack.enter_context(CaptureQueriesContext(connections[alias]))
+            for alias in aliases
+        ]
+        yield
+    queries = [query["sql"] for context in contexts for query in context]
+    test.assertEqual(
+        len(queries),
+        num,
+        f"{len(queries)} queries executed, {num} expected\n" + "\n".join(queries),
+    )
 
 
 class NoAuthAPITest(rest_test.APITestCase):
@@ -47,6 +136,8 @@ class NoAuthAPITest(rest_test.APITestCase):
 
 
 class AuthAPITest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
     def setUp(self):
         self.user = models.User.objects.create_user(
             "user1@gmail.com", "user1@gmail.com", "user1_pass"
@@ -95,10 +186,15 @@ class AuthAPITest(rest_test.APITestCase):
                 "revenue": 7.3,
             },
         ]
-        for sale in self.sales1:
-            models.Sale.objects.create(**sale, user=self.user)
+        # Numbered from the range of the user's database, see app.sharding
+        self.sale_id = min(
+            models.Sale.objects.for_user(self.user.id).create(**sale, user=self.user).id
+            for sale in self.sales1
+        )
         for sale in self.sales2:
-            models.Sale.objects.create(**sale, user=self.another_user)
+            models.Sale.objects.for_user(self.another_user.id).create(
+                **sale, user=self.another_user
+            )
 
     def test_get_all_sales(self):
         response = self.client.get("/api/v1/sales/")
@@ -106,21 +202,21 @@ class AuthAPITest(rest_test.APITestCase):
         self.assertEqual(len(response.json()), len(self.sales1))
 
     def test_get_sale(self):
-        response = self.client.get("/api/v1/sales/1/")
+        response = self.client.get(f"/api/v1/sales/{self.sale_id}/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["id"], 1)
+        self.assertEqual(response.data["id"], self.sale_id)
         self.assertEqual(response.data["product"], "Product1")
 
     def test_update_partial_sale(self):
-        response = self.client.patch("/api/v1/sales/1/", {"revenue": 56})
+        response = self.client.patch(f"/api/v1/sales/{self.sale_id}/", {"revenue": 56})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["id"], 1)
+        self.assertEqual(response.data["id"], self.sale_id)
         self.assertEqual(response.data["product"], "Product1")
         self.assertEqual(response.data["revenue"], 56)
 
     def test_update_sale(self):
         response = self.client.put(
-            "/api/v1/sales/1/",
+            f"/api/v1/sales/{self.sale_id}/",
             {
                 "date": "2011-2-2",
                 "product": "ProductXX",
@@ -132,7 +228,7 @@ class AuthAPITest(rest_test.APITestCase):
         self.assertEqual(
             response.data,
             {
-                "id": 1,
+                "id": self.sale_id,
                 "date": "2011-02-02",
                 "product": "ProductXX",
                 "sales_number": 12,
@@ -142,13 +238,14 @@ class AuthAPITest(rest_test.APITestCase):
         )
 
     def test_delete_sale(self):
-        response = self.client.delete("/api/v1/sales/1/")
+        response = self.client.delete(f"/api/v1/sales/{self.sale_id}/")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
     def test_update_sale_with_auth_of_another_auth(self):
+        sale = models.Sale.objects.for_user(self.user.id).first()
         self.client.force_authenticate(user=self.another_user)
         response = self.client.put(
-            "/api/v1/sales/1/",
+            f"/api/v1/sales/{sale.id}/",
             {
                 "date": "2011-2-2",
                 "product": "ProductXX",
@@ -156,7 +253,8 @@ class AuthAPITest(rest_test.APITestCase):
                 "revenue": 1.3,
             },
         )
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        # As for the sales of users on other shards, see app.sharding
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_sale_statistics(self):
         response = self.client.get(reverse("sale_statistics"))
@@ -167,7 +265,7 @@ class AuthAPITest(rest_test.APITestCase):
         self.assertEqual(round(response.data["average_sale_all_user"], 4), 0.1435)
         self.assertEqual(
             response.data["highest_revenue_sale_for_current_user"],
-            {"sale_id": 1, "revenue": 2.3},
+            {"sale_id": self.sale_id, "revenue": 2.3},
         )
         self.assertEqual(
             response.data["product_highest_revenue_for_current_user"],
@@ -177,3 +275,2315 @@ class AuthAPITest(rest_test.APITestCase):
             response.data["product_highest_sales_number_for_current_user"],
             {"product_name": "Product1"},
         )
+
+    def test_sale_statistics_query_count_is_constant(self):
+        for _ in range(20):
+            models.Sale.objects.for_user(self.user.id).create(
+                **self.sales1[0], user=self.user
+            )
+        # The ETag's, the user's rollups and the global totals, per database
+        with assert_num_queries(self, 3 + len(sharding.databases())):
+            response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_sale_statistics_without_sales(self):
+        user = models.User.objects.create_user(
+            "user3@gmail.com", "user3@gmail.com", "user3_pass"
+        )
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["average_sales_for_current_user"])
+        self.assertEqual(round(response.data["average_sale_all_user"], 4), 0.1435)
+        self.assertIsNone(response.data["highest_revenue_sale_for_current_user"])
+        self.assertEqual(
+            response.data["product_highest_revenue_for_current_user"],
+            {"product_name": None},
+        )
+
+
+class SaleRollupTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.another_user = models.User.objects.create_user(
+            "user2@gmail.com", "user2@gmail.com", "user2_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def rollup_state(self):
+        users = sharded_rows(
+            models.SaleUserRollup,
+            "user_id",
+            "sale_count",
+            "sales_number",
+            "revenue",
+            "max_sale_id",
+        )
+        products = sharded_rows(
+            models.SaleProductRollup,
+            "user_id",
+            "product",
+            "sale_count",
+            "sales_number",
+            "revenue",
+        )
+        days = sharded_rows(
+            models.SaleProductDayRollup,
+            "user_id",
+            "date",
+            "product",
+            "sale_count",
+            "sales_number",
+            "revenue",
+        )
+        day_totals = sharded_rows(
+            models.SaleProductDayTotal,
+            "date",
+            "product",
+            "sale_count",
+            "sales_number",
+            "revenue",
+        )
+        return users, products, days, day_totals
+
+    def day_sale_count(self, **lookups):
+        return sum(
+            count
+            for count, in sharded_rows(
+                models.SaleProductDayTotal, "sale_count", **lookups
+            )
+        )
+
+    def assertRollupsConsistent(self):
+        incremental = self.rollup_state()
+        call_command("rebuild_sale_rollups", stdout=io.StringIO())
+        self.assertEqual(incremental, self.rollup_state())
+
+    def test_rollups_follow_api_writes(self):
+        for sale in [
+            {"date": "2010-2-2", "product": "A", "sales_number": 3, "revenue": 2.5},
+            {"date": "2010-2-3", "product": "B", "sales_number": 4, "revenue": 7.5},
+            {"date": "2010-2-4", "product": "A", "sales_number": 1, "revenue": 1.5},
+        ]:
+            response = self.client.post("/api/v1/sales/", sale)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        rollup = models.SaleUserRollup.objects.for_user(self.user.id).get()
+        self.assertEqual((rollup.sales_number, rollup.revenue), (8, 11.5))
+        self.assertEqual(rollup.max_revenue, 7.5)
+
+        max_sale_id = rollup.max_sale_id
+        self.client.patch(f"/api/v1/sales/{max_sale_id}/", {"revenue": 0.5})
+        self.assertEqual(
+            models.SaleUserRollup.objects.for_user(self.user.id).get().max_revenue, 2.5
+        )
+        self.assertRollupsConsistent()
+
+        self.client.patch(f"/api/v1/sales/{max_sale_id}/", {"product": "A"})
+        self.assertFalse(
+            models.SaleProductRollup.objects.for_user(self.user.id)
+            .filter(product="B")
+            .exists()
+        )
+        self.assertRollupsConsistent()
+
+        self.client.patch(f"/api/v1/sales/{max_sale_id}/", {"date": "2010-2-2"})
+        self.assertEqual(self.day_sale_count(product="A", date="2010-2-2"), 2)
+        self.assertRollupsConsistent()
+
+        for sale in models.Sale.objects.for_user(self.user.id):
+            self.client.delete(f"/api/v1/sales/{sale.id}/")
+        self.assertFalse(models.SaleUserRollup.objects.for_user(self.user.id).exists())
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertIsNone(response.data["highest_revenue_sale_for_current_user"])
+
+    def test_rollups_follow_orm_writes(self):
+        sale = models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="C", sales_number=1, revenue=1
+        )
+        # Sales only change users within a shard, see app.sharding
+        other = self.another_user
+        while sharding.shard_for(other.id) != sharding.shard_for(self.user.id):
+            other = models.User.objects.create_user(f"user{other.id + 1}@gmail.com")
+        sale.user = other
+        sale.save()
+        self.assertRollupsConsistent()
+        sale.delete()
+        self.assertRollupsConsistent()
+        other.delete()
+        self.assertRollupsConsistent()
+
+    def test_failed_rollup_updates_roll_the_write_back(self):
+        sale = models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        state = self.rollup_state()
+        locked = OperationalError("database is locked")
+        for method, path, data in [
+            ("post", "/api/v1/sales/", {"date": "2010-2-3", "product": "B"}),
+            ("patch", f"/api/v1/sales/{sale.id}/", {"revenue": 8}),
+            ("delete", f"/api/v1/sales/{sale.id}/", None),
+        ]:
+            with self.subTest(method):
+                with mock.patch("app.rollups._advance", side_effect=locked):
+                    with self.assertRaises(OperationalError):
+                        getattr(self.client, method)(path, data)
+                self.assertEqual(
+                    list(
+                        models.Sale.objects.for_user(self.user.id).values_list(
+                            "product", "revenue"
+                        )
+                    ),
+                    [("A", 4)],
+                )
+                self.assertEqual(self.rollup_state(), state)
+
+    def test_rollups_follow_bulk_writes(self):
+        rows = [
+            {"date": "2010-2-2", "product": "A", "sales_number": 3, "revenue": 2.5},
+            {"date": "2010-2-3", "product": "A", "sales_number": 4, "revenue": 7.5},
+            {"date": "2010-2-2", "product": "A", "sales_number": 1, "revenue": 1.5},
+        ]
+        models.Sale.objects.for_user(self.another_user.id).create(
+            user=self.another_user, **rows[0]
+        )
+        with override_settings(SALE_BULK_BATCH_SIZE=2):
+            self.client.post(reverse("sales_bulk"), rows, format="json")
+        self.assertEqual(self.day_sale_count(date="2010-2-2"), 3)
+        self.assertRollupsConsistent()
+        rollups.delete_rollups(sharding.shard_for(self.user.id), [self.user.id])
+        self.assertEqual(self.day_sale_count(date="2010-2-2"), 1)
+        rollups.rebuild([self.user.id])
+        self.assertRollupsConsistent()
+
+    def test_statistics_read_rollups(self):
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="B", sales_number=5, revenue=1
+        )
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(
+            response.data["product_highest_revenue_for_current_user"],
+            {"product_name": "A"},
+        )
+        self.assertEqual(
+            response.data["product_highest_sales_number_for_current_user"],
+            {"product_name": "B"},
+        )
+
+
+class VersionedCacheTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.another_user = models.User.objects.create_user(
+            "user2@gmail.com", "user2@gmail.com", "user2_pass"
+        )
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_global_statistics_are_shared_until_a_sale_is_written(self):
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(response.data["average_sale_all_user"], 2)
+        with assert_num_queries(self, 3):
+            self.client.get(reverse("sale_statistics"))
+
+        models.Sale.objects.for_user(self.another_user.id).create(
+            user=self.another_user,
+            date="2010-2-2",
+            product="A",
+            sales_number=2,
+            revenue=8,
+        )
+        with assert_num_queries(self, 3 + len(sharding.databases())):
+            response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(response.data["average_sale_all_user"], 3)
+
+    def test_versions_with_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                        "LOCATION": location,
+                    }
+                }
+            ):
+                computed = []
+
+                def compute():
+                    computed.append(1)
+                    return len(computed)
+
+                self.assertEqual(caching.get_or_set("test", "value", compute, 60), 1)
+                self.assertEqual(caching.get_or_set("test", "value", compute, 60), 1)
+                caching.bump_version("test")
+                self.assertEqual(caching.get_or_set("test", "value", compute, 60), 2)
+
+    def test_workers_need_a_shared_cache(self):
+        self.assertTrue(caching.is_shared())
+        locmem = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        with override_settings(CACHES=locmem):
+            self.assertFalse(caching.is_shared())
+            apps.get_app_config("app").ready()
+            with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "2"}):
+                with self.assertRaises(ImproperlyConfigured):
+                    apps.get_app_config("app").ready()
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+class SaleQueryPlanTest(rest_test.APITestCase):
+    """
+    The hot per-user queries must be answered through an index. A plan line
+    such as "SCAN app_sale" means SQLite reads the whole table.
+    """
+
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+
+    def assertNoFullScan(self, queryset):
+        plan = queryset.explain()
+        full_scans = re.findall(r"SCAN (?:TABLE )?app_\w+", plan)
+        self.assertFalse(
+            full_scans, f"Full table scan in\n{queryset.query}\n\nplan:\n{plan}"
+        )
+
+    def hot_queries(self):
+        view = views.SaleListView()
+        view.request = types.SimpleNamespace(user=self.user)
+        user_sales = models.Sale.objects.for_user(self.user.id)
+        return {
+            "sale list": view.get_queryset(),
+            "sale list page": user_sales.filter(
+                Q(date__gt="2010-02-02") | Q(date="2010-02-02", id__gt=10),
+                date__gte="2010-02-02",
+            ).order_by("date", "id")[:101],
+            "time series": user_sales.filter(date__gte="2010-01-01")
+            .annotate(bucket=TruncMonth("date"))
+            .values("bucket", "product")
+            .annotate(revenue=Sum("revenue")),
+            "sales in date range": user_sales.filter(
+                date__range=("2010-01-01", "2010-12-31")
+            ),
+            "sales by product": user_sales.values("product").annotate(
+                total=Sum("revenue")
+            ),
+            "sales of product": user_sales.filter(product="Paper"),
+            "highest revenue sale": user_sales.order_by("-revenue", "id")[:1],
+            "user rollup": models.SaleUserRollup.objects.for_user(self.user.id),
+            "product rollups": models.SaleProductRollup.objects.for_user(
+                self.user.id
+            ).order_by("id"),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                self.assertNoFullScan(queryset)
+
+
+class SalePaginationTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for day in [3, 1, 2, 1, 3, 1, 2]:
+            models.Sale.objects.for_user(self.user.id).create(
+                user=self.user, date=f"2010-2-{day}", product="A", sales_number=1
+            )
+
+    def test_pages_cover_all_sales_in_date_order(self):
+        expected = list(
+            models.Sale.objects.for_user(self.user.id)
+            .order_by("date", "id")
+            .values_list("id", flat=True)
+        )
+        seen, url = [], "/api/v1/sales/?page_size=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 3)
+            seen += [sale["id"] for sale in page["results"]]
+            url = page["next"]
+        self.assertEqual(seen, expected)
+
+    def test_without_pagination_parameters_returns_a_plain_list(self):
+        response = self.client.get("/api/v1/sales/")
+        self.assertEqual(len(response.json()), 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/v1/sales/?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SaleExportTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for day, product in [(3, "Paper, A4"), (1, "Pen"), (2, "Ruler")]:
+            models.Sale.objects.for_user(self.user.id).create(
+                user=self.user,
+                date=f"2010-2-{day}",
+                product=product,
+                sales_number=day,
+                revenue=day / 3,
+            )
+
+    def serialized_sales(self):
+        sales = models.Sale.objects.for_user(self.user.id).order_by("date", "id")
+        return serializers.SaleSerializer(sales, many=True).data
+
+    def test_ndjson_export_matches_serializer(self):
+        response = self.client.get(reverse("sales_export"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Type"].startswith("application/x-ndjson"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            json.loads(json.dumps(self.serialized_sales())),
+        )
+
+    def test_csv_export_chosen_by_format_or_accept_header(self):
+        for response in [
+            self.client.get(reverse("sales_export") + "?format=csv"),
+            self.client.get(reverse("sales_export"), HTTP_ACCEPT="text/csv"),
+        ]:
+            content = b"".join(response.streaming_content).decode()
+            rows = list(csv.reader(io.StringIO(content)))
+            self.assertEqual(rows[0], list(serializers.SaleSerializer.Meta.fields))
+            self.assertEqual(
+                rows[1:],
+                [
+                    [str(value) for value in sale.values()]
+                    for sale in self.serialized_sales()
+                ],
+            )
+
+
+class SaleBulkTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.rows = [
+            {"date": "2010-2-2", "product": "A", "sales_number": 3, "revenue": 2.5},
+            {"date": "2010-2-3", "product": "B", "sales_number": 4, "revenue": 7.5},
+            {"date": "2010-2-4", "product": "A", "sales_number": 1, "revenue": 1.5},
+        ]
+
+    def assertRollupsMatchRebuild(self):
+        rollup = models.SaleUserRollup.objects.for_user(self.user.id).get()
+        incremental = (rollup.sales_number, rollup.revenue, rollup.max_sale_id)
+        call_command("rebuild_sale_rollups", stdout=io.StringIO())
+        rollup = models.SaleUserRollup.objects.for_user(self.user.id).get()
+        self.assertEqual(
+            incremental, (rollup.sales_number, rollup.revenue, rollup.max_sale_id)
+        )
+
+    def test_bulk_json_array(self):
+        with override_settings(SALE_BULK_BATCH_SIZE=2):
+            response = self.client.post(reverse("sales_bulk"), self.rows, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"created": 3, "errors": []})
+        self.assertEqual(models.Sale.objects.for_user(self.user.id).count(), 3)
+        self.assertRollupsMatchRebuild()
+
+    def test_bulk_ndjson_reports_rejected_rows(self):
+        body = "\n".join(
+            [
+                json.dumps(self.rows[0]),
+                "{not json",
+                json.dumps({"product": "C", "sales_number": 1}),
+                "",
+                json.dumps(self.rows[1]),
+            ]
+        )
+        response = self.client.post(
+            reverse("sales_bulk"), body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([error["index"] for error in response.data["errors"]], [1, 2])
+        self.assertIn("date", response.data["errors"][1]["errors"])
+        self.assertRollupsMatchRebuild()
+
+    def test_bulk_ndjson_with_unicode_line_breaks(self):
+        # Written as such by the export, which does not escape them
+        row = {**self.rows[0], "product": "A\u2028B\u0085C\u2029D"}
+        body = "".join(export.ndjson_line(row) for row in [row, self.rows[1]])
+        response = self.client.post(
+            reverse("sales_bulk"),
+            body.encode(),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"created": 2, "errors": []})
+        self.assertEqual(
+            sorted(
+                models.Sale.objects.for_user(self.user.id).values_list(
+                    "product", flat=True
+                )
+            ),
+            ["A\u2028B\u0085C\u2029D", "B"],
+        )
+
+    def test_bulk_ndjson_with_invalid_utf8(self):
+        body = json.dumps(self.rows[0]).encode() + b"\n\xff\xfe\n"
+        response = self.client.post(
+            reverse("sales_bulk"), body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("NDJSON parse error", response.data["detail"])
+        self.assertEqual(sharded_rows(models.Sale, "id"), [])
+
+    def test_bulk_rejects_everything(self):
+        response = self.client.post(
+            reverse("sales_bulk"), [{"product": "A"}], format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("sales_bulk"), self.rows[0], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SaleQueueTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            SALE_QUEUE_PATH=os.path.join(directory.name, "queue.sqlite3")
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(sale_queue.close)
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def post_sale(self, revenue=2.5):
+        return self.client.post(
+            "/api/v1/sales/",
+            {"date": "2010-2-2", "product": "A", "sales_number": 3, "revenue": revenue},
+        )
+
+    def test_sales_are_saved_by_the_drain(self):
+        response = self.post_sale()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], "queued")
+        location = response["Location"]
+        self.assertEqual(
+            location, reverse("sale_queue_item", args=[response.data["id"]])
+        )
+        self.post_sale(7.5)
+        self.assertEqual(sharded_rows(models.Sale, "id"), [])
+        self.assertEqual(self.client.get(location).data["status"], "queued")
+
+        out = io.StringIO()
+        call_command("drain_sale_queue", stdout=out)
+        self.assertEqual(out.getvalue(), "Drained 2 queued sales\n")
+        item = self.client.get(location).data
+        sale = models.Sale.objects.for_user(self.user.id).get(pk=item["sale_id"])
+        self.assertEqual((item["status"], sale.revenue), ("created", 2.5))
+        rollup = models.SaleUserRollup.objects.for_user(self.user.id).get()
+        self.assertEqual((rollup.sale_count, rollup.revenue), (2, 10))
+
+        other = models.User.objects.create_user("user2@gmail.com", "user2@gmail.com")
+        self.client.force_authenticate(user=other)
+        self.assertEqual(
+            self.client.get(location).status_code, status.HTTP_404_NOT_FOUND
+        )
+
+    def test_invalid_sales_are_not_queued(self):
+        response = self.client.post("/api/v1/sales/", {"product": "A"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sale_queue.drain(), 0)
+
+    def test_sales_of_deleted_users_fail(self):
+        item_id = self.post_sale().data["id"]
+        self.user.delete()
+        self.assertEqual(sale_queue.drain(), 1)
+        item = sale_queue.get(item_id)
+        self.assertEqual(item["status"], "failed")
+        self.assertIn("non_field_errors", item["errors"])
+        self.assertEqual(sharded_rows(models.Sale, "id"), [])
+
+    def test_interrupted_drain_does_not_save_twice(self):
+        item_id = self.post_sale().data["id"]
+        with mock.patch("app.sale_queue._transaction", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                sale_queue.drain()
+        self.assertEqual(sale_queue.get(item_id)["status"], "queued")
+        self.assertEqual(sale_queue.drain(), 1)
+        self.assertEqual(sale_queue.get(item_id)["status"], "created")
+        self.assertEqual(len(sharded_rows(models.Sale, "id")), 1)
+        self.assertEqual(
+            models.SaleUserRollup.objects.for_user(self.user.id).get().sale_count, 1
+        )
+
+    def test_backpressure(self):
+        with override_settings(SALE_QUEUE_MAX_PENDING_PER_USER=1):
+            self.post_sale()
+            response = self.post_sale()
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response["Retry-After"], "5")
+        with override_settings(SALE_QUEUE_MAX_PENDING=1):
+            response = self.post_sale()
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response["Retry-After"], "5")
+        sale_queue.drain()
+        self.assertEqual(self.post_sale().status_code, status.HTTP_202_ACCEPTED)
+
+    def test_drained_sales_change_the_validators(self):
+        etags = {
+            url: self.client.get(url)["ETag"]
+            for url in ["/api/v1/sales/", reverse("sale_statistics")]
+        }
+        self.post_sale()
+        # Drained by a process that does not share the cache of this one
+        other_process = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "drain process",
+            }
+        }
+        with override_settings(CACHES=other_process):
+            self.assertEqual(sale_queue.drain(), 1)
+        for url, etag in etags.items():
+            with self.subTest(url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get("/api/v1/sales/").json()[0]["revenue"], 2.5)
+
+    def test_drain_needs_a_shared_cache(self):
+        locmem = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        with override_settings(CACHES=locmem):
+            with self.assertRaisesMessage(CommandError, "VERSIONED_CACHE_ALIAS"):
+                call_command("drain_sale_queue")
+
+
+class ImportDataCommandTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.another_user = models.User.objects.create_user(
+            "user2@gmail.com", "user2@gmail.com", "user2_pass"
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def import_data(self, **options):
+        call_command("import_data", batch_size=2, stdout=io.StringIO(), **options)
+
+    def test_sales_import_is_idempotent(self):
+        sales = self.write_file(
+            "sales.tsv",
+            "date\tproduct\tsales_number\trevenue\n"
+            "2010-2-2\tPaper\t5\t0.1\n"
+            "2010-2-2\tPaper\t5\t0.1\n"
+            "2010-2-4\tPen\t3\t1.5\n",
+        )
+        user_ids = [self.user.id, self.another_user.id]
+        self.import_data(sales=sales, user_ids=user_ids)
+        self.import_data(sales=sales, user_ids=user_ids)
+        self.assertEqual(models.Sale.objects.for_user(self.user.id).count(), 3)
+        self.assertEqual(len(sharded_rows(models.Sale, "id")), 6)
+        self.assertEqual(
+            models.SaleUserRollup.objects.for_user(self.another_user.id)
+            .get()
+            .sales_number,
+            13,
+        )
+
+        sales = self.write_file(
+            "sales.csv",
+            "date,product,sales_number,revenue\n"
+            "2010-2-2,Paper,5,0.1\n"
+            "2010-2-2,Paper,7,0.1\n"
+            "2010-2-4,Pen,3,1.5\n"
+            "2010-2-5,Pen,1,1\n",
+        )
+        self.import_data(sales=sales, user_ids=[self.user.id])
+        self.assertEqual(
+            sorted(
+                models.Sale.objects.for_user(self.user.id).values_list(
+                    "sales_number", flat=True
+                )
+            ),
+            [1, 3, 5, 7],
+        )
+        self.assertEqual(
+            models.SaleUserRollup.objects.for_user(self.user.id).get().sales_number, 16
+        )
+
+    def test_cities_import_is_idempotent(self):
+        cities = self.write_file(
+            "city.csv",
+            "MOSKVA (Moscow)\tRussia\t\nSt Petersburg\tRussia\t\n"
+            "PRAGUE\tCzech Republic\t\n",
+        )
+        self.import_data(cities=cities)
+        self.import_data(cities=cities)
+        self.assertEqual(
+            sorted(models.Country.objects.values_list("name", flat=True)),
+            ["Czech Republic", "Russia"],
+        )
+        self.assertEqual(models.City.objects.filter(country__name="Russia").count(), 2)
+
+    def test_sales_import_needs_existing_users(self):
+        sales = self.write_file("sales.csv", "date,product,sales_number,revenue\n")
+        with self.assertRaises(CommandError):
+            self.import_data(sales=sales, user_ids=[999])
+
+
+class CountryListTest(rest_test.APITestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for country, cities in [("UK", ["LONDON"]), ("Russia", ["MOSKVA", "KAZAN"])]:
+            country = models.Country.objects.create(name=country)
+            for city in cities:
+                models.City.objects.create(name=city, country=country)
+
+    def test_countries_are_rendered_once(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("countries"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json(),
+            json.loads(
+                json.dumps(
+                    serializers.CountrySerializer(
+                        models.Country.objects.all(), many=True
+                    ).data
+                )
+            ),
+        )
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse("countries"))
+        self.assertEqual(cached.content, response.content)
+
+    def test_conditional_requests(self):
+        response = self.client.get(reverse("countries"))
+        not_modified = self.client.get(
+            reverse("countries"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        not_modified = self.client.get(
+            reverse("countries"), HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        models.City.objects.create(
+            name="LEEDS", country=models.Country.objects.get(name="UK")
+        )
+        modified = self.client.get(
+            reverse("countries"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertIn("LEEDS", modified.content.decode())
+
+    def test_last_modified_is_the_time_of_the_last_change(self):
+        before = int(time.time())
+        country = models.Country.objects.create(name="France")
+        last_modified = self.client.get(reverse("countries"))["Last-Modified"]
+        self.assertGreaterEqual(
+            django_http_utils.parse_http_date(last_modified), before
+        )
+
+        # Another worker rendering the body later tells the same time.
+        caching.get_cache().delete(
+            f"country_list:countries:{caching.get_version('countries')}"
+        )
+        with mock.patch("time.time", return_value=time.time() + 60):
+            response = self.client.get(reverse("countries"))
+        self.assertEqual(response["Last-Modified"], last_modified)
+
+        with mock.patch("time.time_ns", return_value=time.time_ns() + 60 * 10**9):
+            country.delete()
+        response = self.client.get(
+            reverse("countries"), HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ConditionalGetTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.another_user = models.User.objects.create_user(
+            "user2@gmail.com", "user2@gmail.com", "user2_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.sale = models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        self.another_sale = models.Sale.objects.for_user(self.another_user.id).create(
+            user=self.another_user,
+            date="2010-2-2",
+            product="A",
+            sales_number=1,
+            revenue=1,
+        )
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_resources_are_not_recomputed(self):
+        # The version of the user's sales, and for a sale the sale itself
+        for url, queries in [
+            ("/api/v1/sales/", 1),
+            ("/api/v1/sales/?page_size=1", 1),
+            (f"/api/v1/sales/{self.sale.id}/", 2),
+            (reverse("sale_statistics"), 1),
+        ]:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                with assert_num_queries(self, queries):
+                    not_modified = self.revalidate(url, response["ETag"])
+                self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(not_modified["ETag"], response["ETag"])
+
+    def test_permissions_are_checked_first(self):
+        url = f"/api/v1/sales/{self.another_sale.id}/"
+        response = self.revalidate(url, "*")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header("ETag"))
+        response = self.revalidate("/api/v1/sales/0/", "*")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_validators_do_not_depend_on_the_cache(self):
+        list_etag = self.client.get("/api/v1/sales/")["ETag"]
+        # Written by a process that does not share the cache of this one
+        other_process = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "other process",
+            }
+        }
+        with override_settings(CACHES=other_process):
+            self.client.patch(f"/api/v1/sales/{self.sale.id}/", {"revenue": 8})
+        response = self.revalidate("/api/v1/sales/", list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]["revenue"], 8)
+
+    def test_validators_change_with_the_sales(self):
+        list_etag = self.client.get("/api/v1/sales/")["ETag"]
+        statistics_etag = self.client.get(reverse("sale_statistics"))["ETag"]
+        self.assertNotEqual(
+            list_etag, self.client.get("/api/v1/sales/?page_size=1")["ETag"]
+        )
+
+        # Another user's sales only change the statistics shared by everyone.
+        self.another_sale.revenue = 5
+        self.another_sale.save()
+        self.assertEqual(
+            self.revalidate("/api/v1/sales/", list_etag).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        response = self.revalidate(reverse("sale_statistics"), statistics_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["average_sale_all_user"], 3)
+
+        self.client.patch(f"/api/v1/sales/{self.sale.id}/", {"revenue": 8})
+        response = self.revalidate("/api/v1/sales/", list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]["revenue"], 8)
+
+
+class CachedTokenAuthenticationTest(rest_test.APITestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        authentication.token_cache.clear()
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.token = authtoken_models.Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_token_lookups_are_cached(self):
+        self.assertEqual(
+            self.client.get(reverse("countries")).status_code, status.HTTP_200_OK
+        )
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("countries"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_invalidates_the_token(self):
+        self.client.get(reverse("countries"))
+        response = self.client.post(reverse("logout"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse("countries"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_invalidates_the_token(self):
+        self.client.get(reverse("countries"))
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse("countries"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalidation_from_another_worker(self):
+        worker = authentication.TokenCache(max_size=10, timeout=60, sync_interval=0)
+        worker.set(self.token.key, self.token)
+        self.assertIsNotNone(worker.get(self.token.key))
+        authentication.token_cache.invalidate(key=self.token.key)
+        self.assertIsNone(worker.get(self.token.key))
+
+    def test_tokens_are_looked_up_without_a_shared_cache(self):
+        locmem = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+        with override_settings(CACHES=locmem):
+            self.client.get(reverse("countries"))
+            # Deactivated by another worker, whose invalidation is not seen
+            models.User.objects.filter(pk=self.user.pk).update(is_active=False)
+            response = self.client.get(reverse("countries"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_is_bounded(self):
+        cache = authentication.TokenCache(max_size=2, timeout=60, sync_interval=60)
+        for key in ["a", "b", "c"]:
+            cache.set(key, self.token)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+class CredentialCacheTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        check_password = base_user.check_password
+        self.password_checks = mock.patch(
+            "django.contrib.auth.base_user.check_password", side_effect=check_password
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def basic_auth(self, password):
+        credentials = base64.b64encode(f"user1@gmail.com:{password}".encode())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Basic {credentials.decode()}")
+        return self.client.get(reverse("sale_statistics"))
+
+    def test_basic_auth_hashes_the_password_once(self):
+        for _ in range(3):
+            self.assertEqual(
+                self.basic_auth("user1_pass").status_code, status.HTTP_200_OK
+            )
+        self.assertEqual(self.password_checks.call_count, 1)
+        self.assertEqual(
+            self.basic_auth("wrong_pass").status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    def test_login_hashes_the_password_once(self):
+        for _ in range(3):
+            response = self.client.post(
+                reverse("login"),
+                {"email": "user1@gmail.com", "password": "user1_pass"},
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.password_checks.call_count, 1)
+
+    def test_password_change_invalidates_cached_credentials(self):
+        self.basic_auth("user1_pass")
+        self.user.set_password("new_pass")
+        self.user.save()
+        self.assertEqual(
+            self.basic_auth("user1_pass").status_code, status.HTTP_401_UNAUTHORIZED
+        )
+        self.assertEqual(self.basic_auth("new_pass").status_code, status.HTTP_200_OK)
+
+    def test_hashing_pool(self):
+        with override_settings(PASSWORD_HASH_POOL_SIZE=1):
+            thread_name = authentication.run_password_check(
+                lambda: threading.current_thread().name
+            )
+        self.assertTrue(thread_name.startswith("password-hashing"))
+
+        pool = authentication.PasswordHashingPool(1, 0, queue_timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_check():
+            started.set()
+            release.wait()
+
+        busy = threading.Thread(target=pool.run, args=(slow_check,))
+        busy.start()
+        started.wait()
+        with self.assertRaises(authentication.PasswordHashingUnavailable):
+            pool.run(lambda: None)
+        release.set()
+        busy.join()
+        self.assertEqual(pool.run(lambda: 42), 42)
+
+
+class SaleTimeSeriesTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for date, product, sales_number, revenue in [
+            ("2010-2-1", "A", 1, 1.5),
+            ("2010-2-3", "A", 2, 2.5),
+            ("2010-2-3", "B", 4, 1),
+            ("2010-2-8", "A", 8, 4),
+            ("2010-3-1", "A", 16, 8),
+        ]:
+            models.Sale.objects.for_user(self.user.id).create(
+                user=self.user,
+                date=date,
+                product=product,
+                sales_number=sales_number,
+                revenue=revenue,
+            )
+
+    def get_series(self, **params):
+        return self.client.get(reverse("sale_time_series"), params)
+
+    def test_weekly_buckets(self):
+        response = self.get_series(interval="week")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "bucket": "2010-02-01",
+                    "product": "A",
+                    "revenue": 4.0,
+                    "sales_number": 3,
+                },
+                {
+                    "bucket": "2010-02-01",
+                    "product": "B",
+                    "revenue": 1.0,
+                    "sales_number": 4,
+                },
+                {
+                    "bucket": "2010-02-08",
+                    "product": "A",
+                    "revenue": 4.0,
+                    "sales_number": 8,
+                },
+                {
+                    "bucket": "2010-03-01",
+                    "product": "A",
+                    "revenue": 8.0,
+                    "sales_number": 16,
+                },
+            ],
+        )
+
+    def test_monthly_buckets_in_range_for_product(self):
+        response = self.get_series(
+            interval="month", start="2010-02-02", end="2010-12-31", product="A"
+        )
+        self.assertEqual(
+            [(row["bucket"], row["sales_number"]) for row in response.json()],
+            [("2010-02-01", 10), ("2010-03-01", 16)],
+        )
+
+    def test_buckets_are_read_from_the_day_rollups(self):
+        models.Sale.objects.for_user(self.user.id).get(product="B").delete()
+        shard = connections[sharding.shard_for(self.user.id)]
+        with CaptureQueriesContext(shard) as queries:
+            response = self.get_series(interval="day")
+        self.assertFalse(
+            [query for query in queries if '"app_sale"' in query["sql"]],
+            "the sales are read",
+        )
+        self.assertEqual(
+            [
+                (row["bucket"], row["product"], row["sales_number"])
+                for row in response.json()
+            ],
+            [
+                ("2010-02-01", "A", 1),
+                ("2010-02-03", "A", 2),
+                ("2010-02-08", "A", 8),
+                ("2010-03-01", "A", 16),
+            ],
+        )
+
+    def test_invalid_query(self):
+        for params in [
+            {"interval": "year"},
+            {"start": "2010-03-01", "end": "2010-02-01"},
+        ]:
+            self.assertEqual(
+                self.get_series(**params).status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+
+class SaleLeaderboardTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user, self.another_user = [
+            models.User.objects.create_user(f"user{i}@gmail.com") for i in (1, 2)
+        ]
+        self.client.force_authenticate(user=self.user)
+        for user, date, product, sales_number, revenue in [
+            (self.user, "2010-2-1", "A", 1, 10),
+            (self.user, "2010-2-3", "B", 5, 4),
+            (self.user, "2010-2-3", "C", 2, 6),
+            (self.user, "2010-3-1", "B", 1, 9),
+            (self.another_user, "2010-2-2", "C", 20, 30),
+        ]:
+            models.Sale.objects.for_user(user.id).create(
+                user=user,
+                date=date,
+                product=product,
+                sales_number=sales_number,
+                revenue=revenue,
+            )
+
+    def get_leaderboard(self, **params):
+        response = self.client.get(reverse("sale_leaderboard"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (row["product"], row["revenue"], row["sales_number"])
+            for row in response.json()
+        ]
+
+    def test_user_leaderboard(self):
+        self.assertEqual(
+            self.get_leaderboard(),
+            [("B", 13, 6), ("A", 10, 1), ("C", 6, 2)],
+        )
+        self.assertEqual(
+            self.get_leaderboard(by="sales_number", limit=2),
+            [("B", 13, 6), ("C", 6, 2)],
+        )
+        self.assertEqual(
+            self.get_leaderboard(start="2010-2-2", end="2010-2-28"),
+            [("C", 6, 2), ("B", 4, 5)],
+        )
+
+    def test_global_leaderboard(self):
+        self.assertEqual(
+            self.get_leaderboard(scope="all"),
+            [("C", 36, 22), ("B", 13, 6), ("A", 10, 1)],
+        )
+        self.assertEqual(
+            self.get_leaderboard(scope="all", start="2010-2-3", limit=2),
+            [("B", 13, 6), ("C", 6, 2)],
+        )
+        # Ties are broken by product name
+        models.Sale.objects.for_user(self.another_user.id).create(
+            user=self.another_user, date="2010-3-1", product="A", revenue=6
+        )
+        self.assertEqual(
+            self.get_leaderboard(scope="all", start="2010-2-3"),
+            [("B", 13, 6), ("A", 6, 0), ("C", 6, 2)],
+        )
+
+    def test_invalid_query(self):
+        for params in [
+            {"by": "profit"},
+            {"scope": "everyone"},
+            {"limit": 0},
+            {"limit": settings.SALE_LEADERBOARD_MAX_LIMIT + 1},
+            {"start": "2010-03-01", "end": "2010-02-01"},
+        ]:
+            response = self.client.get(reverse("sale_leaderboard"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@unittest.skipUnless(analytics.available(), "NumPy is not installed")
+class SaleDistributionTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        caching.get_cache().clear()
+        analytics.clear()
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.other = models.User.objects.create_user(
+            "user2@gmail.com", "user2@gmail.com", "user2_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for user, product, sales_number, revenue in [
+            (self.user, "A", 1, 10),
+            (self.user, "A", 2, 20),
+            (self.user, "A", 3, 30),
+            (self.user, "B", 4, 40),
+            (self.other, "A", 5, 50),
+            (self.other, "B", 6, 60),
+        ]:
+            models.Sale.objects.for_user(user.id).create(
+                user=user,
+                date="2010-2-1",
+                product=product,
+                sales_number=sales_number,
+                revenue=revenue,
+            )
+
+    def get_distribution(self):
+        response = self.client.get(reverse("sale_distribution"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_distribution(self):
+        data = self.get_distribution()
+        self.assertEqual(data["sales"], 4)
+        self.assertEqual(data["median_sales_number"], 2.5)
+        self.assertAlmostEqual(data["revenue_percentiles"]["p50"], 25)
+        self.assertAlmostEqual(data["revenue_percentiles"]["p90"], 37)
+        self.assertEqual(
+            [
+                (row["product"], row["sales"], row["revenue"])
+                for row in data["products"]
+            ],
+            [("A", 3, 60.0), ("B", 1, 40.0)],
+        )
+        self.assertAlmostEqual(data["products"][0]["revenue_percentiles"]["p50"], 20)
+        # 100 for user1 against 110 for user2
+        self.assertEqual(data["revenue_rank_percentile"], 50.0)
+
+    def test_view_reads_the_snapshot_without_its_etag(self):
+        class View(views.SaleDistributionView):
+            get = views.SaleDistributionView.get.__wrapped__
+
+        request = rest_test.APIRequestFactory().get(reverse("sale_distribution"))
+        rest_test.force_authenticate(request, user=self.user)
+        response = View.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["revenue_rank_percentile"], 50.0)
+
+    def test_user_without_sales(self):
+        self.client.force_authenticate(
+            user=models.User.objects.create_user("user3@gmail.com")
+        )
+        data = self.get_distribution()
+        self.assertEqual(data["sales"], 0)
+        self.assertEqual(data["products"], [])
+        self.assertIsNone(data["revenue_percentiles"]["p50"])
+        self.assertIsNone(data["revenue_rank_percentile"])
+
+    def test_new_sales_are_appended(self):
+        snapshot = analytics.get_snapshot()
+        db = sharding.shard_for(self.user.id)
+        watermark = snapshot.watermarks[db]
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-2", product="C", sales_number=1, revenue=100
+        )
+        with mock.patch.object(snapshot, "_load", wraps=snapshot._load) as load:
+            self.assertIs(analytics.get_snapshot(), snapshot)
+        load.assert_any_call(db, watermark)
+        self.assertEqual(load.call_count, len(sharding.databases()))
+        self.assertEqual(len(snapshot), 7)
+        self.assertEqual(self.get_distribution()["revenue_rank_percentile"], 100.0)
+
+    def test_updates_and_deletes_reload_the_snapshot(self):
+        snapshot = analytics.get_snapshot()
+        sale = models.Sale.objects.for_user(self.other.id).first()
+        sale.revenue = 0
+        sale.save()
+        self.assertEqual(self.get_distribution()["revenue_rank_percentile"], 100.0)
+        models.Sale.objects.for_user(self.user.id).filter(product="B").delete()
+        self.assertIsNot(analytics.get_snapshot(), snapshot)
+        self.assertEqual(len(analytics.get_snapshot()), 5)
+        self.assertEqual(
+            [row["product"] for row in self.get_distribution()["products"]], ["A"]
+        )
+
+    def test_readers_do_not_wait_for_a_reload(self):
+        response = self.client.get(reverse("sale_distribution"))
+        sale = models.Sale.objects.for_user(self.other.id).first()
+        sale.revenue = 0
+        sale.save()
+        # While another thread loads the new snapshot, the current one is
+        # read, with its validator.
+        with analytics._snapshot_lock:
+            stale = self.client.get(
+                reverse("sale_distribution"), HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(stale.status_code, status.HTTP_304_NOT_MODIFIED)
+        fresh = self.client.get(
+            reverse("sale_distribution"), HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+        self.assertEqual(fresh.json()["revenue_rank_percentile"], 100.0)
+
+
+class AsyncViewTest(rest_test.APITransactionTestCase):
+    # The offloaded views run on other threads, which only see committed rows.
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.sale = models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-1", product="A", sales_number=1, revenue=2
+        )
+        self.factory = rest_test.APIRequestFactory()
+        self.view = async_views.offload(views.SaleDetailView.as_view())
+
+    def get(self, **headers):
+        request = self.factory.get(f"/api/v1/sales/{self.sale.id}/", **headers)
+        rest_test.force_authenticate(request, user=self.user)
+        return async_to_sync(self.view)(request, pk=self.sale.id)
+
+    def test_offloaded_view(self):
+        self.assertTrue(asyncio.iscoroutinefunction(self.view))
+        # drf_yasg finds the endpoints through the view class
+        self.assertIs(self.view.cls, views.SaleDetailView)
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_rendered)
+        self.assertEqual(json.loads(response.content)["product"], "A")
+
+    def test_conditional_get(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED
+        )
+
+
+def asgi_get(path, headers=()):
+    """Status, headers and body of a GET of ``path`` through ``huy.asgi``'s handler."""
+
+    async def request():
+        communicator = ApplicationCommunicator(
+            asgi.ASGIHandler(),
+            {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": b"",
+                "headers": [(b"host", b"testserver"), *headers],
+            },
+        )
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output()
+        body = b""
+        while True:
+            message = await communicator.receive_output()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return start["status"], dict(start["headers"]), body
+
+    return async_to_sync(request)()
+
+
+class ASGIStaticFilesTest(rest_test.APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, "app.css"), "w") as file:
+            file.write("body {}")
+        self.enterContext(
+            override_settings(
+                MIDDLEWARE=settings_asgi.MIDDLEWARE, STATIC_ROOT=directory.name
+            )
+        )
+
+    def get(self, path):
+        status_code, _, body = asgi_get(path)
+        return status_code, body
+
+    def test_static_files_are_served_by_whitenoise(self):
+        self.assertIn("app.middleware.AsyncWhiteNoiseMiddleware", settings.MIDDLEWARE)
+        self.assertEqual(self.get("/static/app.css"), (200, b"body {}"))
+        self.assertEqual(self.get("/static/missing.css")[0], 404)
+
+    def test_other_requests_reach_the_views(self):
+        status_code, body = self.get("/api/v1/countries/")
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ASGIProfileTest(rest_test.APITransactionTestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        caching.get_cache().clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.traffic = os.path.join(directory.name, "traffic.jsonl")
+        self.enterContext(
+            override_settings(
+                MIDDLEWARE=settings_asgi.MIDDLEWARE,
+                SALE_EXPORT_CHUNK_SIZE=2,
+                PERF_SAMPLE_RATE=1,
+                PERF_SERVER_TIMING=True,
+                TRAFFIC_RECORD_FILE=self.traffic,
+            )
+        )
+        self.addCleanup(metrics.clear)
+        user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        token = authtoken_models.Token.objects.create(user=user)
+        self.headers = [(b"authorization", f"Token {token.key}".encode())]
+        for revenue in range(5):
+            models.Sale.objects.for_user(user.id).create(
+                user=user, date="2010-2-2", product="A", revenue=revenue
+            )
+
+    def test_export_streams_from_the_database(self):
+        status_code, _, body = asgi_get("/api/v1/sales/export/", self.headers)
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row["revenue"] for row in rows], [0, 1, 2, 3, 4])
+
+    def test_requests_are_measured_and_recorded(self):
+        for middleware in [
+            "app.middleware.PerformanceMiddleware",
+            "app.middleware.TrafficRecordingMiddleware",
+        ]:
+            self.assertIn(middleware, settings.MIDDLEWARE)
+        status_code, headers, _ = asgi_get("/api/v1/sales/", self.headers)
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        # Queries run off the event loop, by the views, are counted.
+        queries = re.search(r'desc="(\d+) queries"', headers[b"Server-Timing"].decode())
+        self.assertGreater(int(queries.group(1)), 0)
+        self.assertIn('view="api/v1/sales/"', metrics.render())
+        with open(self.traffic) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(
+            [(record["path"], record["status"]) for record in records],
+            [("/api/v1/sales/", 200)],
+        )
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "SQLite pragmas")
+class SQLitePragmaTest(rest_test.APITestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def configure(self, pragmas):
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            signals.configure_sqlite(sender=type(connection), connection=connection)
+
+    def test_pragmas_applied_to_new_connections(self):
+        pragmas = {"cache_size": -1234, "busy_timeout": 1500}
+        self.addCleanup(self.configure, {name: self.pragma(name) for name in pragmas})
+        self.configure(pragmas)
+        self.assertEqual(self.pragma("cache_size"), -1234)
+        self.assertEqual(self.pragma("busy_timeout"), 1500)
+
+
+class SaleShardRouterTest(rest_test.APITestCase):
+    @override_settings(SALE_SHARDS=[])
+    def test_unsharded(self):
+        self.assertEqual(sharding.shard_for(123), "default")
+        self.assertEqual(
+            models.Sale.objects.for_user(123).filter(product="A").db, "default"
+        )
+
+    def test_adding_shards_only_moves_users_to_new_shards(self):
+        for user_id in range(1, 2000):
+            buckets = [sharding.jump_hash(user_id, count) for count in range(1, 9)]
+            for count, (before, after) in enumerate(zip(buckets, buckets[1:]), 1):
+                self.assertIn(after, (before, count))
+        counts = collections.Counter(
+            sharding.jump_hash(user_id, 4) for user_id in range(1, 4001)
+        )
+        self.assertGreater(min(counts.values()), 800)
+
+    @override_settings(SALE_SHARDS=["sales_0", "sales_1"])
+    def test_routing(self):
+        router = sharding.SaleShardRouter()
+        user = models.User(pk=7)
+        shard = sharding.shard_for(7)
+        self.assertEqual(router.db_for_read(models.Sale, instance=user), shard)
+        self.assertEqual(
+            router.db_for_write(models.Sale, instance=models.Sale(user_id=7)), shard
+        )
+        sale = models.Sale(user_id=7)
+        sale._state.db = "sales_1"
+        self.assertEqual(
+            router.db_for_read(models.SaleUserRollup, instance=sale), "sales_1"
+        )
+        self.assertEqual(router.db_for_read(models.Country), "default")
+        self.assertEqual(router.db_for_write(models.User, instance=sale), "default")
+        self.assertEqual(router.db_for_read(models.Sale, user_id=7), shard)
+        with self.assertRaises(ValueError):
+            router.db_for_read(models.Sale)
+        self.assertTrue(router.allow_relation(sale, user))
+        self.assertTrue(router.allow_migrate("sales_0", "app", "sale"))
+        self.assertFalse(router.allow_migrate("sales_0", "app", "user"))
+        self.assertFalse(router.allow_migrate("sales_0", "auth"))
+        self.assertTrue(router.allow_migrate("default", "app", "user"))
+        self.assertEqual(sharding.id_range("default"), (0, sharding.ID_RANGE - 1))
+        self.assertEqual(sharding.id_range("sales_0")[0], sharding.ID_RANGE)
+        self.assertEqual(sharding.id_range("sales_1")[0], 2 * sharding.ID_RANGE)
+
+
+@unittest.skipUnless(
+    len(settings.SALE_SHARDS) > 1,
+    "run with --settings=huy.settings_sharded",
+)
+class ShardedSalesTest(rest_test.APITransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.users = {}
+        index = 0
+        while len(self.users) < 2:
+            index += 1
+            user = models.User.objects.create_user(
+                f"user{index}@gmail.com", f"user{index}@gmail.com", "pass"
+            )
+            self.users.setdefault(sharding.shard_for(user.id), user)
+        (self.shard, self.user), (self.other_shard, self.other) = sorted(
+            self.users.items()
+        )
+
+    def post_sale(self, user, revenue):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            "/api/v1/sales/",
+            {
+                "date": "2010-01-01",
+                "product": "A",
+                "sales_number": 1,
+                "revenue": revenue,
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()["id"]
+
+    def test_sales_go_to_the_shard_of_their_user(self):
+        sale_id = self.post_sale(self.user, 10)
+        other_id = self.post_sale(self.other, 30)
+        self.assertNotEqual(sale_id, other_id)
+        for user, shard, sale in [
+            (self.user, self.shard, sale_id),
+            (self.other, self.other_shard, other_id),
+        ]:
+            first, last = sharding.id_range(shard)
+            self.assertTrue(first <= sale <= last)
+            self.assertEqual(
+                list(models.Sale.objects.using(shard).values_list("id", flat=True)),
+                [sale],
+            )
+            self.assertEqual(models.SaleUserRollup.objects.for_user(user.id).count(), 1)
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(
+            [sale["id"] for sale in self.client.get("/api/v1/sales/").json()],
+            [sale_id],
+        )
+        self.assertEqual(
+            self.client.get(f"/api/v1/sales/{other_id}/").status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+        statistics = self.client.get("/api/v1/sale_statistics/").json()
+        self.assertEqual(statistics["average_sales_for_current_user"], 10)
+        self.assertEqual(statistics["average_sale_all_user"], 20)
+        self.assertEqual(
+            self.client.get("/api/v1/sale_statistics/leaderboard/?scope=all").json(),
+            [{"product": "A", "revenue": 40, "sales_number": 2}],
+        )
+
+    def test_sale_queue(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(sale_queue.close)
+        with override_settings(
+            SALE_QUEUE_PATH=os.path.join(directory.name, "queue.sqlite3")
+        ):
+            item_ids = {}
+            for user in (self.user, self.other):
+                self.client.force_authenticate(user=user)
+                response = self.client.post(
+                    "/api/v1/sales/",
+                    {"date": "2010-01-01", "product": "A", "revenue": 1},
+                )
+                item_ids[user] = response.data["id"]
+            self.assertEqual(sale_queue.drain(), 2)
+            for user, shard in [
+                (self.user, self.shard),
+                (self.other, self.other_shard),
+            ]:
+                sale = models.Sale.objects.for_user(user.id).get()
+                self.assertEqual(sale_queue.get(item_ids[user])["sale_id"], sale.id)
+                first, last = sharding.id_range(shard)
+                self.assertTrue(first <= sale.id <= last)
+                self.assertEqual(
+                    models.SaleQueueCursor.objects.using(shard).get().last_item_id,
+                    item_ids[user],
+                )
+
+    def test_deleting_a_user_deletes_its_sales(self):
+        self.post_sale(self.other, 30)
+        self.other.delete()
+        self.assertFalse(models.Sale.objects.using(self.other_shard).exists())
+        self.assertFalse(models.SaleUserRollup.objects.using(self.other_shard).exists())
+
+    def test_rebalance(self):
+        models.Sale.objects.using("default").bulk_create(
+            models.Sale(user=user, date="2010-01-01", product="A", revenue=revenue)
+            for user, revenue in [(self.user, 5), (self.other, 7), (self.user, 9)]
+        )
+        call_command("rebalance_sales", stdout=io.StringIO())
+        self.assertFalse(models.Sale.objects.using("default").exists())
+        self.assertFalse(models.SaleProductDayTotal.objects.using("default").exists())
+        self.assertEqual(models.Sale.objects.for_user(self.user.id).count(), 2)
+        rollup = models.SaleUserRollup.objects.for_user(self.user.id).get()
+        self.assertEqual((rollup.sale_count, rollup.max_revenue), (2, 9))
+        out = io.StringIO()
+        call_command("rebalance_sales", stdout=out)
+        self.assertIn("Moved the sales of 0 users", out.getvalue())
+
+    def test_rebalance_stops_at_ids_taken_on_the_target(self):
+        models.Sale.objects.using("default").bulk_create(
+            models.Sale(user=self.user, date="2010-01-01", product="A", revenue=r)
+            for r in [5, 9]
+        )
+        sales = list(models.Sale.objects.using("default").order_by("id"))
+        # Left by another user on the target, e.g. by an older id numbering
+        models.Sale.objects.using(self.shard).bulk_create(
+            [
+                models.Sale(
+                    id=sales[1].id,
+                    user=self.other,
+                    date="2010-01-01",
+                    product="B",
+                    revenue=1,
+                )
+            ]
+        )
+        with self.assertRaisesMessage(CommandError, "already taken"):
+            call_command("rebalance_sales", stdout=io.StringIO())
+        self.assertEqual(
+            sorted(models.Sale.objects.using("default").values_list("id", "revenue")),
+            [(sales[0].id, 5), (sales[1].id, 9)],
+        )
+        self.assertEqual(
+            list(
+                models.Sale.objects.using(self.shard).values_list("user_id", "product")
+            ),
+            [(self.other.id, "B")],
+        )
+
+
+@override_settings(DATABASE_REPLICAS={"default": "replica"}, REPLICA_MAX_LAG=30)
+class ReadReplicaTest(rest_test.APITestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.synced = time.time() - 1
+        patcher = mock.patch(
+            "app.replicas.synced_at", side_effect=lambda replica: self.synced
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_routing(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_read(models.Sale), "default")
+        with replicas.reading_from_replicas(None):
+            self.assertEqual(router.db_for_read(models.Sale), "replica")
+            self.assertEqual(router.db_for_write(models.Sale), "default")
+            self.assertEqual(router.db_for_read(models.User), "default")
+            self.assertEqual(router.db_for_read(authtoken_models.Token), "default")
+            with replicas.reading_from_primaries():
+                self.assertEqual(router.db_for_read(models.Sale), "default")
+        sale, country = models.Sale(), models.Country()
+        sale._state.db, country._state.db = "replica", "default"
+        self.assertTrue(router.allow_relation(sale, country))
+        self.assertFalse(router.allow_migrate("replica", "app", "sale"))
+        self.assertIsNone(router.allow_migrate("default", "app", "sale"))
+
+    def test_lagging_replica_is_not_read(self):
+        self.synced = time.time() - 31
+        with replicas.reading_from_replicas(None):
+            self.assertEqual(replicas.for_read("default"), "default")
+        self.synced = None
+        with replicas.reading_from_replicas(None):
+            self.assertEqual(replicas.for_read("default"), "default")
+
+    def test_clients_read_their_writes(self):
+        replicas.wrote("client")
+        with replicas.reading_from_replicas("client"):
+            self.assertEqual(replicas.for_read("default"), "default")
+        with replicas.reading_from_replicas("other"):
+            self.assertEqual(replicas.for_read("default"), "replica")
+        # Synced after the write
+        self.synced = time.time() + 1
+        with replicas.reading_from_replicas("client"):
+            self.assertEqual(replicas.for_read("default"), "replica")
+
+    def test_middleware(self):
+        read_from = []
+
+        def view(request):
+            read_from.append(replicas.for_read("default"))
+            status_code = 400 if "invalid" in request.GET else 200
+            return django_http.HttpResponse(status=status_code)
+
+        handler = middleware.ReplicaReadMiddleware(view)
+        factory = RequestFactory()
+        for request in [
+            factory.get("/", HTTP_AUTHORIZATION="Token a"),
+            factory.post("/?invalid", HTTP_AUTHORIZATION="Token a"),
+            factory.get("/", HTTP_AUTHORIZATION="Token a"),
+            factory.post("/", HTTP_AUTHORIZATION="Token a"),
+            factory.head("/", HTTP_AUTHORIZATION="Token a"),
+            factory.get("/", HTTP_AUTHORIZATION="Token b"),
+            factory.get("/"),
+        ]:
+            handler(request)
+        self.assertEqual(
+            read_from,
+            [
+                "replica",
+                "default",
+                "replica",
+                "default",
+                "default",
+                "replica",
+                "replica",
+            ],
+        )
+        with override_settings(DATABASE_REPLICAS={}):
+            with self.assertRaises(MiddlewareNotUsed):
+                middleware.ReplicaReadMiddleware(view)
+
+    def test_cached_values_are_computed_on_the_primary(self):
+        with replicas.reading_from_replicas(None):
+            value = caching.get_or_set(
+                "sales", "test", lambda: replicas.for_read("default"), 60
+            )
+        self.assertEqual(value, "default")
+
+
+@unittest.skipIf(settings.SALE_SHARDS, "replicas are of the unsharded database")
+@override_settings(
+    DATABASE_REPLICAS={"default": "stale"},
+    DATABASE_ROUTERS=["app.replicas.ReplicaRouter"],
+    REPLICA_MAX_LAG=30,
+)
+class ReplicaConditionalGetTest(rest_test.APITransactionTestCase):
+    """The validators go with the data of the replica read, even behind."""
+
+    def setUp(self):
+        caching.get_cache().clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.replica = os.path.join(directory.name, "stale.sqlite3")
+        patcher = mock.patch.dict(
+            settings.DATABASES,
+            {"stale": {"ENGINE": "django.db.backends.sqlite3", "NAME": self.replica}},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.close_replica)
+        patcher = mock.patch("app.replicas.synced_at", return_value=time.time())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.sale = models.Sale.objects.create(
+            user=self.user, date="2010-2-2", product="A", sales_number=2, revenue=4
+        )
+        self.sync()
+
+    def close_replica(self):
+        connections["stale"].close()
+        del connections["stale"]
+
+    def sync(self):
+        # What sync_replica does, from the in-memory test database
+        connections["default"].ensure_connection()
+        target = sqlite3.connect(self.replica)
+        try:
+            connections["default"].connection.backup(target)
+        finally:
+            target.close()
+
+    def test_validators_follow_the_replica(self):
+        for url in ["/api/v1/sales/", f"/api/v1/sales/{self.sale.id}/"]:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.sale.revenue = 8
+                self.sale.save()
+
+                # The replica still has the old sale: so has its validator.
+                stale = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(stale.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(stale["ETag"], response["ETag"])
+
+                self.sync()
+                synced = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(synced.status_code, status.HTTP_200_OK)
+                self.assertNotEqual(synced["ETag"], response["ETag"])
+                body = synced.json()
+                self.assertEqual(
+                    (body[0] if url == "/api/v1/sales/" else body)["revenue"], 8
+                )
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=synced["ETag"])
+                self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+                self.sale.revenue = 4
+                self.sale.save()
+                self.sync()
+
+
+class ReplicaSyncTest(rest_test.APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        databases = {
+            alias: {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(directory.name, f"{alias}.sqlite3"),
+            }
+            for alias in ("primary", "copy")
+        }
+        patcher = mock.patch.dict(settings.DATABASES, databases)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db = sqlite3.connect(databases["primary"]["NAME"])
+        with db:
+            db.execute("CREATE TABLE t (x)")
+            db.execute("INSERT INTO t VALUES (1)")
+        db.close()
+        self.copy = databases["copy"]["NAME"]
+
+    @override_settings(DATABASE_REPLICAS={"primary": "copy"})
+    def test_sync(self):
+        self.assertEqual(replicas.lags(), {})
+        self.assertNotIn("huy_replica_lag_seconds{", metrics.render())
+        started = time.time()
+        out = io.StringIO()
+        call_command("sync_replica", stdout=out)
+        self.assertRegex(out.getvalue(), r"^primary -> copy: [\d.]+s$")
+        db = sqlite3.connect(self.copy)
+        self.assertEqual(db.execute("SELECT x FROM t").fetchall(), [(1,)])
+        db.close()
+        self.assertGreaterEqual(replicas.synced_at("copy"), started)
+        self.assertLess(replicas.lags()["copy"], 30)
+        self.assertRegex(
+            metrics.render(),
+            r'\nhuy_replica_lag_seconds\{database="copy"\} [\d.e-]+\n',
+        )
+
+    @override_settings(DATABASE_REPLICAS={})
+    def test_without_replicas(self):
+        with self.assertRaises(CommandError):
+            call_command("sync_replica")
+
+
+class TrafficReplayTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "traffic.jsonl")
+
+    def record_traffic(self):
+        with override_settings(TRAFFIC_RECORD_FILE=self.path):
+            client = rest_test.APIClient()
+            client.post(
+                reverse("login"),
+                {"username": "user1@gmail.com", "password": "user1_pass"},
+                format="json",
+            )
+            client.force_authenticate(user=self.user)
+            client.post(
+                "/api/v1/sales/",
+                {
+                    "date": "2010-01-01",
+                    "product": "A",
+                    "sales_number": 1,
+                    "revenue": 2.5,
+                },
+                format="json",
+            )
+            client.get("/api/v1/sales/1000/")
+        return traffic.load_records(self.path)
+
+    def test_recording(self):
+        login, sale, missing = self.record_traffic()
+        self.assertTrue(login["redacted"])
+        self.assertNotIn("user1_pass", login["body"])
+        self.assertEqual(sale["method"], "POST")
+        self.assertEqual(sale["user"], "user1@gmail.com")
+        self.assertEqual(json.loads(sale["body"])["product"], "A")
+        self.assertEqual(sale["status"], status.HTTP_201_CREATED)
+        self.assertEqual(
+            (missing["path"], missing["status"]),
+            ("/api/v1/sales/1000/", status.HTTP_404_NOT_FOUND),
+        )
+
+    def test_replay(self):
+        self.record_traffic()
+        models.Sale.objects.for_user(self.user.id).delete()
+        out, err = io.StringIO(), io.StringIO()
+        call_command("replay_traffic", self.path, stdout=out, stderr=err)
+        self.assertEqual(models.Sale.objects.for_user(self.user.id).get().product, "A")
+        self.assertIn("Skipped 1 requests", err.getvalue())
+        rows = {line.split()[1]: line.split() for line in out.getvalue().splitlines()}
+        self.assertEqual(rows["api/v1/sales/"][:3], ["POST", "api/v1/sales/", "1"])
+        self.assertEqual(rows["api/v1/sales/"][4], "0.0%")
+        # The recorded 404 is replayed as expected, not as an error
+        self.assertEqual(rows["api/v1/sales/<int:pk>/"][4], "0.0%")
+        self.assertRegex(out.getvalue(), r"\ntotal +2 ")
+
+    def test_pacing(self):
+        records = [
+            {"timestamp": 100 + i, "method": "GET", "path": "/"} for i in range(3)
+        ]
+        self.assertEqual(traffic.Replay(records, None, rate=4).offsets, [0, 0.25, 0.5])
+        self.assertEqual(traffic.Replay(records, None, speed=2).offsets, [0, 0.5, 1])
+
+
+@override_settings(PERF_SAMPLE_RATE=1)
+class PerformanceMetricsTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        models.Sale.objects.for_user(self.user.id).create(
+            user=self.user, date="2010-2-1", product="A", sales_number=1, revenue=2
+        )
+        self.client = rest_test.APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Server-Timing", response)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="[1-9]\d* queries", serialize;dur=[\d.]+, '
+            r"render;dur=[\d.]+, total;dur=[\d.]+$",
+        )
+
+    @override_settings(PERF_SERVER_TIMING=True)
+    def test_server_timing_for_everyone(self):
+        response = self.client.get(reverse("sale_statistics"))
+        self.assertIn("Server-Timing", response)
+
+    def test_serialization_is_timed(self):
+        sale = models.Sale.objects.for_user(self.user.id).get()
+        self.client.get(f"/api/v1/sales/{sale.id}/")
+        self.client.get(reverse("sale_statistics"))
+        series = metrics.request_serialize_duration.series()
+        detail = (("method", "GET"), ("view", "api/v1/sales/<int:pk>/"))
+        statistics = (("method", "GET"), ("view", "api/v1/sale_statistics/"))
+        self.assertGreater(series[detail][1], 0)
+        # Computed as primitives, without serializers
+        self.assertEqual(series[statistics][1], 0)
+
+    def test_metrics_of_every_worker(self):
+        self.client.get(reverse("sale_statistics"))
+        # Saved by another worker, still running
+        other = metrics._path(f"{os.getppid()}-{metrics._started(os.getppid())}")
+        with open(metrics._path(metrics._this_worker())) as own:
+            saved = own.read()
+        with open(other, "w") as file:
+            file.write(saved)
+        self.addCleanup(os.remove, other)
+        self.client.get(reverse("sale_statistics"))
+        labels = 'method="GET",view="api/v1/sale_statistics/"'
+        self.assertIn(
+            f"huy_request_duration_seconds_count{{{labels}}} 3", metrics.render()
+        )
+
+    def test_metrics_of_exited_workers(self):
+        self.client.get(reverse("sale_statistics"))
+        with open(metrics._path(metrics._this_worker())) as own:
+            saved = own.read()
+        self.addCleanup(os.remove, metrics._exited_path())
+        labels = 'method="GET",view="api/v1/sale_statistics/"'
+
+        def restart(count, *workers):
+            for worker in workers:
+                with open(metrics._path(worker), "w") as file:
+                    file.write(saved)
+            with mock.patch.object(metrics, "_worker", None):
+                text = metrics.render()
+            self.assertIn(
+                f"huy_request_duration_seconds_count{{{labels}}} {count}", text
+            )
+            for worker in workers:
+                self.assertFalse(os.path.exists(metrics._path(worker)))
+
+        # Saved by an exited worker whose PID this one reuses
+        exited = f"{os.getpid()}-0"
+        restart(2, exited)
+        restart(2)
+        # Its file left by a fold stopped short of removing it
+        restart(3, exited, f"{os.getpid()}-1")
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("sale_statistics"))
+        self.client.get(reverse("sale_statistics"))
+        self.assertEqual(
+            self.client.get(reverse("metrics")).status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        labels = 'method="GET",view="api/v1/sale_statistics/"'
+        self.assertIn("# TYPE huy_request_duration_seconds histogram", text)
+        self.assertIn(f"huy_request_duration_seconds_count{{{labels}}} 2", text)
+        self.assertIn(f'huy_request_db_queries_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f"huy_response_size_bytes_count{{{labels}}} 2", text)
+
+    @override_settings(PERF_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        with mock.patch("random.random", return_value=0.7):
+            response = self.client.get(reverse("sale_statistics"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertNotIn("huy_request_duration_seconds_count", metrics.render())
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("h", "Help", (1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe((("view", 'a"b'),), value)
+        self.assertEqual(
+            histogram.render(),
+            "# HELP h Help\n"
+            "# TYPE h histogram\n"
+            'h_bucket{view="a\\"b",le="1"} 2\n'
+            'h_bucket{view="a\\"b",le="10"} 3\n'
+            'h_bucket{view="a\\"b",le="+Inf"} 4\n'
+            'h_sum{view="a\\"b"} 56.5\n'
+            'h_count{view="a\\"b"} 4\n',
+        )
+
+
+# Query and response time budgets per endpoint, checked by QueryBudgetTest
+# over its seeded dataset. Requests are authenticated by force and start with
+# an empty cache, so the budgets are those of the uncached path. Queries are
+# counted on every database: the reads spanning all sales run once per
+# database holding some. Response times depend on the machine, and are only
+# checked with CHECK_RESPONSE_TIMES set in the environment.
+# (name, method, path, data, max queries, max milliseconds)
+QUERY_BUDGETS = [
+    ("sale list", "get", "/api/v1/sales/", None, 2, 2000),
+    ("sale list page", "get", "/api/v1/sales/?page_size=100", None, 2, 250),
+    (
+        "sale create",
+        "post",
+        "/api/v1/sales/",
+        {"date": "2011-01-01", "product": "P1", "sales_number": 2, "revenue": 3},
+        12,
+        250,
+    ),
+    ("sale detail", "get", "/api/v1/sales/{sale}/", None, 2, 250),
+    (
+        "sale update",
+        "put",
+        "/api/v1/sales/{sale}/",
+        {"date": "2011-01-01", "product": "P2", "sales_number": 2, "revenue": 3},
+        22,
+        250,
+    ),
+    ("sale delete", "delete", "/api/v1/sales/{sale}/", None, 16, 250),
+    ("sale export", "get", "/api/v1/sales/export/?format=csv", None, 1, 2000),
+    (
+        "sale bulk",
+        "post",
+        "/api/v1/sales/bulk/",
+        [
+            {"date": "2011-01-01", "product": "P1", "sales_number": 1, "revenue": i}
+            for i in range(50)
+        ],
+        14,
+        500,
+    ),
+    ("countries", "get", "/api/v1/countries/", None, 2, 500),
+    (
+        "sale statistics",
+        "get",
+        "/api/v1/sale_statistics/",
+        None,
+        3 + len(sharding.databases()),
+        250,
+    ),
+    (
+        "sale leaderboard",
+        "get",
+        "/api/v1/sale_statistics/leaderboard/?start=2010-06-01&end=2010-12-31",
+        None,
+        2,
+        250,
+    ),
+    (
+        "global sale leaderboard",
+        "get",
+        "/api/v1/sale_statistics/leaderboard/?scope=all&start=2010-06-01",
+        None,
+        len(sharding.databases()),
+        250,
+    ),
+    (
+        "sale time series",
+        "get",
+        "/api/v1/sale_statistics/timeseries/?interval=month",
+        None,
+        2,
+        500,
+    ),
+    (
+        "sale distribution",
+        "get",
+        "/api/v1/sale_statistics/distribution/",
+        None,
+        2 * len(sharding.databases()),
+        2000,
+    ),
+]
+
+
+class QueryBudgetTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, *others = [
+            models.User.objects.create_user(f"user{i}@gmail.com") for i in range(3)
+        ]
+        for user, count in [(cls.user, 2000)] + [(other, 500) for other in others]:
+            sales = [
+                models.Sale(
+                    user=user,
+                    date=datetime.date(2010, 1, 1) + datetime.timedelta(days=i % 730),
+                    product=f"P{i % 20}",
+                    sales_number=i % 10 + 1,
+                    revenue=(i * 37 % 1000) / 10,
+                )
+                for i in range(count)
+            ]
+            models.Sale.objects.for_user(user.id).bulk_create(sales)
+        rollups.rebuild()
+        for i in range(30):
+            country = models.Country.objects.create(name=f"Country {i}")
+            models.City.objects.bulk_create(
+                models.City(name=f"City {i}.{j}", country=country) for j in range(10)
+            )
+
+    def setUp(self):
+        caching.get_cache().clear()
+        analytics.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def assertWithinBudget(self, name, method, path, data, max_queries, max_ms):
+        sale = models.Sale.objects.for_user(self.user.id).first()
+        with contextlib.ExitStack() as stack:
+            # Every database, such as the shards of huy.settings_sharded
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in self.databases
+            ]
+            started = time.perf_counter()
+            response = getattr(self.client, method)(
+                path.format(sale=sale.id), data, format="json"
+            )
+            content = (
+                b"".join(response.streaming_content)
+                if response.streaming
+                else response.content
+            )
+            elapsed = (time.perf_counter() - started) * 1000
+        queries = [query["sql"] for context in contexts for query in context]
+        self.assertLess(response.status_code, 300, content[:500])
+        self.assertLessEqual(
+            len(queries),
+            max_queries,
+            f"{name} ran {len(queries)} queries, budget {max_queries}:\n"
+            + "\n".join(queries),
+        )
+        if os.environ.get("CHECK_RESPONSE_TIMES"):
+            self.assertLessEqual(
+                elapsed, max_ms, f"{name} took {elapsed:.0f}ms, budget {max_ms}ms"
+            )
+
+    def test_budgets(self):
+        for name, method, path, data, max_queries, max_ms in QUERY_BUDGETS:
+            if name == "sale distribution" and not analytics.available():
+                continue
+            with self.subTest(name), contextlib.ExitStack() as stack:
+                for alias in self.databases:
+                    stack.enter_context(transaction.atomic(using=alias))
+                self.assertWithinBudget(name, method, path, data, max_queries, max_ms)
+                for alias in self.databases:
+                    transaction.set_rollback(True, using=alias)
+
+
+class SaleListFastPathTest(rest_test.APITestCase):
+    databases = SALE_DATABASES
+
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            "user1@gmail.com", "user1@gmail.com", "user1_pass"
+        )
+        self.client.force_authenticate(user=self.user)
+        for date, product, sales_number, revenue in [
+            ("2010-2-1", 'Ünïcödé \u2028 "quoted"', 1, 0.1),
+            ("2010-2-1", "A", -5, 1e20),
+            ("2009-12-31", "", 0, -2.5),
+            ("2010-3-1", "B\nC", 2**40, 3),
+        ]:
+            models.Sale.objects.for_user(self.user.id).create(
+                user=self.user,
+                date=date,
+                product=product,
+                sales_number=sales_number,
+                revenue=revenue,
+            )
+
+    def serialized(self, sales):
+        return rest_renderers.JSONRenderer().render(
+            serializers.SaleSerializer(sales, many=True).data
+        )
+
+    def test_same_output_as_serializer(self):
+        sales = models.Sale.objects.for_user(self.user.id)
+        response = self.client.get("/api/v1/sales/")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, self.serialized(sales))
+
+    def test_same_output_as_serializer_paginated(self):
+        sales = models.Sale.objects.for_user(self.user.id).order_by("date", "id")
+        response = self.client.get("/api/v1/sales/", {"page_size": 2})
+        self.assertEqual(
+            json.loads(response.content)["results"],
+            json.loads(self.serialized(sales[:2])),
+        )
+        next_page = self.client.get(json.loads(response.content)["next"])
+        self.assertEqual(
+            next_page.content,
+            b'{"next":null,"results":' + self.serialized(sales[2:]) + b"}",
+        )
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_browsable_api_uses_serializer(self):
+        response = self.client.get("/api/v1/sales/", HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/html"))
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class OpenAPISchemaTest(rest_test.APITestCase):
+    def setUp(self):
+        schema.reset()
+        self.addCleanup(schema.reset)
+
+    def test_document_generated_once(self):
+        with mock.patch.object(schema, "generate", wraps=schema.generate) as generate:
+            first = self.client.get("/api/v1/redoc/openapi.json")
+            second = self.client.get("/api/v1/redoc/?format=openapi")
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.content, second.content)
+        self.assertIn("/sales/", json.loads(first.content)["paths"])
+
+    def test_not_modified(self):
+        etag = self.client.get("/api/v1/redoc/openapi.json")["ETag"]
+        response = self.client.get(
+            "/api/v1/redoc/openapi.json", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_redoc_page_points_at_document(self):
+        with mock.patch.object(schema.finders, "find", return_value=None):
+            response = self.client.get("/api/v1/redoc/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b"/api/v1/redoc/openapi.json", response.content)
+
+    def test_redoc_page_points_at_static_file(self):
+        with mock.patch.object(schema.finders, "find", return_value="openapi.json"):
+            response = self.client.get("/api/v1/redoc/")
+        self.assertIn(b"/static/app/openapi.json", response.content)
+
+    def test_build_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "openapi.json")
+            call_command("build_openapi_schema", output=path, stdout=io.StringIO())
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), schema.get_document()[0])
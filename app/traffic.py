@@ -0,0 +1,268 @@
+"""
+Recording and replaying API traffic.
+
+A recording is a JSONL file with one request per line::
+
+    {"timestamp": 1637900000.5, "method": "POST", "path": "/api/v1/sales/",
+     "user": "user1@gmail.com", "content_type": "application/json",
+     "body": "{...}", "status": 201, "duration_ms": 12.3}
+
+``TrafficRecordingMiddleware`` writes it, ``manage.py replay_traffic`` plays
+it back, in process or against a running server.
+"""
+
+import collections
+import concurrent.futures
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+import rest_framework.test as rest_test
+
+import app.models as models
+
+SECRET_FIELDS = {"password"}
+
+
+def _redact(body, content_type):
+    """Return ``body`` without its secrets, and whether it had any."""
+    if content_type.startswith("application/json"):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return body, False
+        if isinstance(data, dict) and SECRET_FIELDS & data.keys():
+            data = {
+                name: value for name, value in data.items() if name not in SECRET_FIELDS
+            }
+            return json.dumps(data), True
+    elif content_type.startswith("application/x-www-form-urlencoded"):
+        fields = urllib.parse.parse_qsl(body, keep_blank_values=True)
+        if any(name in SECRET_FIELDS for name, _ in fields):
+            return (
+                urllib.parse.urlencode(
+                    [
+                        (name, value)
+                        for name, value in fields
+                        if name not in SECRET_FIELDS
+                    ]
+                ),
+                True,
+            )
+    return body, False
+
+
+def make_record(request, body, response, timestamp, duration):
+    """
+    Describe ``request`` and its ``response``. ``body`` is the raw request
+    body, or None when it was too large to record.
+
+    Secrets such as passwords are dropped; requests that had any are marked
+    ``redacted`` and skipped by the replay.
+    """
+    user = getattr(request, "user", None)
+    record = {
+        "timestamp": timestamp,
+        "method": request.method,
+        "path": request.get_full_path(),
+        "user": user.get_username() if user and user.is_authenticated else None,
+        "content_type": request.content_type or "",
+        "body": None,
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+    }
+    if body is None:
+        record["body_omitted"] = True
+    elif body:
+        try:
+            record["body"], redacted = _redact(
+                body.decode("utf-8"), record["content_type"]
+            )
+        except UnicodeDecodeError:
+            record["body_omitted"] = True
+        else:
+            if redacted:
+                record["redacted"] = True
+    return record
+
+
+def dump_record(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def load_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def endpoint(record):
+    """Group requests by method and URL pattern, e.g. "GET api/v1/sales/<int:pk>/"."""
+    path = urllib.parse.urlsplit(record["path"]).path
+    try:
+        route = resolve(path).route
+    except Resolver404:
+        route = path
+    return f"{record['method']} {route}"
+
+
+class InProcessClient:
+    """Sends requests through Django's test client, as the recorded users."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._users = {}
+
+    def _user(self, username):
+        if username not in self._users:
+            self._users[username] = models.User.objects.filter(
+                username=username
+            ).first()
+        return self._users[username]
+
+    def send(self, record):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = rest_test.APIClient()
+        user = self._user(record["user"]) if record["user"] else None
+        client.force_authenticate(user=user)
+        response = client.generic(
+            record["method"],
+            record["path"],
+            (record["body"] or "").encode("utf-8"),
+            record["content_type"] or "application/octet-stream",
+            HTTP_HOST="localhost",
+        )
+        return response.status_code
+
+
+class HTTPClient:
+    """
+    Sends requests to the server at ``base_url``, authenticated with a token
+    of the recorded user, taken from (or created in) the configured database.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self._tokens = {}
+
+    def _token(self, username):
+        if username not in self._tokens:
+            user = models.User.objects.filter(username=username).first()
+            self._tokens[username] = (
+                Token.objects.get_or_create(user=user)[0].key if user else None
+            )
+        return self._tokens[username]
+
+    def send(self, record):
+        headers = {}
+        if record["content_type"]:
+            headers["Content-Type"] = record["content_type"]
+        token = self._token(record["user"]) if record["user"] else None
+        if token:
+            headers["Authorization"] = f"Token {token}"
+        body = record["body"].encode("utf-8") if record["body"] else None
+        request = urllib.request.Request(
+            self.base_url + record["path"],
+            data=body,
+            headers=headers,
+            method=record["method"],
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, -(-len(sorted_values) * p // 100) - 1))
+    return sorted_values[index]
+
+
+class Replay:
+    """
+    Play ``records`` back with ``client`` on ``concurrency`` threads.
+
+    Requests start as fast as the threads allow, or at ``rate`` requests per
+    second, or spaced like they were recorded, sped up ``speed`` times.
+    """
+
+    def __init__(self, records, client, concurrency=1, rate=None, speed=None):
+        self.records = [record for record in records if not record.get("redacted")]
+        self.skipped = len(records) - len(self.records)
+        self.client = client
+        self.concurrency = concurrency
+        self.offsets = self._offsets(rate, speed)
+        self.results = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _offsets(self, rate, speed):
+        if rate:
+            return [i / rate for i in range(len(self.records))]
+        if speed and self.records:
+            first = self.records[0]["timestamp"]
+            return [(record["timestamp"] - first) / speed for record in self.records]
+        return [0] * len(self.records)
+
+    def _play(self, index):
+        record = self.records[index]
+        delay = self.started + self.offsets[index] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        started = time.perf_counter()
+        try:
+            status = self.client.send(record)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - started
+        # A recorded error replayed identically is not a replay error.
+        failed = status is None or (status >= 400 and status != record.get("status"))
+        with self._lock:
+            self.results[endpoint(record)].append((elapsed, failed))
+
+    def _play_on_thread(self, index):
+        try:
+            self._play(index)
+        finally:
+            connections.close_all()
+
+    def run(self):
+        self.started = time.perf_counter()
+        if self.concurrency == 1:
+            for index in range(len(self.records)):
+                self._play(index)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+                list(pool.map(self._play_on_thread, range(len(self.records))))
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def summary(self):
+        """Per endpoint (and overall): count, req/s, error rate, p50/p95/p99 ms."""
+        groups = dict(sorted(self.results.items()))
+        groups["total"] = [result for results in groups.values() for result in results]
+        rows = []
+        for name, results in groups.items():
+            latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+            errors = sum(failed for _, failed in results)
+            rows.append(
+                {
+                    "endpoint": name,
+                    "requests": len(results),
+                    "throughput": len(results) / self.elapsed if self.elapsed else 0,
+                    "error_rate": errors / len(results) if results else 0,
+                    **{
+                        f"p{p}": percentile(latencies, p) if latencies else None
+                        for p in (50, 95, 99)
+                    },
+                }
+            )
+        return rows
@@ -1,33 +1,53 @@
+from django.conf import settings
 from django.urls import path
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-from . import views
+from . import async_views, views
+
+
+def read_view(view_class):
+    """``view_class.as_view()``, async when ``ASYNC_READ_VIEWS`` is set."""
+    view = view_class.as_view()
+    if settings.ASYNC_READ_VIEWS:
+        return async_views.offload(view)
+    return view
+
 
 api_url_patterns = [
     path("login/", views.LoginView.as_view(), name="login"),
     path("logout/", views.LogoutView.as_view(), name="logout"),
     path("user/<int:pk>/", views.UserView.as_view(), name="user"),
-    path("sales/", views.SaleListView.as_view()),
-    path("sales/<int:pk>/", views.SaleDetailView.as_view()),
-    path("countries/", views.CountryListView.as_view(), name="countries"),
+    path("sales/", read_view(views.SaleListView)),
+    path("sales/bulk/", views.SaleBulkView.as_view(), name="sales_bulk"),
+    path("sales/export/", views.SaleExportView.as_view(), name="sales_export"),
     path(
-        "sale_statistics/", views.SaleStatisticsView.as_view(), name="sale_statistics"
+        "sales/queue/<int:pk>/",
+        views.SaleQueueItemView.as_view(),
+        name="sale_queue_item",
     ),
-]
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="API Documentation",
-        default_version="v1",
-        description="API Description",
-        contact=openapi.Contact(email="havanhuy1997@gmail.com"),
+    path("sales/<int:pk>/", read_view(views.SaleDetailView)),
+    path("countries/", read_view(views.CountryListView), name="countries"),
+    path(
+        "sale_statistics/", read_view(views.SaleStatisticsView), name="sale_statistics"
     ),
-    url="https://localhost:8000/api/v1",
-    public=True,
-    patterns=api_url_patterns,
-)
+    path(
+        "sale_statistics/distribution/",
+        read_view(views.SaleDistributionView),
+        name="sale_distribution",
+    ),
+    path(
+        "sale_statistics/leaderboard/",
+        read_view(views.SaleLeaderboardView),
+        name="sale_leaderboard",
+    ),
+    path(
+        "sale_statistics/timeseries/",
+        read_view(views.SaleTimeSeriesView),
+        name="sale_time_series",
+    ),
+]
 
 urlpatterns = api_url_patterns + [
-    path("redoc/", schema_view.with_ui("redoc", cache_timeout=0), name="docs"),
+    path("redoc/", views.docs, name="docs"),
+    path("redoc/openapi.json", views.openapi_document, name="openapi_document"),
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
 ]
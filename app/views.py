@@ -1,10 +1,18 @@
-import collections
+import hashlib
+import json
 
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 import django.http as django_htt
+import django.utils.cache as django_cache
+from django.utils.http import http_date
+from django.urls import reverse
+from django.views.decorators.http import condition
+import rest_framework.parsers as rest_parsers
 import rest_framework.permissions as rest_permissions
 import rest_framework.authtoken.views as authtoken_views
 import rest_framework.authtoken.models as authtoken_models
+import rest_framework.renderers as rest_renderers
 import rest_framework.views as rest_views
 from rest_framework.response import Response
 from rest_framework import generics
@@ -12,9 +20,21 @@ from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+import app.analytics as analytics
+import app.caching as caching
+import app.conditional as conditional
+import app.export as export
+import app.ingest as ingest
+import app.metrics as metrics
 import app.models as models
+import app.pagination as pagination
+import app.parsers as parsers
 import app.serializers as serializers
 import app.permissions as permissions
+import app.renderers as renderers
+import app.sale_queue as sale_queue
+import app.schema as schema
+import app.statistics as statistics
 
 
 class LoginView(authtoken_views.ObtainAuthToken):
@@ -121,9 +141,157 @@ class UserView(rest_views.APIView):
 class SaleListView(generics.ListCreateAPIView):
     serializer_class = serializers.SaleSerializer
     permission_classes = (rest_permissions.IsAuthenticated,)
+    pagination_class = pagination.SaleKeysetPagination
 
     def get_queryset(self):
-        return models.Sale.objects.filter(user=self.request.user)
+        return models.Sale.objects.for_user(self.request.user.id)
+
+    @conditional.etag(conditional.sale_list_etag)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_201_CREATED: serializers.SaleSerializer,
+            status.HTTP_202_ACCEPTED: openapi.Response(
+                "Queued, when the write-behind queue is on: the sale is saved "
+                "later, see the Location header for its status",
+                serializers.SaleQueueItemSerializer,
+            ),
+            status.HTTP_429_TOO_MANY_REQUESTS: "Too many sales of the current user queued",
+            status.HTTP_503_SERVICE_UNAVAILABLE: "Too many sales queued",
+        }
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        if not settings.SALE_QUEUE_PATH:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item_id = sale_queue.enqueue(request.user.id, serializer.validated_data)
+        return Response(
+            serializers.SaleQueueItemSerializer(
+                {"id": item_id, "status": sale_queue.QUEUED}
+            ).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": reverse("sale_queue_item", args=[item_id])},
+        )
+
+    def list(self, request, *args, **kwargs):
+        if type(request.accepted_renderer) is not rest_renderers.JSONRenderer:
+            return super().list(request, *args, **kwargs)
+        # Fast path for JSON: encode the serializer fields straight from
+        # database rows, skipping model instances and serializer fields.
+        queryset = self.filter_queryset(self.get_queryset()).values_list(
+            *export.SALE_FIELDS, named=True
+        )
+        page = self.paginate_queryset(queryset)
+        with metrics.timing("serialize"):
+            if page is None:
+                body = export.sales_json(queryset)
+            else:
+                body = b"".join(
+                    [
+                        b'{"next":',
+                        json.dumps(self.paginator.get_next_link()).encode("utf-8"),
+                        b',"results":',
+                        export.sales_json(page),
+                        b"}",
+                    ]
+                )
+        return django_htt.HttpResponse(body, content_type="application/json")
+
+
+class SaleBulkView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+    parser_classes = (rest_parsers.JSONParser, parsers.NDJSONParser)
+
+    @swagger_auto_schema(
+        operation_description="Create many sales at once from a JSON array or an NDJSON body. Valid rows are created even if others are rejected",
+        request_body=serializers.SaleSerializer(many=True),
+        responses={
+            status.HTTP_201_CREATED: openapi.Response(
+                "All the sales were created",
+                openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "created": openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "errors": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                        ),
+                    },
+                ),
+            ),
+            status.HTTP_207_MULTI_STATUS: "Some rows were rejected, see errors",
+            status.HTTP_400_BAD_REQUEST: "No row could be created",
+        },
+    )
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response(
+                {"message": "Expected a list of sales"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(rows) > settings.SALE_BULK_MAX_ROWS:
+            return Response(
+                {"message": f"At most {settings.SALE_BULK_MAX_ROWS} sales per request"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        created, errors = ingest.ingest_sales(
+            request.user, rows, context={"request": request}
+        )
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"created": created, "errors": errors}, status=response_status)
+
+
+class SaleExportView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+    renderer_classes = (renderers.NDJSONRenderer, renderers.CSVRenderer)
+
+    @swagger_auto_schema(
+        operation_description="Export all the sales of the current user as NDJSON or CSV, chosen by the Accept header or the format parameter",
+        responses={status.HTTP_200_OK: "Streamed sales, ordered by date"},
+    )
+    def get(self, request):
+        renderer = request.accepted_renderer
+        rows = export.sale_rows(models.Sale.objects.for_user(request.user.id))
+        if renderer.format == renderers.CSVRenderer.format:
+            stream = export.csv_stream(rows)
+        else:
+            stream = export.ndjson_stream(rows)
+        response = django_htt.StreamingHttpResponse(
+            stream, content_type=f"{renderer.media_type}; charset={renderer.charset}"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="sales.{renderer.format}"'
+        )
+        return response
+
+
+class SaleQueueItemView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+
+    @swagger_auto_schema(
+        operation_description="Status of a sale queued by POST /sales/, until SALE_QUEUE_RETENTION after it was saved or rejected",
+        responses={
+            status.HTTP_200_OK: serializers.SaleQueueItemSerializer,
+            status.HTTP_404_NOT_FOUND: "No such item queued by the current user",
+        },
+    )
+    def get(self, request, pk):
+        item = sale_queue.get(pk) if settings.SALE_QUEUE_PATH else None
+        if item is None or item["user_id"] != request.user.id:
+            raise django_htt.Http404
+        return Response(serializers.SaleQueueItemSerializer(item).data)
 
 
 class SaleDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -134,12 +302,60 @@ class SaleDetailView(generics.RetrieveUpdateDestroyAPIView):
         permissions.isObjectBelongToUser,
     )
 
+    def get_queryset(self):
+        if getattr(self, "swagger_fake_view", False):
+            return super().get_queryset()
+        # Sales of other users are not found, whichever shard holds them:
+        # only the current user's shard is searched.
+        return models.Sale.objects.for_user(self.request.user.id)
+
+    def get_object(self):
+        # Looked up by the ETag first, see app.conditional
+        if not hasattr(self, "_object"):
+            self._object = super().get_object()
+        return self._object
+
+    @conditional.etag(conditional.sale_detail_etag)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class CountryListView(generics.ListAPIView):
-    queryset = models.Country.objects.all()
+    queryset = models.Country.objects.prefetch_related("cities")
     serializer_class = serializers.CountrySerializer
     permission_classes = (rest_permissions.IsAuthenticated,)
 
+    def render_countries(self):
+        body = rest_renderers.JSONRenderer().render(
+            self.get_serializer(self.get_queryset(), many=True).data
+        )
+        return {"body": body, "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"'}
+
+    def list(self, request, *args, **kwargs):
+        # Countries and cities are reference data: serve a JSON body rendered
+        # once per change instead of re-serializing it on every request.
+        if not isinstance(request.accepted_renderer, rest_renderers.JSONRenderer):
+            return super().list(request, *args, **kwargs)
+        # The same for every worker rendering the body, as the counter is in
+        # the shared cache.
+        last_modified = caching.changed_at("countries")
+        countries = caching.get_or_set(
+            "countries",
+            "country_list",
+            self.render_countries,
+            settings.COUNTRY_LIST_CACHE_TIMEOUT,
+        )
+        response = django_cache.get_conditional_response(
+            request, etag=countries["etag"], last_modified=last_modified
+        )
+        if response is None:
+            response = django_htt.HttpResponse(
+                countries["body"], content_type="application/json"
+            )
+        response["ETag"] = countries["etag"]
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
 
 class SaleStatisticsView(rest_views.APIView):
     permission_classes = (rest_permissions.IsAuthenticated,)
@@ -173,57 +389,134 @@ class SaleStatisticsView(rest_views.APIView):
             )
         },
     )
+    @conditional.etag(conditional.sale_statistics_etag)
     def get(self, request):
-        total_number_current, total_revenue_current = 0, 0
-        total_number_all, total_revenue_all = 0, 0
-        highest_revenue_sale_current = None
-        highest_revenue_current = float("-inf")
-        product_data = collections.defaultdict(dict)
-        for sale in models.Sale.objects.all():
-            if sale.user.id == request.user.id:
-                # Calculate average_sales_for_current_user
-                total_number_current += sale.sales_number
-                total_revenue_current += sale.revenue
-
-                # Calcualte highest_revenue_sale_for_current_user
-                if sale.revenue > highest_revenue_current:
-                    highest_revenue_current = sale.revenue
-                    highest_revenue_sale_current = sale
-
-                # Calculate data for each product
-                product = product_data[sale.product]
-                product["revenue"] = product.get("revenue", 0) + sale.revenue
-                product["number_sold"] = (
-                    product.get("number_sold", 0) + sale.sales_number
-                )
-            total_number_all += sale.sales_number
-            total_revenue_all += sale.revenue
-
-        highest_revenue, highest_number = float("-inf"), float("-inf")
-        revenue_product, number_product = None, None
-        for product_name, data in product_data.items():
-            if data["revenue"] > highest_revenue:
-                highest_revenue = data["revenue"]
-                revenue_product = product_name
-            if data["number_sold"] > highest_number:
-                highest_number = data["number_sold"]
-                number_product = product_name
+        return Response(
+            statistics.sale_statistics(request.user.id), status=status.HTTP_200_OK
+        )
+
 
+class SaleLeaderboardView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+
+    @swagger_auto_schema(
+        tags=["Statistics"],
+        operation_description="Products with the highest revenue or number of units sold, of the current user or of all users, optionally between two dates",
+        query_serializer=serializers.SaleLeaderboardQuerySerializer,
+        responses={
+            status.HTTP_200_OK: serializers.SaleLeaderboardEntrySerializer(many=True)
+        },
+    )
+    @conditional.etag(conditional.sale_leaderboard_etag)
+    def get(self, request):
+        query = serializers.SaleLeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        options = dict(query.validated_data)
+        scope = options.pop("scope")
+        entries = statistics.product_leaderboard(
+            request.user.id if scope == "user" else None, **options
+        )
         return Response(
-            {
-                "average_sales_for_current_user": total_revenue_current
-                / total_number_current,
-                "average_sale_all_user": total_revenue_all / total_number_all,
-                "highest_revenue_sale_for_current_user": {
-                    "sale_id": highest_revenue_sale_current.id,
-                    "revenue": highest_revenue_sale_current.revenue,
-                },
-                "product_highest_revenue_for_current_user": {
-                    "product_name": revenue_product
-                },
-                "product_highest_sales_number_for_current_user": {
-                    "product_name": number_product
-                },
-            },
+            serializers.SaleLeaderboardEntrySerializer(entries, many=True).data,
             status=status.HTTP_200_OK,
         )
+
+
+class SaleTimeSeriesView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+
+    @swagger_auto_schema(
+        tags=["Statistics"],
+        operation_description="Revenue and number of units sold per product and per day, week or month",
+        query_serializer=serializers.SaleTimeSeriesQuerySerializer,
+        responses={
+            status.HTTP_200_OK: serializers.SaleTimeSeriesBucketSerializer(many=True)
+        },
+    )
+    @conditional.etag(conditional.sale_list_etag)
+    def get(self, request):
+        query = serializers.SaleTimeSeriesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        buckets = statistics.sale_time_series(request.user.id, **query.validated_data)
+        return Response(
+            serializers.SaleTimeSeriesBucketSerializer(buckets, many=True).data,
+            status=status.HTTP_200_OK,
+        )
+
+
+class SaleDistributionView(rest_views.APIView):
+    permission_classes = (rest_permissions.IsAuthenticated,)
+    _snapshot = None
+
+    def get_snapshot(self):
+        """
+        The analytics snapshot the request is answered from, read once, for
+        the ETag (see app.conditional) as for the body.
+        """
+        if self._snapshot is None:
+            self._snapshot = analytics.get_snapshot()
+        return self._snapshot
+
+    @swagger_auto_schema(
+        tags=["Statistics"],
+        operation_description="Revenue percentiles of the current user's sales, overall and per product, and the rank of the user's total revenue among all users",
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                "",
+                openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "sales": openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "revenue_percentiles": openapi.Schema(type=openapi.TYPE_OBJECT),
+                        "median_sales_number": openapi.Schema(type=openapi.TYPE_NUMBER),
+                        "products": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                        ),
+                        "revenue_rank_percentile": openapi.Schema(
+                            type=openapi.TYPE_NUMBER
+                        ),
+                    },
+                ),
+            ),
+            status.HTTP_501_NOT_IMPLEMENTED: "NumPy is not installed",
+        },
+    )
+    @conditional.etag(conditional.sale_distribution_etag)
+    def get(self, request):
+        if not analytics.available():
+            return Response(
+                {"message": "Sales analytics need NumPy"},
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+            )
+        return Response(
+            analytics.sale_distribution(request.user.id, self.get_snapshot()),
+            status=status.HTTP_200_OK,
+        )
+
+
+class MetricsView(rest_views.APIView):
+    """Request performance histograms, in the Prometheus text format."""
+
+    permission_classes = (rest_permissions.IsAdminUser,)
+    swagger_schema = None
+
+    def get(self, request):
+        return django_htt.HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+@condition(etag_func=conditional.openapi_document_etag)
+def openapi_document(request):
+    """The OpenAPI document, from memory (see app.schema)."""
+    return django_htt.HttpResponse(
+        schema.get_document()[0], content_type="application/json"
+    )
+
+
+def docs(request):
+    # The document used to be served by this URL, keep that working.
+    if request.GET.get("format") == "openapi":
+        return openapi_document(request)
+    return django_htt.HttpResponse(schema.get_redoc_page(request))
@@ -0,0 +1,151 @@
+"""
+Compare the revenue distribution of one user computed with the ORM and plain
+Python against ``app.analytics.sale_distribution`` on a warm snapshot.
+
+    python -m benchmarks.analytics --rows 1000000 --users 1000
+"""
+
+import argparse
+import datetime
+import math
+import statistics
+
+from benchmarks import common
+
+
+def percentile(values, p):
+    """Linear interpolation between closest ranks, like numpy.percentile."""
+    position = (len(values) - 1) * p / 100
+    low, high = math.floor(position), math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def orm_distribution(user_id):
+    from django.db.models import Sum
+
+    from app import analytics, models
+
+    revenues, per_product, sales_numbers = [], {}, []
+    for product, sales_number, revenue in models.Sale.objects.filter(
+        user_id=user_id
+    ).values_list("product", "sales_number", "revenue"):
+        revenues.append(revenue)
+        sales_numbers.append(sales_number)
+        per_product.setdefault(product, []).append(revenue)
+
+    def percentiles(values):
+        values = sorted(values)
+        return {f"p{p}": percentile(values, p) for p in analytics.PERCENTILES}
+
+    totals = [
+        total
+        for total in models.Sale.objects.values("user_id")
+        .annotate(total=Sum("revenue"))
+        .values_list("total", flat=True)
+    ]
+    mine = sum(revenues)
+    return {
+        "sales": len(revenues),
+        "revenue_percentiles": percentiles(revenues),
+        "median_sales_number": statistics.median(sales_numbers),
+        "products": [
+            {
+                "product": product,
+                "sales": len(values),
+                "revenue": sum(values),
+                "revenue_percentiles": percentiles(values),
+            }
+            for product, values in sorted(per_product.items())
+        ],
+        "revenue_rank_percentile": 100
+        * sum(total <= mine for total in totals)
+        / len(totals),
+    }
+
+
+def load_sales(rows, users):
+    from django.db import transaction
+
+    from app import models
+
+    # No passwords: hashing one per user would dominate the setup.
+    models.User.objects.bulk_create(
+        models.User(username=f"bench{i}@example.com") for i in range(users)
+    )
+    user_ids = list(models.User.objects.order_by("id").values_list("id", flat=True))
+    products = [f"Product {i}" for i in range(50)]
+    start = datetime.date(2010, 1, 1)
+    batch = []
+    with transaction.atomic():
+        for i in range(rows):
+            batch.append(
+                models.Sale(
+                    user_id=user_ids[i % users],
+                    date=start + datetime.timedelta(days=i % 3650),
+                    product=products[i * 7 % len(products)],
+                    sales_number=i % 50 + 1,
+                    revenue=(i * 37 % 1000) / 10,
+                )
+            )
+            if len(batch) == 10000:
+                models.Sale.objects.bulk_create(batch)
+                batch = []
+        models.Sale.objects.bulk_create(batch)
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    common.setup()
+    from app import analytics, models
+
+    timings = {}
+    with common.test_databases():
+        with common.timer(timings, "load"):
+            user_ids = load_sales(args.rows, args.users)
+        with common.timer(timings, "snapshot (cold)"):
+            snapshot = analytics.get_snapshot()
+        models.Sale.objects.create(
+            user_id=user_ids[0],
+            date="2010-1-1",
+            product="Product 0",
+            sales_number=1,
+            revenue=1,
+        )
+        with common.timer(timings, "snapshot (1 new row)"):
+            analytics.get_snapshot()
+
+        sample = user_ids[:: max(1, len(user_ids) // args.repeat)][: args.repeat]
+        expected = orm_distribution(sample[0])
+        actual = analytics.sale_distribution(sample[0], snapshot)
+        assert actual["sales"] == expected["sales"]
+        assert math.isclose(
+            actual["revenue_rank_percentile"], expected["revenue_rank_percentile"]
+        )
+        for p, value in expected["revenue_percentiles"].items():
+            assert math.isclose(actual["revenue_percentiles"][p], value)
+
+        with common.timer(timings, "ORM + Python"):
+            for user_id in sample:
+                orm_distribution(user_id)
+        with common.timer(timings, "NumPy snapshot"):
+            for user_id in sample:
+                analytics.sale_distribution(user_id)
+
+    rows = [("step", "seconds")]
+    for name, seconds in timings.items():
+        rows.append((name, f"{seconds:.3f}"))
+    common.report(
+        f"{args.rows} sales of {args.users} users, {len(sample)} distributions",
+        rows,
+    )
+    print(f"speedup {timings['ORM + Python'] / timings['NumPy snapshot']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
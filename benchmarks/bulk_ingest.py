@@ -0,0 +1,57 @@
+"""
+Compare the rows/second of POST /sales/ (one sale per request) with
+POST /sales/bulk/ (batched bulk_create).
+
+    python -m benchmarks.bulk_ingest --rows 2000
+"""
+
+import argparse
+
+from benchmarks import common
+
+TARGET_SPEEDUP = 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--request-rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework.test import APIClient
+
+    rows = common.sample_sales(args.rows)
+    timings = {}
+    with common.test_databases():
+        client = APIClient()
+        client.force_authenticate(user=common.create_user())
+
+        with common.timer(timings, "single"):
+            for row in rows:
+                response = client.post("/api/v1/sales/", row, format="json")
+                assert response.status_code == 201, response.content
+
+        with common.timer(timings, "bulk"):
+            for start in range(0, len(rows), args.request_rows):
+                chunk = rows[start : start + args.request_rows]
+                response = client.post("/api/v1/sales/bulk/", chunk, format="json")
+                assert response.status_code == 201, response.content
+
+    single_rate = args.rows / timings["single"]
+    bulk_rate = args.rows / timings["bulk"]
+    common.report(
+        f"Ingesting {args.rows} sales",
+        [
+            ("endpoint", "seconds", "rows/s"),
+            ("/sales/", f"{timings['single']:.2f}", f"{single_rate:.0f}"),
+            ("/sales/bulk/", f"{timings['bulk']:.2f}", f"{bulk_rate:.0f}"),
+        ],
+    )
+    speedup = bulk_rate / single_rate
+    verdict = "met" if speedup >= TARGET_SPEEDUP else "NOT met"
+    print(f"speedup {speedup:.1f}x, target {TARGET_SPEEDUP}x {verdict}")
+
+
+if __name__ == "__main__":
+    main()
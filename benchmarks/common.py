@@ -0,0 +1,68 @@
+"""
+Helpers shared by the benchmarks.
+
+Benchmarks are run from the repository root, e.g.
+``python -m benchmarks.bulk_ingest``. They work on freshly created test
+databases, never on the configured ones.
+"""
+
+import contextlib
+import os
+import time
+
+import django
+
+
+def setup(settings_module="huy.settings"):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_databases():
+    from django.test import utils
+
+    from huy.test_runner import temporary_caches
+
+    utils.setup_test_environment()
+    old_config = utils.setup_databases(verbosity=0, interactive=False)
+    try:
+        with temporary_caches():
+            yield
+    finally:
+        utils.teardown_databases(old_config, verbosity=0)
+        utils.teardown_test_environment()
+
+
+def create_user(username="bench@example.com"):
+    from app import models
+
+    return models.User.objects.create_user(username, username, "bench_pass")
+
+
+def sample_sales(count):
+    products = ["Paper", "Pen", "Ruler", "Glue", "Tape", "Stapler", "Label"]
+    return [
+        {
+            "date": f"2010-{i % 12 + 1}-{i % 28 + 1}",
+            "product": products[i % len(products)],
+            "sales_number": i % 50 + 1,
+            "revenue": round((i % 97) * 1.37, 2),
+        }
+        for i in range(count)
+    ]
+
+
+@contextlib.contextmanager
+def timer(results, name):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
+
+
+def report(title, rows):
+    """Print ``rows`` (a list of tuples, header first) as an aligned table."""
+    print(title)
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,174 @@
+"""
+Compare the sync deployment (gunicorn sync workers, ``huy.wsgi``) with the
+ASGI profile (gunicorn with uvicorn workers, ``huy.asgi`` and
+``huy.settings_asgi``) under many concurrent slow clients.
+
+Slow clients send their requests in pieces over ``--send-time`` seconds,
+like clients on a bad network; fast clients send theirs at once. A sync
+worker is held by a slow client until its request is complete, so the fast
+clients queue behind the slow ones; an uvicorn worker serves other clients
+meanwhile.
+
+    python -m benchmarks.concurrency --slow-clients 50 --fast-clients 5
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+
+PROFILES = {
+    "sync (huy.wsgi)": ("huy.settings", ["huy.wsgi:application"]),
+    "ASGI (huy.asgi)": (
+        "huy.settings_asgi",
+        ["huy.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+    ),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(sales):
+    """Create a user with a token and ``sales`` sales, return the token key."""
+    from django.core.management import call_command
+    from rest_framework.authtoken.models import Token
+
+    from app import ingest
+
+    call_command("migrate", verbosity=0)
+    user = common.create_user()
+    ingest.ingest_sales(user, common.sample_sales(sales), {})
+    return Token.objects.create(user=user).key
+
+
+def start_server(base_settings, arguments, database, port, workers):
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="benchmarks.server_settings",
+        BENCHMARK_BASE_SETTINGS=base_settings,
+        BENCHMARK_DATABASE=database,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", *arguments]
+        + ["--bind", f"127.0.0.1:{port}", "--workers", str(workers)]
+        + ["--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{arguments[0]} did not start")
+
+
+async def client(port, request, send_time, until, latencies):
+    """Send ``request`` over ``send_time`` seconds, in pieces, until ``until``."""
+    pieces = max(1, int(send_time * 10))
+    size = -(-len(request) // pieces)
+    while time.monotonic() < until:
+        started = time.monotonic()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for start in range(0, len(request), size):
+            if start:
+                await asyncio.sleep(send_time / pieces)
+            writer.write(request[start : start + size])
+            await writer.drain()
+        response = await reader.read()
+        writer.close()
+        assert response.startswith(b"HTTP/1.1 200"), response[:100]
+        latencies.append(time.monotonic() - started)
+
+
+async def run_clients(port, token, args):
+    request = (
+        "GET /api/v1/sales/?page_size=20 HTTP/1.1\r\n"
+        "Host: 127.0.0.1\r\n"
+        f"Authorization: Token {token}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode("ascii")
+    slow, fast = [], []
+    until = time.monotonic() + args.duration
+    await asyncio.gather(
+        *(
+            client(port, request, args.send_time, until, slow)
+            for _ in range(args.slow_clients)
+        ),
+        *(client(port, request, 0, until, fast) for _ in range(args.fast_clients)),
+    )
+    return slow, fast
+
+
+def rate(latencies, duration):
+    return f"{len(latencies) / duration:.1f}"
+
+
+def median(latencies):
+    return f"{sorted(latencies)[len(latencies) // 2] * 1000:.0f}" if latencies else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slow-clients", type=int, default=50)
+    parser.add_argument("--fast-clients", type=int, default=5)
+    parser.add_argument(
+        "--send-time", type=float, default=2, help="Seconds a slow client takes"
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--sales", type=int, default=1000)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "db.sqlite3")
+        os.environ["BENCHMARK_DATABASE"] = database
+        common.setup("benchmarks.server_settings")
+        token = prepare_database(args.sales)
+
+        for name, (base_settings, arguments) in PROFILES.items():
+            port = free_port()
+            server = start_server(
+                base_settings, arguments, database, port, args.workers
+            )
+            try:
+                slow, fast = asyncio.run(run_clients(port, token, args))
+            finally:
+                server.terminate()
+                server.wait()
+            results.append(
+                (
+                    name,
+                    rate(slow, args.duration),
+                    median(slow),
+                    rate(fast, args.duration),
+                    median(fast),
+                    rate(slow + fast, args.duration),
+                )
+            )
+
+    common.report(
+        f"{args.slow_clients} slow clients sending requests over {args.send_time}s, "
+        f"{args.fast_clients} fast clients, {args.workers} workers, {args.duration}s",
+        [
+            ("server", "slow req/s", "slow ms", "fast req/s", "fast ms", "req/s"),
+            *results,
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare rows/second of encoding a user's sales to JSON with SaleSerializer
+and JSONRenderer against the fast path of SaleListView
+(``app.export.sales_json`` over ``values_list`` rows), database reads
+included.
+
+    python -m benchmarks.serialization --rows 10000
+"""
+
+import argparse
+
+from benchmarks import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework.renderers import JSONRenderer
+
+    from app import export, ingest, models, serializers
+
+    timings = {}
+    with common.test_databases():
+        user = common.create_user()
+        ingest.ingest_sales(user, common.sample_sales(args.rows), {})
+        sales = models.Sale.objects.filter(user=user)
+
+        def drf():
+            return JSONRenderer().render(
+                serializers.SaleSerializer(sales.all(), many=True).data
+            )
+
+        def fast():
+            return export.sales_json(sales.values_list(*export.SALE_FIELDS))
+
+        assert drf() == fast()
+        for name, encode in [("SaleSerializer", drf), ("sales_json", fast)]:
+            with common.timer(timings, name):
+                for _ in range(args.repeat):
+                    encode()
+
+    rows = [("encoder", "seconds", "rows/s")]
+    for name, seconds in timings.items():
+        rows.append(
+            (name, f"{seconds:.2f}", f"{args.rows * args.repeat / seconds:.0f}")
+        )
+    common.report(f"{args.rows} sales, {args.repeat} times", rows)
+    print(f"speedup {timings['SaleSerializer'] / timings['sales_json']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Settings for the servers started by the benchmarks: the settings module named
+by ``BENCHMARK_BASE_SETTINGS`` with its database moved to the SQLite file
+``BENCHMARK_DATABASE``, and any other database (such as sale shards), the
+file-based caches and the metrics directory next to it.
+"""
+
+import importlib
+import os
+
+_base = importlib.import_module(
+    os.environ.get("BENCHMARK_BASE_SETTINGS", "huy.settings")
+)
+globals().update((name, value) for name, value in vars(_base).items() if name.isupper())
+
+_directory = os.path.dirname(os.environ["BENCHMARK_DATABASE"])
+DATABASES = {
+    alias: {
+        **database,
+        "NAME": (
+            os.environ["BENCHMARK_DATABASE"]
+            if alias == "default"
+            else os.path.join(_directory, os.path.basename(database["NAME"]))
+        ),
+    }
+    for alias, database in _base.DATABASES.items()
+}
+CACHES = {
+    alias: (
+        {**cache, "LOCATION": os.path.join(_directory, f"cache_{alias}")}
+        if cache["BACKEND"].endswith(".FileBasedCache")
+        else cache
+    )
+    for alias, cache in _base.CACHES.items()
+}
+METRICS_DIR = os.path.join(_directory, "metrics")
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1"]
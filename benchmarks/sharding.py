@@ -0,0 +1,140 @@
+"""
+Write throughput with the sales spread over 1, 2 and 4 SQLite databases
+(``huy.settings_sharded``), each in a file of its own.
+
+Every writer process saves sales as its own user, through the ORM (the
+rollups and cache invalidations included) or with ``--api`` through POSTs
+to /api/v1/sales/; the users are picked so that the writers are spread
+evenly over the shards. Writes failing with "database is locked" are
+counted as errors.
+
+SQLite lets one writer at a time into a database, so sharding helps once
+the writers wait for each other's locks rather than for a CPU: the writers
+should not outnumber the CPUs, which is the default. The "CPU busy" column
+tells how much of the CPUs the writers used; near 100%, the writes are
+bound by the CPUs, and more shards cannot help.
+
+    python -m benchmarks.sharding --shards 1 2 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks import common
+
+
+def prepare(writers):
+    common.setup("benchmarks.server_settings")
+    from django.conf import settings
+    from django.core.management import call_command
+
+    from app import models, sharding
+
+    for alias in settings.DATABASES:
+        call_command("migrate", database=alias, verbosity=0)
+    # Users for the writers, taking every shard in turn
+    by_shard = {alias: [] for alias in sharding.databases()}
+    models.User.objects.bulk_create(
+        models.User(username=f"bench{index}@example.com")
+        for index in range(writers * len(by_shard) * 4)
+    )
+    for user_id in models.User.objects.values_list("id", flat=True):
+        by_shard[sharding.shard_for(user_id)].append(user_id)
+    shards = list(by_shard.values())
+    return [
+        shards[index % len(shards)][index // len(shards)] for index in range(writers)
+    ]
+
+
+def sale(index):
+    return {
+        "date": "2010-01-01",
+        "product": f"Product {index % 10}",
+        "sales_number": 1,
+        "revenue": 1.5,
+    }
+
+
+def write(user_id, duration, api, start_at):
+    common.setup("benchmarks.server_settings")
+    from django.db import OperationalError
+    from rest_framework.test import APIClient
+
+    from app import models
+
+    user = models.User.objects.get(pk=user_id)
+    client = APIClient(HTTP_HOST="127.0.0.1")
+    client.force_authenticate(user)
+    sales = models.Sale.objects.for_user(user_id)
+    # Every writer starts at once, after Django is set up in all of them
+    time.sleep(max(0, start_at - time.time()))
+    requests, errors = 0, 0
+    cpu = time.process_time()
+    until = time.monotonic() + duration
+    while time.monotonic() < until:
+        try:
+            if api:
+                response = client.post("/api/v1/sales/", sale(requests))
+                assert response.status_code == 201, response.status_code
+            else:
+                sales.create(user=user, **sale(requests))
+        except OperationalError:
+            errors += 1
+        requests += 1
+    return requests - errors, errors, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=os.cpu_count())
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--api", action="store_true", help="Write through /api/v1/sales/"
+    )
+    args = parser.parse_args()
+
+    # Fresh interpreters: Django must not be set up with other databases
+    context = multiprocessing.get_context("spawn")
+    os.environ["BENCHMARK_BASE_SETTINGS"] = "huy.settings_sharded"
+    rows = [("shards", "writes/s", "write errors", "CPU ms/write", "CPU busy")]
+    for shards in args.shards:
+        os.environ["SALE_SHARD_COUNT"] = str(shards)
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["BENCHMARK_DATABASE"] = os.path.join(directory, "db.sqlite3")
+            with context.Pool(1) as pool:
+                user_ids = pool.apply(prepare, (args.writers,))
+            with context.Pool(args.writers) as pool:
+                start_at = time.time() + 5
+                results = pool.starmap(
+                    write,
+                    [
+                        (user_id, args.duration, args.api, start_at)
+                        for user_id in user_ids
+                    ],
+                )
+        writes = sum(writes for writes, _, _ in results)
+        errors = sum(errors for _, errors, _ in results)
+        cpu = sum(cpu for _, _, cpu in results)
+        rows.append(
+            (
+                shards,
+                f"{writes / args.duration:.0f}",
+                errors,
+                f"{cpu / max(writes, 1) * 1000:.2f}",
+                f"{cpu / (args.duration * os.cpu_count()):.0%}",
+            )
+        )
+
+    common.report(
+        f"{args.writers} writer processes on {os.cpu_count()} CPUs, "
+        f"{'API' if args.api else 'ORM'} writes, {args.duration}s",
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Run concurrent writer and reader processes against a SQLite database with
+the default settings (``huy.settings``) and with the tuned profile
+(``huy.settings_sqlite``: WAL, busy timeout, persistent connections...).
+
+Writers POST sales to /api/v1/sales/; readers alternate between a page of
+/api/v1/sales/ and /api/v1/sale_statistics/. Requests failing with
+"database is locked" are counted as errors.
+
+    python -m benchmarks.sqlite_contention --writers 4 --readers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks import common
+
+PROFILES = {"default": "huy.settings", "tuned": "huy.settings_sqlite"}
+
+
+def prepare():
+    common.setup("benchmarks.server_settings")
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+    user = common.create_user()
+    return user.id
+
+
+def work(role, user_id, duration):
+    common.setup("benchmarks.server_settings")
+    from django.db import OperationalError
+    from rest_framework.test import APIClient
+
+    from app import models
+
+    client = APIClient(HTTP_HOST="127.0.0.1")
+    client.force_authenticate(models.User.objects.get(pk=user_id))
+    requests, errors = 0, 0
+    until = time.monotonic() + duration
+    while time.monotonic() < until:
+        try:
+            if role == "writer":
+                response = client.post(
+                    "/api/v1/sales/",
+                    {
+                        "date": "2010-01-01",
+                        "product": f"Product {requests % 10}",
+                        "sales_number": 1,
+                        "revenue": 1.5,
+                    },
+                )
+            elif requests % 2:
+                response = client.get("/api/v1/sale_statistics/")
+            else:
+                response = client.get("/api/v1/sales/?page_size=20")
+            assert response.status_code < 300, response.status_code
+        except OperationalError:
+            errors += 1
+        requests += 1
+    return role, requests, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    # Fresh interpreters: Django must not be set up with another database
+    context = multiprocessing.get_context("spawn")
+    rows = [("profile", "writes/s", "write errors", "reads/s", "read errors")]
+    for name, settings_module in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["BENCHMARK_BASE_SETTINGS"] = settings_module
+            os.environ["BENCHMARK_DATABASE"] = os.path.join(directory, "db.sqlite3")
+            with context.Pool(1) as pool:
+                user_id = pool.apply(prepare)
+            roles = ["writer"] * args.writers + ["reader"] * args.readers
+            with context.Pool(len(roles)) as pool:
+                results = pool.starmap(
+                    work, [(role, user_id, args.duration) for role in roles]
+                )
+        totals = {"writer": [0, 0], "reader": [0, 0]}
+        for role, requests, errors in results:
+            totals[role][0] += requests - errors
+            totals[role][1] += errors
+        rows.append(
+            (
+                name,
+                f"{totals['writer'][0] / args.duration:.0f}",
+                totals["writer"][1],
+                f"{totals['reader'][0] / args.duration:.0f}",
+                totals["reader"][1],
+            )
+        )
+
+    common.report(
+        f"{args.writers} writer and {args.readers} reader processes, "
+        f"{args.duration}s",
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
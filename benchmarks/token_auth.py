@@ -0,0 +1,51 @@
+"""
+Compare requests/second on a cheap endpoint (the cached /countries/ body)
+authenticated with DRF's TokenAuthentication and with
+CachedTokenAuthentication.
+
+    python -m benchmarks.token_auth --requests 2000
+"""
+
+import argparse
+
+from benchmarks import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework import authentication as rest_authentication
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    from app import authentication, views
+
+    timings = {}
+    with common.test_databases():
+        token = Token.objects.create(user=common.create_user())
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        for name, authentication_class in [
+            ("TokenAuthentication", rest_authentication.TokenAuthentication),
+            ("CachedTokenAuthentication", authentication.CachedTokenAuthentication),
+        ]:
+            views.CountryListView.authentication_classes = [authentication_class]
+            assert client.get("/api/v1/countries/").status_code == 200
+            with common.timer(timings, name):
+                for _ in range(args.requests):
+                    client.get("/api/v1/countries/")
+
+    rows = [("authentication", "seconds", "requests/s")]
+    for name, seconds in timings.items():
+        rows.append((name, f"{seconds:.2f}", f"{args.requests / seconds:.0f}"))
+    common.report(f"{args.requests} GET /api/v1/countries/", rows)
+    print(
+        f"speedup {timings['TokenAuthentication'] / timings['CachedTokenAuthentication']:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
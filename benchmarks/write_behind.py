@@ -0,0 +1,121 @@
+"""
+Latency of POST /api/v1/sales/ under a burst of writers, saving each sale
+during its request and through the write-behind queue (``SALE_QUEUE_PATH``),
+on the tuned SQLite profile (``huy.settings_sqlite``).
+
+With the queue, a ``drain_sale_queue`` process saves the queued sales while
+the writers run; the time it takes to catch up afterwards is reported too.
+Requests failing with "database is locked" are counted as errors.
+
+    python -m benchmarks.write_behind --writers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks import common
+
+
+def prepare():
+    common.setup("benchmarks.server_settings")
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+    return common.create_user().id
+
+
+def write(user_id, duration):
+    common.setup("benchmarks.server_settings")
+    from django.db import OperationalError
+    from rest_framework.test import APIClient
+
+    from app import models
+
+    client = APIClient(HTTP_HOST="127.0.0.1")
+    client.force_authenticate(models.User.objects.get(pk=user_id))
+    latencies, errors = [], 0
+    until = time.monotonic() + duration
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        try:
+            response = client.post(
+                "/api/v1/sales/",
+                {
+                    "date": "2010-01-01",
+                    "product": f"Product {len(latencies) % 10}",
+                    "sales_number": 1,
+                    "revenue": 1.5,
+                },
+            )
+            assert response.status_code in (201, 202), response.status_code
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def drain(stop):
+    common.setup("benchmarks.server_settings")
+    from app import sale_queue
+
+    while not stop.is_set():
+        if not sale_queue.drain():
+            time.sleep(0.05)
+    started = time.perf_counter()
+    while sale_queue.drain():
+        pass
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    # Fresh interpreters: Django must not be set up with another database
+    context = multiprocessing.get_context("spawn")
+    os.environ["BENCHMARK_BASE_SETTINGS"] = "huy.settings_sqlite"
+    rows = [("mode", "requests/s", "p50 ms", "p99 ms", "errors", "catch-up s")]
+    for mode in ("direct", "queued"):
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["BENCHMARK_DATABASE"] = os.path.join(directory, "db.sqlite3")
+            os.environ["SALE_QUEUE_PATH"] = (
+                os.path.join(directory, "queue.sqlite3") if mode == "queued" else ""
+            )
+            with context.Pool(1) as pool:
+                user_id = pool.apply(prepare)
+            with context.Manager() as manager, context.Pool(1) as drainer:
+                stop = manager.Event()
+                catch_up = (
+                    drainer.apply_async(drain, (stop,)) if mode == "queued" else None
+                )
+                with context.Pool(args.writers) as pool:
+                    results = pool.starmap(
+                        write, [(user_id, args.duration)] * args.writers
+                    )
+                stop.set()
+                catch_up = f"{catch_up.get():.2f}" if catch_up else "-"
+        latencies = sorted(latency for latencies, _ in results for latency in latencies)
+        percentiles = statistics.quantiles(latencies, n=100)
+        rows.append(
+            (
+                mode,
+                f"{len(latencies) / args.duration:.0f}",
+                f"{percentiles[49] * 1000:.1f}",
+                f"{percentiles[98] * 1000:.1f}",
+                sum(errors for _, errors in results),
+                catch_up,
+            )
+        )
+
+    common.report(f"{args.writers} writer processes, {args.duration}s", rows)
+
+
+if __name__ == "__main__":
+    main()
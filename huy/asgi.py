@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "huy.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "huy.settings_asgi")
 
-application = get_asgi_application()
+# As get_asgi_application(), with a handler streaming the exports off the
+# event loop, see app.asgi. The static files are served by WhiteNoise, see
+# huy.settings_asgi.
+django.setup(set_prefix=False)
+
+from app.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.middleware.PerformanceMiddleware",
+    "app.middleware.ReplicaReadMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -56,16 +58,84 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "app.middleware.TrafficRecordingMiddleware",
 ]
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.BasicAuthentication",
+        "app.authentication.CachedBasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "app.authentication.CachedTokenAuthentication",
     ),
 }
 
+# In-process cache of authentication tokens (app.authentication): maximum
+# entries and seconds they are kept, and how often, in seconds, a worker
+# checks the shared cache for invalidations published by other workers.
+# Without a shared cache, tokens are looked up on every request instead.
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+AUTH_TOKEN_CACHE_SYNC_INTERVAL = 1
+
+# Seconds successfully verified credentials (Basic auth, login) are cached,
+# sparing the password hash. A password change invalidates them.
+AUTH_CREDENTIAL_CACHE_TIMEOUT = 60
+
+# Threads running password checks off the request threads; 0 runs them
+# inline. At most PASSWORD_HASH_QUEUE_SIZE more checks wait for a thread,
+# for up to PASSWORD_HASH_QUEUE_TIMEOUT seconds, before answering 503.
+PASSWORD_HASH_POOL_SIZE = 0
+PASSWORD_HASH_QUEUE_SIZE = 16
+PASSWORD_HASH_QUEUE_TIMEOUT = 5
+
+# Default and maximum page size of the opt-in /sales/ keyset pagination
+SALE_PAGE_SIZE = 100
+SALE_MAX_PAGE_SIZE = 1000
+
+# Rows fetched per database round trip when streaming a sales export
+SALE_EXPORT_CHUNK_SIZE = 2000
+
+# Rows inserted per transaction and maximum rows per request of /sales/bulk/
+SALE_BULK_BATCH_SIZE = 500
+SALE_BULK_MAX_ROWS = 10000
+
+# SQLite file of the write-behind queue of new sales (app.sale_queue): when
+# set, POST /sales/ queues the sale and answers 202, and
+# `manage.py drain_sale_queue` saves the queued sales in batches of
+# SALE_BULK_BATCH_SIZE, and refuses to run without a shared cache (see
+# CACHES). Empty saves them during the request.
+SALE_QUEUE_PATH = os.environ.get("SALE_QUEUE_PATH", "")
+# Queued sales of one user, and of everyone, above which POST /sales/
+# answers 429 and 503, asking to retry after SALE_QUEUE_RETRY_AFTER seconds
+SALE_QUEUE_MAX_PENDING_PER_USER = 10000
+SALE_QUEUE_MAX_PENDING = 100000
+SALE_QUEUE_RETRY_AFTER = 5
+# Seconds the status of saved or rejected sales stays in the queue
+SALE_QUEUE_RETENTION = 24 * 60 * 60
+
+# Rows fetched per database round trip when loading the analytics snapshot
+SALE_SNAPSHOT_CHUNK_SIZE = 10000
+
+# Share of the requests PerformanceMiddleware measures, for the Server-Timing
+# header and /metrics/; 0 turns it off
+PERF_SAMPLE_RATE = 0.05
+# Send the Server-Timing header to every client, not only to staff users
+PERF_SERVER_TIMING = False
+# Directory shared by the workers of a server, where each saves its
+# histograms for /metrics/ to add them up; only those of the worker serving
+# the scrape are reported when empty. Deleting the files resets the metrics.
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(BASE_DIR, "metrics"))
+
+# JSONL file TrafficRecordingMiddleware appends every request to, for
+# `manage.py replay_traffic`; recording is off when empty. Request bodies
+# larger than TRAFFIC_RECORD_MAX_BODY bytes are left out.
+TRAFFIC_RECORD_FILE = os.environ.get("TRAFFIC_RECORD_FILE", "")
+TRAFFIC_RECORD_MAX_BODY = 64 * 1024
+
+# Serve the read-heavy endpoints with async views (see app.async_views); set
+# by the ASGI profile, huy.settings_asgi
+ASYNC_READ_VIEWS = False
+
 ROOT_URLCONF = "huy.urls"
 
 TEMPLATES = [
@@ -97,6 +167,54 @@ DATABASES = {
     }
 }
 
+# Pragmas run on every new SQLite connection (see app.signals); the tuned
+# values are in huy.settings_sqlite
+SQLITE_PRAGMAS = {}
+
+# Aliases of the databases the sales are spread over, by user (see
+# app.sharding); empty keeps them in "default". Set by huy.settings_sharded
+SALE_SHARDS = []
+
+# Database aliases mapped to the alias of their read replica (see
+# app.replicas); empty reads everything from the primaries. Set by
+# huy.settings_replica
+DATABASE_REPLICAS = {}
+
+# Seconds a replica may lag behind its primary and still be read from, and
+# for which a client that wrote reads from the primaries
+REPLICA_MAX_LAG = 30
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Shared by the gunicorn workers, and by the management commands writing
+# sales: the version counters of app.caching invalidate what every worker
+# cached. A cache private to each process, such as LocMemCache, only suits a
+# single worker; starting more (WEB_CONCURRENCY) with one fails.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CACHE_DIR", os.path.join(BASE_DIR, "cache")),
+        # Every set() lists the directory to cull it above MAX_ENTRIES.
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# Cache holding the version counters and values of app.caching
+VERSIONED_CACHE_ALIAS = "default"
+
+# Seconds the statistics shared by all users stay cached
+SALE_STATISTICS_CACHE_TIMEOUT = 60
+
+# Maximum number of products of /sale_statistics/leaderboard/
+SALE_LEADERBOARD_MAX_LIMIT = 100
+
+
+# Seconds the pre-rendered /countries/ body stays cached. Country and City
+# writes invalidate it right away, for every worker sharing the cache.
+COUNTRY_LIST_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -140,4 +258,7 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 AUTH_USER_MODEL = "app.User"
 
+# Gives every test run an empty cache, see huy.test_runner
+TEST_RUNNER = "huy.test_runner.TestRunner"
+
 APPEND_SLASH = True
@@ -0,0 +1,27 @@
+"""
+Settings for serving the project over ASGI, with uvicorn workers:
+
+    DJANGO_SETTINGS_MODULE=huy.settings_asgi \\
+        gunicorn huy.asgi:application -k uvicorn.workers.UvicornWorker
+
+A sync gunicorn worker is tied up by a client for the whole request, however
+slowly it sends or reads it; an uvicorn worker keeps serving other clients
+meanwhile.
+"""
+
+from huy.settings import *  # noqa: F401,F403
+
+ASYNC_READ_VIEWS = True
+
+# Synchronous middleware would make Django run every request through its
+# single thread for synchronous code: the middleware of huy.settings also
+# run asynchronously. The static files are served by WhiteNoise, as under
+# WSGI, through a subclass that does too.
+MIDDLEWARE = [
+    (
+        "app.middleware.AsyncWhiteNoiseMiddleware"
+        if middleware == "whitenoise.middleware.WhiteNoiseMiddleware"
+        else middleware
+    )
+    for middleware in MIDDLEWARE  # noqa: F405
+]
@@ -0,0 +1,31 @@
+"""
+Settings sending the reads of safe requests to a read replica of the
+database (see app.replicas), on top of the tuned SQLite profile:
+
+    DJANGO_SETTINGS_MODULE=huy.settings_replica gunicorn huy.wsgi
+    DJANGO_SETTINGS_MODULE=huy.settings_replica \\
+        python manage.py sync_replica --interval 5
+
+The replica is a copy of db.sqlite3 that sync_replica refreshes; reads move
+there from the primary, whose only readers left are the writing requests.
+Replicas older than REPLICA_MAX_LAG are not read from. Clients that wrote
+read from the primary until the next sync, which needs a cache shared by the
+server's workers (see CACHES): with a per-process cache, a client could miss
+its own writes when its next request lands on another worker. ETags come
+from the database the body is read from, so they never run ahead of it.
+"""
+
+import os
+
+from huy.settings_sqlite import *  # noqa: F401,F403
+
+DATABASES = {
+    **DATABASES,  # noqa: F405
+    "replica": {
+        **DATABASES["default"],  # noqa: F405
+        "NAME": os.path.join(BASE_DIR, "db_replica.sqlite3"),  # noqa: F405
+        "TEST": {"MIRROR": "default"},
+    },
+}
+DATABASE_REPLICAS = {"default": "replica"}
+DATABASE_ROUTERS = ["app.replicas.ReplicaRouter"]
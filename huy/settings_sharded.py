@@ -0,0 +1,38 @@
+"""
+Settings spreading the sales over SALE_SHARD_COUNT SQLite databases, by
+user (see app.sharding), on top of the tuned SQLite profile:
+
+    SALE_SHARD_COUNT=4 DJANGO_SETTINGS_MODULE=huy.settings_sharded \\
+        gunicorn huy.wsgi
+
+SQLite lets one writer at a time into a database; with sales in several
+databases, writers for users on different shards run in parallel. Every
+database needs migrating, and existing sales moving to their shard:
+
+    for db in default sales_0 sales_1 sales_2 sales_3; do
+        python manage.py migrate --database $db
+    done
+    python manage.py rebalance_sales
+
+Raising SALE_SHARD_COUNT later only moves users to the new shards, again
+with rebalance_sales. Removing shards is not supported.
+"""
+
+import os
+
+from huy.settings_sqlite import *  # noqa: F401,F403
+
+SALE_SHARDS = [
+    f"sales_{index}" for index in range(int(os.environ.get("SALE_SHARD_COUNT", 4)))
+]
+DATABASES = {
+    **DATABASES,  # noqa: F405
+    **{
+        alias: {
+            **DATABASES["default"],  # noqa: F405
+            "NAME": os.path.join(BASE_DIR, f"db_{alias}.sqlite3"),  # noqa: F405
+        }
+        for alias in SALE_SHARDS
+    },
+}
+DATABASE_ROUTERS = ["app.sharding.SaleShardRouter"]
@@ -0,0 +1,34 @@
+"""
+Settings for running on SQLite under concurrent load:
+
+    DJANGO_SETTINGS_MODULE=huy.settings_sqlite gunicorn huy.wsgi
+
+With the default rollback journal a writer locks out the readers, and a
+connection that finds the database locked fails at once with "database is
+locked". WAL lets readers and one writer work at the same time, and the busy
+timeout makes writers wait for each other instead of failing.
+"""
+
+from huy.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    "default": {
+        **DATABASES["default"],  # noqa: F405
+        # Reuse connections between requests, which also saves running the
+        # pragmas below for every request.
+        "CONN_MAX_AGE": 600,
+    }
+}
+
+SQLITE_PRAGMAS = {
+    # Persistent: stored in the database file
+    "journal_mode": "wal",
+    # In WAL mode, fsync at checkpoints only: a power loss can lose the last
+    # transactions but not corrupt the database.
+    "synchronous": "normal",
+    # Milliseconds to wait for a lock before failing
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative: in KiB, i.e. 64 MiB of page cache per connection
+    "cache_size": -64 * 1024,
+}
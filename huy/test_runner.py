@@ -0,0 +1,52 @@
+"""
+Test runner giving every run caches, and a metrics directory, of its own.
+
+The file-based caches of the settings outlive the test databases: values
+cached by a server, or by an earlier run, under versions the tests would
+read again, belong to other data. The metrics saved by a server would add
+up with those of the tests.
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+@contextlib.contextmanager
+def temporary_caches():
+    """
+    Move the file-based caches, and ``METRICS_DIR``, to an empty temporary
+    directory.
+    """
+    directory = tempfile.mkdtemp(prefix="huy-cache-")
+    caches = {
+        alias: (
+            {**cache, "LOCATION": os.path.join(directory, alias)}
+            if cache["BACKEND"].endswith(".FileBasedCache")
+            else cache
+        )
+        for alias, cache in settings.CACHES.items()
+    }
+    try:
+        with override_settings(
+            CACHES=caches, METRICS_DIR=os.path.join(directory, "metrics")
+        ):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = temporary_caches()
+        self._caches.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)